@@ -1,24 +1,32 @@
 """
 CAD File Conversion API
-Supports STEP, IGES to STL/OBJ conversion using OpenCASCADE
+Supports STEP, IGES, BREP to STL/OBJ/PLY/3MF conversion using OpenCASCADE
 """
 
 from fastapi import APIRouter, UploadFile, File, Form, HTTPException
-from fastapi.responses import StreamingResponse
+from fastapi.responses import FileResponse, StreamingResponse
+import asyncio
+import io
+import json
 import tempfile
 import os
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 import logging
-from typing import Literal
-import io
+from typing import List, Literal, Optional, Sequence
+
+from ..core.mesh_writers import MESH_FORMATS, write_mesh
+from ..loaders.cad_loader import BREP_FORMATS, load_cad_shape, sniff_cad_format
+from ..utils.artifact_cache import SHARED_URL, ArtifactCache, backend_from_url
+from ..utils.archive import ArchiveLimitExceeded, archive_kind, extract_models
+from ..utils.download import save_upload_to_temp, sha256_of_file
+from ..utils.tessellation_store import Tessellation, tessellation_store
+from ..workers.kernel_pool import KernelPool
 
 try:
-    from OCC.Core.STEPControl import STEPControl_Reader
-    from OCC.Core.IGESControl import IGESControl_Reader
-    from OCC.Core.StlAPI import StlAPI_Writer
-    from OCC.Core.BRepMesh import BRepMesh_IncrementalMesh
     from OCC.Core.BRepBuilderAPI import BRepBuilderAPI_Transform
-    from OCC.Extend.DataExchange import write_stl_file, write_obj_file
     from OCC.Core.gp import gp_Trsf, gp_Pnt
     from OCC.Core.Bnd import Bnd_Box
     from OCC.Core.BRepBndLib import brepbndlib_Add
@@ -30,212 +38,426 @@ except ImportError:
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
+# Triangle budget per quality preset, used when no explicit deflection is given
+QUALITY_TRIANGLE_BUDGETS = {"low": 50_000, "medium": 200_000, "high": 1_000_000}
+DEFAULT_ANGULAR_DEFLECTION = 0.1
+MAX_UPLOAD_BYTES = int(os.getenv("CAD_CONVERT_MAX_UPLOAD_BYTES", str(512 * 1024 * 1024)))
+MAX_BATCH_FILES = int(os.getenv("CAD_CONVERT_MAX_BATCH_FILES", "100"))
+# Kernel helpers for conversions; a batch converts this many files at once
+CONVERT_WORKERS = int(os.getenv("CAD_CONVERT_WORKERS", str(os.cpu_count() or 1)))
+CONVERSION_CACHE_DIR = Path(os.getenv("CAD_CONVERSION_CACHE_DIR", "/tmp/conversion-cache"))
+CONVERSION_CACHE_MAX_BYTES = int(os.getenv("CAD_CONVERSION_CACHE_MAX_BYTES", str(4 * 1024 ** 3)))
+# Bytes copied into the batch zip between yields to the response
+ZIP_CHUNK = 1 << 20
+OUTPUT_MEDIA_TYPES = {
+    "stl": "application/sla",
+    "obj": "text/plain",
+    "ply": "application/octet-stream",
+    "3mf": "model/3mf",
+}
+OutputFormat = Literal["stl", "obj", "ply", "3mf"]
+
+# Converted files by content address (source sha256, format, tessellation parameters)
+conversion_cache = ArtifactCache(CONVERSION_CACHE_DIR, CONVERSION_CACHE_MAX_BYTES, shared=backend_from_url(SHARED_URL))
+conversion_pool = KernelPool(size=CONVERT_WORKERS)
+
+
+class CADReadError(ValueError):
+    """The uploaded file could not be read as a CAD model."""
+
 
 @router.post("/convert")
 async def convert_cad_file(
     file: UploadFile = File(...),
-    output_format: Literal["stl", "obj"] = Form("stl"),
+    output_format: OutputFormat = Form("stl"),
     quality: Literal["low", "medium", "high"] = Form("medium"),
-    linear_deflection: float = Form(0.1),
-    angular_deflection: float = Form(0.1),
+    linear_deflection: Optional[float] = Form(None),
+    angular_deflection: Optional[float] = Form(None),
 ):
     """
-    Convert STEP/IGES files to STL/OBJ format
+    Convert STEP/IGES/BREP files to STL/OBJ/PLY/3MF format
     
     Args:
-        file: CAD file (STEP, STP, IGES, IGS)
-        output_format: Target format (stl or obj)
-        quality: Quality preset (low, medium, high)
-        linear_deflection: Linear deflection for tessellation (smaller = higher quality)
-        angular_deflection: Angular deflection for tessellation (smaller = higher quality)
+        file: CAD file (STEP, IGES or BREP; detected from content), optionally
+            gzip-compressed or in a single-model zip (STEPZ)
+        output_format: Target format (stl, obj, ply or 3mf)
+        quality: Quality preset (low, medium, high); sets the triangle budget
+        linear_deflection: Linear deflection for tessellation (smaller = higher quality);
+            overrides the quality budget
+        angular_deflection: Angular deflection for tessellation (default 0.1 with linear_deflection)
     
     Returns:
-        Converted file in requested format
+        Converted file in requested format; repeat conversions of the same
+        content and parameters are served from the conversion cache
     """
-    if not HAS_OCC:
-        raise HTTPException(
-            status_code=503,
-            detail="CAD conversion service unavailable. OpenCASCADE not installed."
-        )
-    
-    # Validate file extension
-    filename = file.filename.lower()
-    if not filename.endswith(('.step', '.stp', '.iges', '.igs')):
-        raise HTTPException(
-            status_code=400,
-            detail="Unsupported file format. Only STEP and IGES files are supported."
-        )
+    ensure_conversion_available()
     
+    started = time.perf_counter()
+    temp_paths = []
     try:
-        # Save uploaded file to temp directory
-        with tempfile.NamedTemporaryFile(delete=False, suffix=Path(filename).suffix) as temp_input:
-            content = await file.read()
-            temp_input.write(content)
-            temp_input_path = temp_input.name
-        
-        logger.info(f"Converting {filename} to {output_format} (quality: {quality})")
-        
-        # Read CAD file
-        shape = read_cad_file(temp_input_path)
-        
-        if shape is None:
+        models = await spool_models(file)
+        temp_paths = [path for _, path, _ in models]
+        if len(models) > 1:
             raise HTTPException(
                 status_code=400,
-                detail="Failed to read CAD file. File may be corrupted or invalid."
+                detail=f"Archive contains {len(models)} models; use /convert/batch"
             )
+        filename, temp_input_path, file_sha = models[0]
+        filename = filename.lower()
         
-        # Tessellate (convert to mesh)
-        mesh_shape(shape, linear_deflection, angular_deflection)
-        
-        # Convert to target format
-        output_buffer = io.BytesIO()
-        
-        if output_format == "stl":
-            write_stl_to_buffer(shape, output_buffer)
-            media_type = "application/sla"
-            filename_out = f"{Path(filename).stem}.stl"
-        else:  # obj
-            write_obj_to_buffer(shape, output_buffer)
-            media_type = "text/plain"
-            filename_out = f"{Path(filename).stem}.obj"
-        
-        # Cleanup
-        os.unlink(temp_input_path)
+        logger.info(f"Converting {filename} to {output_format} (quality: {quality})")
         
-        # Return as streaming response
-        output_buffer.seek(0)
+        output_path, cached = await asyncio.to_thread(
+            convert_cached, temp_input_path, file_sha, output_format, quality, linear_deflection, angular_deflection
+        )
+        filename_out = f"{Path(filename).stem}.{output_format}"
         
-        logger.info(f"Conversion complete: {filename} -> {filename_out}")
+        logger.info(f"Conversion complete: {filename} -> {filename_out} (cached: {cached})")
         
-        return StreamingResponse(
-            output_buffer,
-            media_type=media_type,
+        return FileResponse(
+            output_path,
+            media_type=OUTPUT_MEDIA_TYPES[output_format],
+            filename=filename_out,
             headers={
-                "Content-Disposition": f'attachment; filename="{filename_out}"',
-                "X-Conversion-Time": "calculated-by-backend",
-            }
+                "X-Conversion-Time": f"{time.perf_counter() - started:.3f}",
+                "X-Conversion-Cache": "hit" if cached else "miss",
+            },
         )
         
     except HTTPException:
         raise
+    except CADReadError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Conversion failed: {str(e)}", exc_info=True)
         raise HTTPException(
             status_code=500,
             detail=f"Conversion failed: {str(e)}"
         )
+    finally:
+        for path in temp_paths:
+            remove_quietly(path)
 
 
-def read_cad_file(file_path: str):
-    """Read STEP or IGES file and return shape"""
-    ext = Path(file_path).suffix.lower()
+@router.post("/convert/batch")
+async def convert_cad_batch(
+    files: List[UploadFile] = File(...),
+    output_format: OutputFormat = Form("stl"),
+    quality: Literal["low", "medium", "high"] = Form("medium"),
+    linear_deflection: Optional[float] = Form(None),
+    angular_deflection: Optional[float] = Form(None),
+):
+    """
+    Convert many STEP/IGES/BREP files in one request
     
+    gzip/zip uploads contribute every model inside them. Files are converted
+    in parallel kernel helper processes and streamed back
+    as a zip, each part added as soon as it is ready. ``manifest.json`` at the
+    end of the archive lists every input with its output name, or the error
+    if that file failed; one bad file does not fail the batch.
+    
+    Args:
+        files: CAD files (STEP, IGES or BREP)
+        output_format, quality, linear_deflection, angular_deflection: as for /convert
+    
+    Returns:
+        application/zip stream
+    """
+    ensure_conversion_available()
+    if len(files) > MAX_BATCH_FILES:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_FILES} files per batch")
+    inputs = []
+    rejected = []
     try:
-        if ext in ['.step', '.stp']:
-            reader = STEPControl_Reader()
-            status = reader.ReadFile(file_path)
-            
-            if status != 1:  # IFSelect_RetDone
-                logger.error(f"Failed to read STEP file: status {status}")
-                return None
-            
-            reader.TransferRoots()
-            shape = reader.OneShape()
-            
-        elif ext in ['.iges', '.igs']:
-            reader = IGESControl_Reader()
-            status = reader.ReadFile(file_path)
-            
-            if status != 1:  # IFSelect_RetDone
-                logger.error(f"Failed to read IGES file: status {status}")
-                return None
-            
-            reader.TransferRoots()
-            shape = reader.OneShape()
-            
-        else:
-            logger.error(f"Unsupported file extension: {ext}")
-            return None
-        
-        return shape
-        
-    except Exception as e:
-        logger.error(f"Error reading CAD file: {str(e)}", exc_info=True)
-        return None
+        for upload in files:
+            inputs.extend(await spool_models(upload, rejected))
+    except BaseException:
+        for _, path, _ in inputs:
+            remove_quietly(path)
+        raise
+    
+    logger.info(f"Converting batch of {len(inputs)} files to {output_format} (quality: {quality})")
+    
+    return StreamingResponse(
+        stream_batch_zip(inputs, output_format, quality, linear_deflection, angular_deflection, rejected),
+        media_type="application/zip",
+        headers={"Content-Disposition": 'attachment; filename="converted.zip"'},
+    )
 
 
-def mesh_shape(shape, linear_deflection: float, angular_deflection: float):
-    """
-    Tessellate shape (convert to triangular mesh)
-    
-    Args:
-        shape: OpenCASCADE shape
-        linear_deflection: Maximum distance between mesh and actual surface (mm)
-        angular_deflection: Maximum angular deviation (radians)
+def ensure_conversion_available():
+    if not HAS_OCC:
+        raise HTTPException(
+            status_code=503,
+            detail="CAD conversion service unavailable. OpenCASCADE not installed."
+        )
+
+
+async def spool_models(upload: UploadFile, rejected: Optional[List[dict]] = None) -> List[tuple]:
+    """Save an upload and return (filename, path, sha256) for each CAD model in it.
+
+    gzip/zip uploads are unpacked to scratch and the archive itself removed.
+    A plain upload must be STEP, IGES or BREP. Archive members that are not
+    (e.g. an STL kept next to the STEP) are dropped, and listed in
+    ``rejected`` as manifest error entries when it is given; an archive with
+    no B-rep model at all is rejected.
     """
+    filename = upload.filename or "part"
+    # Stream the upload to disk in chunks, hashing as it goes
     try:
-        # Create incremental mesh
-        mesh = BRepMesh_IncrementalMesh(
-            shape,
-            linear_deflection,
-            False,  # relative
-            angular_deflection,
-            True    # in parallel
+        path, file_sha = await save_upload_to_temp(
+            upload, suffix=Path(filename).suffix.lower(), max_bytes=MAX_UPLOAD_BYTES
         )
-        mesh.Perform()
-        
-        if not mesh.IsDone():
-            logger.warning("Mesh generation incomplete")
-        
-    except Exception as e:
-        logger.error(f"Meshing failed: {str(e)}", exc_info=True)
+    except ValueError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    if not archive_kind(path):
+        try:
+            validate_cad_file(path, filename)
+        except HTTPException:
+            remove_quietly(path)
+            raise
+        return [(filename, path, file_sha)]
+    try:
+        members = await asyncio.to_thread(extract_models, path, name=filename)
+    except ArchiveLimitExceeded as e:
+        raise HTTPException(status_code=413, detail=f"{filename}: {e}")
+    except (ValueError, OSError, zipfile.BadZipFile) as e:
+        raise HTTPException(status_code=400, detail=f"{filename}: {e}")
+    finally:
+        remove_quietly(path)
+    models = []
+    for member in members:
+        if sniff_cad_format(member.path) in BREP_FORMATS:
+            models.append((member.name, member.path))
+            continue
+        remove_quietly(member.path)
+        if rejected is not None:
+            rejected.append({"file": member.name, "error": unsupported_format_message(member.name)})
+    try:
+        if not models:
+            raise HTTPException(status_code=400, detail=f"{filename}: no STEP, IGES or BREP model in archive")
+        # Archive members are keyed by their own content
+        return [(name, model_path, await asyncio.to_thread(sha256_of_file, model_path)) for name, model_path in models]
+    except BaseException:
+        for _, model_path in models:
+            remove_quietly(model_path)
         raise
 
 
-def write_stl_to_buffer(shape, buffer: io.BytesIO):
-    """Write shape to STL format in buffer"""
+def unsupported_format_message(filename: Optional[str]) -> str:
+    return f"Unsupported file format: {filename}. Only STEP, IGES and BREP files are supported."
+
+
+def validate_cad_file(path: str, filename: Optional[str]):
+    """Reject uploads whose content is not STEP, IGES or BREP, whatever the extension."""
+    if sniff_cad_format(path) not in BREP_FORMATS:
+        raise HTTPException(status_code=400, detail=unsupported_format_message(filename))
+
+
+def remove_quietly(path: str):
     try:
-        # Create temporary file (StlAPI_Writer requires file path)
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.stl') as temp_file:
-            temp_path = temp_file.name
-        
-        # Write STL file
-        stl_writer = StlAPI_Writer()
-        stl_writer.SetASCIIMode(False)  # Binary STL is smaller
-        stl_writer.Write(shape, temp_path)
-        
-        # Read file into buffer
-        with open(temp_path, 'rb') as f:
-            buffer.write(f.read())
-        
-        # Cleanup
-        os.unlink(temp_path)
-        
-    except Exception as e:
-        logger.error(f"STL write failed: {str(e)}", exc_info=True)
-        raise
+        os.unlink(path)
+    except OSError:
+        pass
+
+
+def conversion_cache_name(
+    file_sha: str,
+    output_format: str,
+    quality: str,
+    linear_deflection: Optional[float] = None,
+    angular_deflection: Optional[float] = None,
+) -> str:
+    """Content address of a conversion: source sha256, format and tessellation parameters.
+
+    The quality preset only matters when no explicit deflection is given.
+    """
+    if linear_deflection is not None:
+        params = f"{linear_deflection:.6e}-{angular_deflection or DEFAULT_ANGULAR_DEFLECTION:.4f}"
+    else:
+        params = f"budget{QUALITY_TRIANGLE_BUDGETS[quality]}"
+    return f"{file_sha}-{params}.{output_format}"
 
 
-def write_obj_to_buffer(shape, buffer: io.BytesIO):
-    """Write shape to OBJ format in buffer"""
+def convert_to_cache(
+    input_path: str,
+    file_sha: str,
+    output_format: str,
+    quality: str,
+    linear_deflection: Optional[float] = None,
+    angular_deflection: Optional[float] = None,
+) -> str:
+    """Tessellate ``input_path`` and store the converted file in conversion_cache.
+
+    Runs in a kernel helper process. Returns the cache name.
+    """
+    def load_shape():
+        # Only called when the tessellation store has no usable mesh
+        shape = read_cad_file(input_path)
+        if shape is None:
+            raise CADReadError("Failed to read CAD file. File may be corrupted or invalid.")
+        return shape
+    
+    # Tessellate (convert to mesh), reusing analysis/viewer meshes of the same file
+    if linear_deflection is not None:
+        tessellation = tessellation_store.tessellate_at(
+            file_sha, load_shape, linear_deflection, angular_deflection or DEFAULT_ANGULAR_DEFLECTION
+        )
+    else:
+        tessellation, plan = tessellation_store.tessellate(file_sha, load_shape, QUALITY_TRIANGLE_BUDGETS[quality])
+        logger.info(f"Tessellated {file_sha} to {plan['triangles']} triangles ({plan['source']})")
+    
+    # Write next to the cache so storing it is a rename
+    name = conversion_cache_name(file_sha, output_format, quality, linear_deflection, angular_deflection)
+    conversion_cache.root.mkdir(parents=True, exist_ok=True)
+    fd, output_path = tempfile.mkstemp(dir=conversion_cache.root, prefix=f".{name}.")
+    os.close(fd)
     try:
-        # Create temporary file
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.obj') as temp_file:
-            temp_path = temp_file.name
-        
-        # Write OBJ file using OCC utility
-        write_obj_file(shape, temp_path)
-        
-        # Read file into buffer
-        with open(temp_path, 'rb') as f:
-            buffer.write(f.read())
-        
-        # Cleanup
-        os.unlink(temp_path)
+        write_mesh_file(tessellation, output_format, output_path)
+        conversion_cache.put_file(name, output_path)
+    finally:
+        remove_quietly(output_path)
+    return name
+
+
+def convert_cached(
+    input_path: str,
+    file_sha: str,
+    output_format: str,
+    quality: str,
+    linear_deflection: Optional[float] = None,
+    angular_deflection: Optional[float] = None,
+) -> tuple[Path, bool]:
+    """Local path of the converted file and whether it came from the cache.
+
+    Blocking; a miss runs convert_to_cache in a conversion_pool helper.
+    """
+    name = conversion_cache_name(file_sha, output_format, quality, linear_deflection, angular_deflection)
+    path = conversion_cache.path(name)
+    if path is not None:
+        return path, True
+    conversion_pool.run(
+        convert_to_cache, input_path, file_sha, output_format, quality, linear_deflection, angular_deflection
+    )
+    path = conversion_cache.path(name)
+    if path is None:
+        raise RuntimeError(f"Converted file {name} was evicted before it could be served")
+    return path, False
+
+
+class ZipStreamSink(io.RawIOBase):
+    """Non-seekable write target for zipfile; the response drains it between parts."""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def batch_arcname(filename: str, output_format: str, taken: set) -> str:
+    """Unique, directory-free name for a converted part inside the batch zip."""
+    stem = Path(filename).stem or "part"
+    arcname = f"{stem}.{output_format}"
+    n = 2
+    while arcname in taken:
+        arcname = f"{stem}-{n}.{output_format}"
+        n += 1
+    taken.add(arcname)
+    return arcname
+
+
+def _timed_conversion(*args) -> tuple[Path, bool, float]:
+    started = time.perf_counter()
+    path, cached = convert_cached(*args)
+    return path, cached, time.perf_counter() - started
+
+
+def stream_batch_zip(
+    inputs: List[tuple],
+    output_format: str,
+    quality: str,
+    linear_deflection: Optional[float] = None,
+    angular_deflection: Optional[float] = None,
+    rejected: Sequence[dict] = (),
+):
+    """Yield a zip of converted parts, adding each as soon as its conversion finishes.
+
+    ``inputs`` are (filename, temp path, sha256) tuples; the temp files are
+    removed once the stream ends. Identical uploads are converted once.
+    ``rejected`` entries (archive members that are not B-rep models) open the
+    manifest.
+    """
+    sink = ZipStreamSink()
+    executor = ThreadPoolExecutor(max_workers=conversion_pool.size)
+    jobs = {}
+    try:
+        members = {}
+        for filename, path, file_sha in inputs:
+            name = conversion_cache_name(file_sha, output_format, quality, linear_deflection, angular_deflection)
+            if name not in members:
+                members[name] = []
+                future = executor.submit(
+                    _timed_conversion, path, file_sha, output_format, quality, linear_deflection, angular_deflection
+                )
+                jobs[future] = name
+            members[name].append(filename)
         
+        manifest = list(rejected)
+        taken = set()
+        with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=1) as archive:
+            for future in as_completed(jobs):
+                filenames = members[jobs[future]]
+                try:
+                    path, cached, seconds = future.result()
+                except Exception as e:
+                    logger.error(f"Batch conversion failed for {filenames}: {e}")
+                    manifest.extend({"file": filename, "error": str(e)} for filename in filenames)
+                    continue
+                for filename in filenames:
+                    arcname = batch_arcname(filename, output_format, taken)
+                    try:
+                        source = open(path, "rb")
+                    except OSError as e:
+                        manifest.append({"file": filename, "error": f"Converted file unavailable: {e}"})
+                        continue
+                    zip64 = os.path.getsize(path) > zipfile.ZIP64_LIMIT
+                    with source, archive.open(arcname, "w", force_zip64=zip64) as dest:
+                        while chunk := source.read(ZIP_CHUNK):
+                            dest.write(chunk)
+                            yield sink.drain()
+                    manifest.append({"file": filename, "output": arcname, "cached": cached, "seconds": round(seconds, 3)})
+            archive.writestr("manifest.json", json.dumps(manifest, indent=2))
+        yield sink.drain()
+    finally:
+        # Running conversions still read their inputs; only queued ones are dropped
+        executor.shutdown(wait=True, cancel_futures=True)
+        for _, path, _ in inputs:
+            remove_quietly(path)
+
+
+def read_cad_file(file_path: str):
+    """Read a STEP, IGES or BREP file (format sniffed from content) and return shape"""
+    try:
+        return load_cad_shape(file_path)
     except Exception as e:
-        logger.error(f"OBJ write failed: {str(e)}", exc_info=True)
-        raise
+        logger.error(f"Error reading CAD file: {str(e)}", exc_info=True)
+        return None
+
+
+def write_mesh_file(tessellation: Tessellation, output_format: str, path: str):
+    """Write a tessellation to ``path`` in one of MESH_FORMATS"""
+    with open(path, "wb") as f:
+        write_mesh(tessellation.vertices, tessellation.faces, output_format, f)
 
 
 def get_bounding_box(shape):
@@ -263,7 +485,8 @@ async def health_check():
         "status": "healthy",
         "occ_available": HAS_OCC,
         "supported_formats": {
-            "input": ["step", "stp", "iges", "igs"],
-            "output": ["stl", "obj"]
-        }
+            "input": ["step", "stp", "iges", "igs", "brep", "brp"],
+            "output": list(MESH_FORMATS)
+        },
+        "cache": conversion_cache.stats(),
     }
@@ -0,0 +1,315 @@
+"""
+Offline bulk feature extraction for pricing-model training.
+
+Usage:
+  python -m app.cli extract <dir|manifest> --out <dataset dir> [--workers N]
+
+Builds the same feature vectors as cad_features /extract-features without
+an HTTP upload per file. The source is a directory tree (STEP, IGES and
+BREP files, by extension) or a manifest: a text file with one path per
+line, relative to the manifest, ``#`` starting a comment. Files run
+through app.core.features.timed_feature_extraction in a process pool. Each
+worker is a long-lived process handling one file at a time, so throughput
+scales with the number of cores.
+
+Rows go to shards in the output directory:
+
+- ``features-00000.parquet`` when pyarrow is installed, otherwise
+  ``features-00000.npz`` holding one array per column;
+- every shard has the columns in SCHEMA in the same order. These are the
+  identity and status columns followed by app.core.features.FEATURE_COLUMNS
+  as float64. Failed files keep their row, with NaN features and ``error``
+  set.
+
+After each shard is written, ``checkpoint.jsonl`` records it, the paths it
+holds and which of them failed. A re-run skips those paths and continues
+from the next shard, so an interrupted run can resume where it left off.
+With ``--retry-failed`` it extracts the failed paths again; their new rows
+land in a later shard and supersede the failed ones. Each checkpoint entry
+also records the SCHEMA it was written with. A dataset written with other
+columns is never resumed, so shards of one dataset always share a schema.
+"""
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from .core.features import FEATURE_COLUMNS, HAS_OCP, isolated_extraction, timed_feature_extraction
+from .loaders.cad_loader import BREP_FORMATS, format_for_extension
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    HAS_ARROW = True
+except ImportError:
+    HAS_ARROW = False
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_NAME = "checkpoint.jsonl"
+DEFAULT_SHARD_SIZE = 10_000
+# Restart each worker after this many files; bounds kernel memory growth
+DEFAULT_MAX_TASKS_PER_CHILD = 200
+# Files queued per worker, so a worker never waits for the parent to hand it the next one
+IN_FLIGHT_PER_WORKER = 4
+
+SCHEMA: Tuple[Tuple[str, str], ...] = (
+    ("path", "string"),
+    ("file_name", "string"),
+    ("format", "string"),
+    ("status", "string"),
+    ("error", "string"),
+    ("file_size_bytes", "int64"),
+    ("seconds", "float64"),
+) + tuple((name, "float64") for name in FEATURE_COLUMNS)
+SCHEMA_ID = hashlib.sha256(json.dumps(SCHEMA).encode()).hexdigest()[:16]
+
+
+def iter_corpus(source: str) -> Iterator[str]:
+    """Absolute paths of the files to extract from a directory tree or manifest."""
+    root = Path(source).resolve()
+    if root.is_dir():
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                if format_for_extension(filename) in BREP_FORMATS:
+                    yield os.path.join(dirpath, filename)
+        return
+    with open(root, encoding="utf-8") as manifest:
+        for line in manifest:
+            entry = line.split("#", 1)[0].strip()
+            if entry:
+                yield str((root.parent / entry).resolve())
+
+
+class Checkpoint:
+    """The shards written so far, the paths they hold and which of those failed."""
+
+    def __init__(self, out_dir: Path):
+        self.path = out_dir / CHECKPOINT_NAME
+        self.shards = 0
+        self.done: set[str] = set()
+        self.failed: set[str] = set()
+        if self.path.exists():
+            complete = 0  # byte offset just past the last complete entry
+            with open(self.path, "rb") as fh:
+                for line in fh:
+                    try:
+                        if not line.endswith(b"\n"):
+                            raise ValueError("no newline")
+                        entry = json.loads(line)
+                    except ValueError:
+                        break  # torn final line from an interrupted run
+                    if entry.get("schema") != SCHEMA_ID:
+                        raise RuntimeError(
+                            f"{out_dir} holds shards with a different feature schema; extract into a new --out directory"
+                        )
+                    self.shards += 1
+                    self._add(entry["paths"], entry.get("failed", []))
+                    complete += len(line)
+            if complete < self.path.stat().st_size:
+                # Drop the torn tail, or new entries would be appended onto it and never read back
+                os.truncate(self.path, complete)
+
+    def _add(self, paths: List[str], failed: List[str]) -> None:
+        failed_set = set(failed)
+        completed = [path for path in paths if path not in failed_set]
+        self.done.update(completed)
+        self.failed.difference_update(completed)
+        self.failed.update(failed_set - self.done)
+
+    def record(self, shard: str, paths: List[str], failed: List[str]) -> None:
+        with open(self.path, "a", encoding="utf-8") as fh:
+            entry = {"shard": shard, "schema": SCHEMA_ID, "rows": len(paths), "paths": paths, "failed": failed}
+            fh.write(json.dumps(entry) + "\n")
+            fh.flush()
+            os.fsync(fh.fileno())
+        self.shards += 1
+        self._add(paths, failed)
+
+
+def make_row(path: str, result: Dict) -> Dict:
+    features = result.get("features") or {}
+    try:
+        size = os.path.getsize(path)
+    except OSError:
+        size = -1
+    row = {
+        "path": path,
+        "file_name": os.path.basename(path),
+        "format": features.get("format", ""),
+        "status": "failed" if "error" in result else "completed",
+        "error": str(result.get("error", "")),
+        "file_size_bytes": size,
+        "seconds": float(result.get("seconds", 0.0)),
+    }
+    for name in FEATURE_COLUMNS:
+        row[name] = float(features.get(name, np.nan))
+    return row
+
+
+def write_shard(rows: List[Dict], out_dir: Path, index: int, fmt: str) -> str:
+    """Write ``rows`` as shard ``index`` and return its file name.
+
+    Written to a temporary name and renamed, so a shard file is never partial.
+    """
+    name = f"features-{index:05d}.{fmt}"
+    tmp_path = out_dir / f".{name}.tmp"
+    if fmt == "parquet":
+        types = {"string": pa.string(), "int64": pa.int64(), "float64": pa.float64()}
+        schema = pa.schema([(column, types[kind]) for column, kind in SCHEMA])
+        table = pa.Table.from_pydict({column: [row[column] for row in rows] for column, _ in SCHEMA}, schema=schema)
+        pq.write_table(table, tmp_path)
+    else:
+        dtypes = {"string": str, "int64": np.int64, "float64": np.float64}
+        arrays = {column: np.array([row[column] for row in rows], dtype=dtypes[kind]) for column, kind in SCHEMA}
+        with open(tmp_path, "wb") as fh:
+            np.savez_compressed(fh, **arrays)
+    os.replace(tmp_path, out_dir / name)
+    return name
+
+
+def _make_pool(workers: int, max_tasks_per_child: int) -> ProcessPoolExecutor:
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        max_tasks_per_child=max_tasks_per_child,
+    )
+
+
+def extract_all(paths: Iterable[str], workers: int, max_tasks_per_child: int) -> Iterator[Tuple[str, Dict]]:
+    """Yield (path, timed_feature_extraction result) in completion order.
+
+    Only a few files per worker are queued at a time, so a corpus of any
+    size is streamed. If a worker dies (a kernel crash), every file in
+    flight fails with it; each is then retried alone in a single-use worker,
+    so only the file that crashed is reported as failed, and a new pool
+    takes the rest.
+    """
+    pool = _make_pool(workers, max_tasks_per_child)
+    pending = iter(paths)
+    in_flight = {}
+    try:
+        while True:
+            for path in pending:
+                in_flight[pool.submit(timed_feature_extraction, path, os.path.basename(path))] = path
+                if len(in_flight) >= workers * IN_FLIGHT_PER_WORKER:
+                    break
+            if not in_flight:
+                return
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            broken = any(isinstance(future.exception(), BrokenProcessPool) for future in done)
+            if broken:
+                # Every other future of a broken pool fails too; collect them now
+                done = wait(in_flight)[0]
+            crashed = []
+            for future in done:
+                path = in_flight.pop(future)
+                try:
+                    yield path, future.result()
+                except BrokenProcessPool:
+                    crashed.append(path)
+            if broken:
+                pool.shutdown(wait=False)
+                with ThreadPoolExecutor(max_workers=workers) as retries:
+                    yield from zip(crashed, retries.map(
+                        lambda path: isolated_extraction(timed_feature_extraction, path, os.path.basename(path)),
+                        crashed,
+                    ))
+                pool = _make_pool(workers, max_tasks_per_child)
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def run_extraction(
+    source: str,
+    out_dir: str,
+    *,
+    workers: Optional[int] = None,
+    shard_size: int = DEFAULT_SHARD_SIZE,
+    max_tasks_per_child: int = DEFAULT_MAX_TASKS_PER_CHILD,
+    fmt: Optional[str] = None,
+    retry_failed: bool = False,
+) -> Dict:
+    """Extract features for every file in ``source`` not yet in ``out_dir``; returns run totals.
+
+    Paths that failed in an earlier run are skipped too unless ``retry_failed``.
+    """
+    if not HAS_OCP:
+        # Every file would fail and be checkpointed; refuse rather than fill a dataset with NaN
+        raise RuntimeError("OpenCascade (OCP) is not installed; nothing can be extracted")
+    fmt = fmt or ("parquet" if HAS_ARROW else "npz")
+    if fmt == "parquet" and not HAS_ARROW:
+        raise RuntimeError("Parquet output needs pyarrow; use --format npz")
+    out = Path(out_dir)
+    out.mkdir(parents=True, exist_ok=True)
+    checkpoint = Checkpoint(out)
+    skip = checkpoint.done if retry_failed else checkpoint.done | checkpoint.failed
+    todo = (path for path in iter_corpus(source) if path not in skip)
+
+    totals = {"files": 0, "failed": 0, "shards": 0, "skipped": len(skip)}
+    started = time.monotonic()
+    rows: List[Dict] = []
+
+    def flush() -> None:
+        shard = write_shard(rows, out, checkpoint.shards, fmt)
+        checkpoint.record(shard, [row["path"] for row in rows], [row["path"] for row in rows if row["status"] == "failed"])
+        totals["shards"] += 1
+        elapsed = time.monotonic() - started
+        logger.info(f"{shard}: {totals['files']} files in {elapsed:.0f}s ({totals['files'] / max(elapsed, 1e-9):.1f}/s)")
+        rows.clear()
+
+    for path, result in extract_all(todo, workers or os.cpu_count() or 1, max_tasks_per_child):
+        row = make_row(path, result)
+        rows.append(row)
+        totals["files"] += 1
+        totals["failed"] += row["status"] == "failed"
+        if len(rows) >= shard_size:
+            flush()
+    if rows:
+        flush()
+    totals["seconds"] = round(time.monotonic() - started, 3)
+    return totals
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.cli", description="CAD service offline tools")
+    commands = parser.add_subparsers(dest="command", required=True)
+    extract = commands.add_parser("extract", help="Extract training features from a CAD corpus")
+    extract.add_argument("source", help="Directory of STEP/IGES/BREP files, or a manifest of paths")
+    extract.add_argument("--out", required=True, help="Dataset directory (created; resumed if it exists)")
+    extract.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    extract.add_argument("--shard-size", type=int, default=DEFAULT_SHARD_SIZE)
+    extract.add_argument("--max-tasks-per-child", type=int, default=DEFAULT_MAX_TASKS_PER_CHILD)
+    extract.add_argument("--format", choices=("parquet", "npz"), help="Default: parquet if pyarrow is installed")
+    extract.add_argument("--retry-failed", action="store_true", help="Extract files that failed in an earlier run again")
+    args = parser.parse_args(argv)
+
+    totals = run_extraction(
+        args.source,
+        args.out,
+        workers=args.workers,
+        shard_size=args.shard_size,
+        max_tasks_per_child=args.max_tasks_per_child,
+        fmt=args.format,
+        retry_failed=args.retry_failed,
+    )
+    print(json.dumps(totals))
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
@@ -0,0 +1,323 @@
+"""
+Quadric-error-metric mesh decimation in pure NumPy.
+
+Used for GLB LODs when trimesh has no native simplification backend.
+
+Edges are scored with Garland-Heckbert quadrics: each face contributes an
+area-weighted plane quadric to its vertices. Boundary and feature (sharp
+dihedral) edges add heavily weighted constraint planes, which keeps outlines
+and CAD creases in place. Collapses run in rounds: every edge gets a cost
+and a priority rank, and a round collapses every edge that has the lowest
+rank in its two-ring. Those collapses touch disjoint faces, so a whole
+round can be applied with array operations. Collapses that would flip a face
+are rejected.
+
+Optional per-face labels (e.g. B-rep face ids) are carried through: label
+borders are constrained like feature edges, and every surviving triangle
+keeps its label.
+"""
+from __future__ import annotations
+
+import math
+from typing import Optional, Tuple
+
+import numpy as np
+
+# Dihedral angle above which an edge counts as a feature edge
+FEATURE_ANGLE_DEG = 45.0
+# Weight of boundary/feature constraint planes relative to face planes
+CONSTRAINT_WEIGHT = 1e3
+# Collapses that turn a surviving face by more than ~78 degrees are rejected
+FLIP_COS = 0.2
+# Collapses that shrink a surviving face below this fraction of its area are rejected
+SLIVER_RATIO = 1e-6
+SELECTION_PASSES = 4
+MAX_ROUNDS = 200
+MAX_STALLED_ROUNDS = 8
+
+
+def _plane_quadrics(normals: np.ndarray, points: np.ndarray, weights: np.ndarray) -> np.ndarray:
+    """Weighted quadrics (k, 4, 4) for planes through ``points`` with unit ``normals``."""
+    d = -np.einsum("ij,ij->i", normals, points)
+    p = np.concatenate([normals, d[:, None]], axis=1)
+    return weights[:, None, None] * p[:, :, None] * p[:, None, :]
+
+
+def _accumulate(target: np.ndarray, index: np.ndarray, quadrics: np.ndarray) -> None:
+    flat = quadrics.reshape(len(quadrics), 16)
+    for k in range(16):
+        target.reshape(-1, 16)[:, k] += np.bincount(index, weights=flat[:, k], minlength=len(target))
+
+
+def _face_normals(vertices: np.ndarray, faces: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """(unit normals, doubled areas) per face."""
+    tri = vertices[faces]
+    cross = np.cross(tri[:, 1] - tri[:, 0], tri[:, 2] - tri[:, 0])
+    norm = np.linalg.norm(cross, axis=1)
+    normals = np.divide(cross, norm[:, None], out=np.zeros_like(cross), where=norm[:, None] > 0)
+    return normals, norm
+
+
+def _edges(faces: np.ndarray, n_vertices: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Unique sorted edges, and for each face-edge its face index and unique-edge index."""
+    half = np.concatenate([faces[:, [0, 1]], faces[:, [1, 2]], faces[:, [2, 0]]])
+    half.sort(axis=1)
+    # 1-D keys sort far faster than np.unique(axis=0)
+    keys, inverse = np.unique(half[:, 0] * n_vertices + half[:, 1], return_inverse=True)
+    edges = np.stack([keys // n_vertices, keys % n_vertices], axis=1)
+    face_of = np.tile(np.arange(len(faces)), 3)
+    return edges, face_of, inverse.reshape(-1)
+
+
+def _vertex_quadrics(vertices: np.ndarray, faces: np.ndarray, labels: Optional[np.ndarray] = None) -> np.ndarray:
+    quadrics = np.zeros((len(vertices), 4, 4))
+    normals, doubled_area = _face_normals(vertices, faces)
+    face_q = _plane_quadrics(normals, vertices[faces[:, 0]], doubled_area / 2.0)
+    for corner in range(3):
+        _accumulate(quadrics, faces[:, corner], face_q)
+
+    # Constraint planes along boundary and feature edges
+    edges, face_of, edge_idx = _edges(faces, len(vertices))
+    valence = np.bincount(edge_idx, minlength=len(edges))
+    order = np.argsort(edge_idx, kind="stable")
+    starts = np.searchsorted(edge_idx[order], np.arange(len(edges)))
+    # First and (for manifold edges) second face-edge of every unique edge
+    first = order[starts]
+    two = valence == 2
+    second = np.full(len(edges), -1, dtype=np.int64)
+    second[two] = order[starts[two] + 1]
+
+    boundary = valence == 1
+    cos_limit = math.cos(math.radians(FEATURE_ANGLE_DEG))
+    feature = np.zeros(len(edges), dtype=bool)
+    feature[two] = np.einsum(
+        "ij,ij->i", normals[face_of[first[two]]], normals[face_of[second[two]]]
+    ) < cos_limit
+    if labels is not None:
+        feature[two] |= labels[face_of[first[two]]] != labels[face_of[second[two]]]
+
+    constrained = boundary | feature
+    if constrained.any():
+        sel = np.flatnonzero(constrained)
+        # One constraint plane per adjacent face for feature edges, one for boundary edges
+        halves = [first[sel]] + [second[sel][feature[sel]]]
+        edge_sel = np.concatenate([sel, sel[feature[sel]]])
+        face_sel = face_of[np.concatenate(halves)]
+        a, b = vertices[edges[edge_sel, 0]], vertices[edges[edge_sel, 1]]
+        direction = b - a
+        length = np.linalg.norm(direction, axis=1)
+        plane_n = np.cross(direction, normals[face_sel])
+        plane_len = np.linalg.norm(plane_n, axis=1)
+        ok = plane_len > 0
+        plane_n = plane_n[ok] / plane_len[ok, None]
+        weights = CONSTRAINT_WEIGHT * length[ok] ** 2
+        cq = _plane_quadrics(plane_n, a[ok], weights)
+        _accumulate(quadrics, edges[edge_sel[ok], 0], cq)
+        _accumulate(quadrics, edges[edge_sel[ok], 1], cq)
+    return quadrics
+
+
+def _quadric_error(q: np.ndarray, points: np.ndarray) -> np.ndarray:
+    h = np.concatenate([points, np.ones((len(points), 1))], axis=1)
+    return np.einsum("ij,ij->i", h, np.einsum("ijk,ik->ij", q, h))
+
+
+def _collapse_targets(vertices: np.ndarray, quadrics: np.ndarray, edges: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Best position and error for collapsing each edge."""
+    q = quadrics[edges[:, 0]] + quadrics[edges[:, 1]]
+    va, vb = vertices[edges[:, 0]], vertices[edges[:, 1]]
+    candidates = [va, vb, (va + vb) / 2.0]
+
+    # Solve A x = -b for the quadric minimum via the adjugate (batched, no LinAlgError)
+    a = q[:, :3, :3]
+    c0, c1, c2 = (np.cross(a[:, 1], a[:, 2]), np.cross(a[:, 2], a[:, 0]), np.cross(a[:, 0], a[:, 1]))
+    det = np.einsum("ij,ij->i", a[:, 0], c0)
+    scale = np.abs(a).sum(axis=(1, 2)) ** 3 + 1e-300
+    solvable = np.abs(det) > 1e-9 * scale
+    optimal = candidates[2].copy()
+    if solvable.any():
+        inverse = np.stack([c0[solvable], c1[solvable], c2[solvable]], axis=2) / det[solvable, None, None]
+        solved = -np.einsum("ijk,ik->ij", inverse, q[solvable, :3, 3])
+        # Keep the optimum near the edge so badly conditioned systems cannot throw vertices away
+        reach = np.linalg.norm(vb[solvable] - va[solvable], axis=1)
+        near = np.linalg.norm(solved - candidates[2][solvable], axis=1) <= reach
+        idx = np.flatnonzero(solvable)[near]
+        optimal[idx] = solved[near]
+    candidates.append(optimal)
+
+    errors = np.stack([_quadric_error(q, c) for c in candidates], axis=1)
+    best = np.argmin(errors, axis=1)
+    positions = np.stack(candidates, axis=1)[np.arange(len(edges)), best]
+    return positions, errors[np.arange(len(edges)), best]
+
+
+def _compact(vertices: np.ndarray, faces: np.ndarray, *extra: np.ndarray):
+    used = np.zeros(len(vertices), dtype=bool)
+    used[faces.reshape(-1)] = True
+    remap = np.cumsum(used) - 1
+    return (vertices[used], remap[faces]) + tuple(arr[used] for arr in extra)
+
+
+def _independent_collapses(edges: np.ndarray, rank: np.ndarray, faces: np.ndarray, n: int) -> np.ndarray:
+    """Indices of edges that can all be collapsed at once, cheapest first.
+
+    An edge qualifies when it has the lowest rank of every edge touching the
+    faces around either endpoint; two such edges never share a face, so their
+    collapses (and flip checks) are independent. Further passes fill in
+    around the edges already taken.
+    """
+    big = np.iinfo(np.int64).max
+    available = np.ones(len(edges), dtype=bool)
+    selected = []
+    for _ in range(SELECTION_PASSES):
+        live = np.where(available, rank, big)
+        vmin = np.full(n, big, dtype=np.int64)
+        np.minimum.at(vmin, edges[:, 0], live)
+        np.minimum.at(vmin, edges[:, 1], live)
+        fmin = vmin[faces].min(axis=1)
+        ring_min = np.full(n, big, dtype=np.int64)
+        for corner in range(3):
+            np.minimum.at(ring_min, faces[:, corner], fmin)
+        chosen = np.flatnonzero(
+            available & (ring_min[edges[:, 0]] == rank) & (ring_min[edges[:, 1]] == rank)
+        )
+        if len(chosen) == 0:
+            break
+        selected.append(chosen)
+        # Block every edge that shares a face neighbourhood with a chosen one
+        endpoint = np.zeros(n, dtype=bool)
+        endpoint[edges[chosen].reshape(-1)] = True
+        blocked = np.zeros(n, dtype=bool)
+        blocked[faces[endpoint[faces].any(axis=1)].reshape(-1)] = True
+        available &= ~(blocked[edges[:, 0]] | blocked[edges[:, 1]])
+    if not selected:
+        return np.zeros(0, dtype=np.int64)
+    chosen = np.concatenate(selected)
+    return chosen[np.argsort(rank[chosen])]
+
+
+def _link_condition(edges: np.ndarray, valence: np.ndarray, chosen: np.ndarray, n: int) -> np.ndarray:
+    """Mask of chosen edges whose endpoints share exactly the neighbours of their
+    adjacent faces; collapsing any other edge would pinch the surface into a
+    non-manifold shape.
+    """
+    ends = np.concatenate([edges[:, 0], edges[:, 1]])
+    others = np.concatenate([edges[:, 1], edges[:, 0]])
+    order = np.argsort(ends, kind="stable")
+    neighbours = others[order]
+    offsets = np.concatenate([[0], np.cumsum(np.bincount(ends, minlength=n))])
+
+    ids, nbrs = [], []
+    for column in (0, 1):
+        v = edges[chosen, column]
+        counts = offsets[v + 1] - offsets[v]
+        ids.append(np.repeat(np.arange(len(chosen)), counts))
+        # Position of every neighbour of every chosen endpoint in the CSR array
+        shift = offsets[v] - (np.cumsum(counts) - counts)
+        nbrs.append(neighbours[np.arange(counts.sum()) + np.repeat(shift, counts)])
+    keys = np.concatenate(ids) * n + np.concatenate(nbrs)
+    unique, counts = np.unique(keys, return_counts=True)
+    shared = np.bincount(unique[counts == 2] // n, minlength=len(chosen))
+    return shared == valence[chosen]
+
+
+def _collapse(faces: np.ndarray, vertices: np.ndarray, edges: np.ndarray, positions: np.ndarray, chosen: np.ndarray):
+    """Apply collapses: (remapped faces, degenerate-face mask, moved vertices)."""
+    keep, drop = edges[chosen, 0], edges[chosen, 1]
+    remap = np.arange(len(vertices))
+    remap[drop] = keep
+    new_vertices = vertices.copy()
+    new_vertices[keep] = positions[chosen]
+    new_faces = remap[faces]
+    degenerate = (
+        (new_faces[:, 0] == new_faces[:, 1])
+        | (new_faces[:, 1] == new_faces[:, 2])
+        | (new_faces[:, 2] == new_faces[:, 0])
+    )
+    return new_faces, degenerate, new_vertices
+
+
+def decimate(vertices: np.ndarray, faces: np.ndarray, target_faces: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Reduce a triangle mesh to roughly ``target_faces`` faces.
+
+    Returns new (vertices, faces) arrays; the input arrays are not modified.
+    Stops early if no further collapse is valid (e.g. the mesh is already minimal).
+    """
+    vertices, faces, _ = decimate_labeled(vertices, faces, np.zeros(len(faces), dtype=np.int64), target_faces)
+    return vertices, faces
+
+
+def decimate_labeled(
+    vertices: np.ndarray,
+    faces: np.ndarray,
+    labels: np.ndarray,
+    target_faces: int,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Like ``decimate``, for faces tagged with ``labels``.
+
+    Returns (vertices, faces, labels of the surviving faces).
+    """
+    vertices = np.asarray(vertices, dtype=np.float64).copy()
+    faces = np.asarray(faces, dtype=np.int64).copy()
+    labels = np.asarray(labels).copy()
+    if len(faces) <= target_faces:
+        return vertices, faces, labels
+
+    quadrics = _vertex_quadrics(vertices, faces, labels)
+    # Times a vertex's collapse was rejected; such edges go to the back of the
+    # queue so they stop blocking their neighbourhood
+    rejected = np.zeros(len(vertices), dtype=np.int64)
+    rng = np.random.default_rng(0)
+    stalled = 0
+    for _ in range(MAX_ROUNDS):
+        excess = len(faces) - target_faces
+        if excess <= 0 or stalled >= MAX_STALLED_ROUNDS:
+            break
+        n = len(vertices)
+        edges, _, edge_idx = _edges(faces, n)
+        positions, cost = _collapse_targets(vertices, quadrics, edges)
+        penalty = rejected[edges[:, 0]] + rejected[edges[:, 1]]
+        rank = np.empty(len(edges), dtype=np.int64)
+        # Random tie-breaking: flat regions have many zero-cost edges, and
+        # index-ordered ties leave very few local minima per round
+        rank[np.lexsort((rng.random(len(edges)), cost, penalty))] = np.arange(len(edges))
+
+        # Each interior collapse removes two faces; don't overshoot the target
+        chosen = _independent_collapses(edges, rank, faces, n)[: int(math.ceil(excess / 2.0))]
+        if len(chosen) == 0:
+            break
+        manifold = _link_condition(edges, np.bincount(edge_idx, minlength=len(edges)), chosen, n)
+        rejected[edges[chosen[~manifold]].reshape(-1)] += 1
+        chosen = chosen[manifold]
+        if len(chosen) == 0:
+            stalled += 1
+            continue
+        new_faces, degenerate, new_vertices = _collapse(faces, vertices, edges, positions, chosen)
+
+        # Reject collapses that flip (or collapse) any surviving face around them
+        moved = np.full(n, -1, dtype=np.int64)
+        moved[edges[chosen, 0]] = np.arange(len(chosen))
+        touched = np.flatnonzero((moved[new_faces] >= 0).any(axis=1) & ~degenerate)
+        before, before_area = _face_normals(vertices, faces[touched])
+        after, after_area = _face_normals(new_vertices, new_faces[touched])
+        # Near-zero areas count as collapsed: their normals are rounding noise
+        flipped = (np.einsum("ij,ij->i", before, after) < FLIP_COS) | (after_area <= before_area * SLIVER_RATIO)
+        if flipped.any():
+            owners = moved[new_faces[touched[flipped]]]
+            bad = np.zeros(len(chosen), dtype=bool)
+            bad[owners[owners >= 0]] = True
+            rejected[edges[chosen[bad]].reshape(-1)] += 1
+            chosen = chosen[~bad]
+            if len(chosen) == 0:
+                stalled += 1
+                continue
+            new_faces, degenerate, new_vertices = _collapse(faces, vertices, edges, positions, chosen)
+        stalled = 0
+
+        keep, drop = edges[chosen, 0], edges[chosen, 1]
+        quadrics[keep] += quadrics[drop]
+        rejected[keep] = 0
+        labels = labels[~degenerate]
+        vertices, faces, quadrics, rejected = _compact(new_vertices, new_faces[~degenerate], quadrics, rejected)
+
+    return vertices, faces, labels
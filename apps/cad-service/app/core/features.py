@@ -0,0 +1,270 @@
+"""
+Geometric feature vectors for ML pricing models, read with OpenCascade (OCP).
+
+Shared by the cad_features service (/extract-features, /batch-extract) and
+the offline ``python -m app.cli extract`` dataset builder, so both produce
+the same vector for the same file. Errors the caller should report as the
+file's result (unreadable or unsupported input, OCP missing) are raised as
+FeatureExtractionError.
+"""
+from __future__ import annotations
+
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, Optional
+
+try:
+    from OCP.STEPControl import STEPControl_Reader
+    from OCP.IGESControl import IGESControl_Reader
+    from OCP.TopExp import TopExp, TopExp_Explorer
+    from OCP.TopAbs import TopAbs_SOLID, TopAbs_SHELL, TopAbs_FACE, TopAbs_WIRE, TopAbs_EDGE, TopAbs_VERTEX
+    from OCP.TopTools import TopTools_IndexedMapOfShape
+    from OCP.BRepAdaptor import BRepAdaptor_Surface
+    from OCP.GeomAbs import (
+        GeomAbs_Plane, GeomAbs_Cylinder, GeomAbs_Cone, GeomAbs_Sphere, GeomAbs_Torus,
+        GeomAbs_BezierSurface, GeomAbs_BSplineSurface, GeomAbs_SurfaceOfRevolution,
+        GeomAbs_SurfaceOfExtrusion, GeomAbs_OffsetSurface,
+    )
+    from OCP.GProp import GProp_GProps
+    from OCP.BRepGProp import brepgprop
+    from OCP.BRepBndLib import brepbndlib
+    from OCP.Bnd import Bnd_Box
+    from OCP.BRep import BRep_Builder
+    from OCP.BRepTools import BRepTools
+    from OCP.BinTools import BinTools
+    from OCP.TopoDS import TopoDS, TopoDS_Shape
+    HAS_OCP = True
+except ImportError:
+    HAS_OCP = False
+
+from ..loaders.cad_loader import BREP_FORMATS, FORMAT_BY_EXT, sniff_cad_format
+
+WORKER_CRASHED = "Feature extraction worker crashed"
+
+
+class FeatureExtractionError(Exception):
+    """A file's features cannot be extracted; ``status_code`` is the HTTP status to answer with"""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def read_shape(file_path: str, fmt: Optional[str] = None):
+    """Read a STEP, IGES or BREP file; ``fmt`` defaults to the sniffed format"""
+    fmt = fmt or sniff_cad_format(file_path)
+    if fmt in ("step", "iges"):
+        reader = STEPControl_Reader() if fmt == "step" else IGESControl_Reader()
+        status = reader.ReadFile(file_path)
+        
+        if status != 1:  # IFSelect_RetDone
+            raise FeatureExtractionError(f"Failed to read {fmt.upper()} file")
+        
+        reader.TransferRoots()
+        return reader.OneShape()
+    if fmt == "brep":
+        shape = TopoDS_Shape()
+        if not BRepTools.Read_s(shape, file_path, BRep_Builder()) or shape.IsNull():
+            # Binary BREP
+            shape = TopoDS_Shape()
+            BinTools.Read_s(shape, file_path)
+        if shape.IsNull():
+            raise FeatureExtractionError("Failed to read BREP file")
+        return shape
+    raise FeatureExtractionError(f"Unsupported format: {fmt or 'unknown'}")
+
+
+def detect_format(file_path: str, hint: Optional[str] = None) -> str:
+    """B-rep format of a saved upload: sniffed from content, else the ``hint`` extension"""
+    fmt = sniff_cad_format(file_path)
+    if fmt is None and hint:
+        fmt = FORMAT_BY_EXT.get(f".{hint.lower()}")
+    if fmt not in BREP_FORMATS:
+        raise FeatureExtractionError(f"Unsupported format: {fmt or hint or 'unknown'}")
+    return fmt
+
+
+# Keys of extract_step_features, in order; the column schema of training datasets (app.cli)
+FEATURE_COLUMNS = (
+    'dim_x', 'dim_y', 'dim_z', 'max_dim', 'min_dim', 'dim_ratio',
+    'volume', 'surface_area', 'surface_to_volume_ratio',
+    'solid_count', 'face_count', 'edge_count',
+    'complexity_score',
+    'bbox_volume', 'bbox_utilization',
+    'centroid_x', 'centroid_y', 'centroid_z',
+    'shell_count', 'wire_count', 'vertex_count',
+    'surface_plane_count', 'surface_cylinder_count', 'surface_cone_count', 'surface_sphere_count',
+    'surface_torus_count', 'surface_bezier_count', 'surface_bspline_count', 'surface_revolution_count',
+    'surface_extrusion_count', 'surface_offset_count', 'surface_other_count',
+    'unique_edge_count',
+)
+SURFACE_KINDS = (
+    'plane', 'cylinder', 'cone', 'sphere', 'torus', 'bezier', 'bspline',
+    'revolution', 'extrusion', 'offset', 'other',
+)
+
+
+def topology_census(shape) -> Dict[str, int]:
+    """Sub-shape counts and a face surface-type histogram.
+
+    Solid, shell, face, wire and vertex counts, and ``unique_edge_count``, are
+    the sizes of indexed maps (one TopExp.MapShapes traversal per type, in
+    C++), so shared sub-shapes are counted once. ``edge_count`` keeps its
+    original meaning for the pricing models: edge occurrences, i.e. an edge
+    shared by two faces counts twice. It takes one explorer pass over the
+    edges. The histogram is a Python loop over the unique faces that reads
+    each surface type without computing UV bounds.
+    """
+    counts = {}
+    maps = {}
+    for name, kind in (
+        ('solid', TopAbs_SOLID), ('shell', TopAbs_SHELL), ('face', TopAbs_FACE),
+        ('wire', TopAbs_WIRE), ('edge', TopAbs_EDGE), ('vertex', TopAbs_VERTEX),
+    ):
+        maps[name] = TopTools_IndexedMapOfShape()
+        TopExp.MapShapes_s(shape, kind, maps[name])
+        counts[f'{name}_count'] = maps[name].Extent()
+    counts['unique_edge_count'] = counts['edge_count']
+
+    edge_occurrences = 0
+    explorer = TopExp_Explorer(shape, TopAbs_EDGE)
+    while explorer.More():
+        edge_occurrences += 1
+        explorer.Next()
+    counts['edge_count'] = edge_occurrences
+
+    surface_kinds = {
+        GeomAbs_Plane: 'plane', GeomAbs_Cylinder: 'cylinder', GeomAbs_Cone: 'cone',
+        GeomAbs_Sphere: 'sphere', GeomAbs_Torus: 'torus', GeomAbs_BezierSurface: 'bezier',
+        GeomAbs_BSplineSurface: 'bspline', GeomAbs_SurfaceOfRevolution: 'revolution',
+        GeomAbs_SurfaceOfExtrusion: 'extrusion', GeomAbs_OffsetSurface: 'offset',
+    }
+    histogram = dict.fromkeys(SURFACE_KINDS, 0)
+    faces = maps['face']
+    for i in range(1, faces.Extent() + 1):
+        surface_type = BRepAdaptor_Surface(TopoDS.Face_s(faces.FindKey(i)), False).GetType()
+        histogram[surface_kinds.get(surface_type, 'other')] += 1
+    for kind, count in histogram.items():
+        counts[f'surface_{kind}_count'] = count
+    return counts
+
+
+def extract_step_features(file_path: str, fmt: Optional[str] = None) -> Dict[str, Any]:
+    """Extract geometric features from a STEP, IGES or BREP file using OpenCascade"""
+    if not HAS_OCP:
+        raise FeatureExtractionError("OpenCascade not installed", status_code=500)
+    
+    shape = read_shape(file_path, fmt)
+    
+    # Extract basic properties
+    props = GProp_GProps()
+    brepgprop.VolumeProperties_s(shape, props)
+    
+    volume = props.Mass()
+    centroid = props.CentreOfMass()
+    
+    # Bounding box
+    bbox = Bnd_Box()
+    brepbndlib.Add_s(shape, bbox)
+    xmin, ymin, zmin, xmax, ymax, zmax = bbox.Get()
+    
+    dimensions = {
+        'x': xmax - xmin,
+        'y': ymax - ymin,
+        'z': zmax - zmin,
+    }
+    
+    # Count topology elements
+    census = topology_census(shape)
+    solid_count = census['solid_count']
+    face_count = census['face_count']
+    edge_count = census['edge_count']
+    
+    # Calculate complexity metrics
+    surface_area = 0.0
+    props_surf = GProp_GProps()
+    brepgprop.SurfaceProperties_s(shape, props_surf)
+    surface_area = props_surf.Mass()
+    
+    # Feature vector for ML (normalized)
+    features = {
+        # Dimensions
+        'dim_x': dimensions['x'],
+        'dim_y': dimensions['y'],
+        'dim_z': dimensions['z'],
+        'max_dim': max(dimensions.values()),
+        'min_dim': min(dimensions.values()),
+        'dim_ratio': max(dimensions.values()) / (min(dimensions.values()) + 0.001),
+        
+        # Volume and area
+        'volume': volume,
+        'surface_area': surface_area,
+        'surface_to_volume_ratio': surface_area / (volume + 0.001),
+        
+        # Topology counts (complexity indicators)
+        'solid_count': solid_count,
+        'face_count': face_count,
+        'edge_count': edge_count,
+        
+        # Complexity score (normalized)
+        'complexity_score': (face_count * 0.5 + edge_count * 0.3 + solid_count * 0.2) / 100.0,
+        
+        # Bounding box
+        'bbox_volume': dimensions['x'] * dimensions['y'] * dimensions['z'],
+        'bbox_utilization': volume / (dimensions['x'] * dimensions['y'] * dimensions['z'] + 0.001),
+        
+        # Centroid
+        'centroid_x': centroid.X(),
+        'centroid_y': centroid.Y(),
+        'centroid_z': centroid.Z(),
+        
+        # Remaining topology counts
+        'shell_count': census['shell_count'],
+        'wire_count': census['wire_count'],
+        'vertex_count': census['vertex_count'],
+        
+        # Surface-type histogram
+        **{f'surface_{kind}_count': census[f'surface_{kind}_count'] for kind in SURFACE_KINDS},
+        
+        # Edges shared by two faces counted once (edge_count counts each occurrence)
+        'unique_edge_count': census['unique_edge_count'],
+    }
+    
+    return features
+
+
+def timed_feature_extraction(file_path: str, file_name: str) -> Dict[str, Any]:
+    """Pool worker: features for one saved upload, or its error, with the time taken.
+
+    Errors are returned rather than raised so one bad file never fails the batch.
+    """
+    started = time.monotonic()
+    try:
+        fmt = detect_format(file_path, os.path.splitext(file_name)[1].lstrip('.') or None)
+        features = extract_step_features(file_path, fmt)
+        features['file_name'] = file_name
+        features['file_size_bytes'] = os.path.getsize(file_path)
+        features['format'] = fmt
+        result = {"features": features}
+    except FeatureExtractionError as e:
+        result = {"error": str(e)}
+    except Exception as e:
+        result = {"error": f"Feature extraction failed: {str(e)}"}
+    result["seconds"] = round(time.monotonic() - started, 3)
+    return result
+
+
+def isolated_extraction(extract: Callable[[str, str], Dict[str, Any]], file_path: str, file_name: str) -> Dict[str, Any]:
+    """Run ``extract`` (timed_feature_extraction) in a single-use worker process.
+
+    Used to retry files whose pool broke under them: a crash here can only be
+    this file's, and is reported as its error.
+    """
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+        try:
+            return pool.submit(extract, file_path, file_name).result()
+        except BrokenProcessPool:
+            return {"error": WORKER_CRASHED, "seconds": 0.0}
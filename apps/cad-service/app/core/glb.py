@@ -0,0 +1,267 @@
+"""
+Compact GLB encoding for viewer meshes.
+
+``encode_quantized_glb`` writes a GLB using
+KHR_mesh_quantization:
+
+- positions are SHORT normalized relative to the mesh bounds, with the
+  dequantization (uniform scale + translation) carried on the node so normals
+  stay correct;
+- normals are BYTE normalized;
+- triangles are reordered along a Morton curve and vertices renumbered in
+  first-use order, which keeps the GPU vertex cache warm and makes the index
+  buffer compress well;
+- large meshes are split into spatially coherent primitives of at most 65535
+  vertices each, so every index buffer is uint16.
+
+Byte-level compression is left to the HTTP layer (gzip Content-Encoding),
+which browsers decode transparently.
+
+Meshes tessellated from B-rep carry a source face id per triangle. Those
+triangles are grouped by face id (Morton order within a face), and each
+primitive lists its faces as consecutive triangle runs in the optional
+``CAD_brep_faces`` extension::
+
+    "extensions": {"CAD_brep_faces": {"faceIds": [3, 7, ...], "triangleCounts": [120, 44, ...]}}
+
+Face ``faceIds[i]`` covers ``triangleCounts[i]`` triangles, starting where
+run ``i - 1`` ended. The ids use the same numbering as the DFM
+``highlights.face_ids``, so the viewer can highlight a finding by drawing a
+sub-range of the index buffer. ``add_face_ranges`` adds the same extension to
+a single-primitive GLB whose triangles are already grouped by face id.
+"""
+from __future__ import annotations
+
+import json
+import struct
+from typing import Optional, Tuple
+
+import numpy as np
+
+GLB_MAGIC = 0x46546C67
+GLB_VERSION = 2
+CHUNK_JSON = 0x4E4F534A
+CHUNK_BIN = 0x004E4942
+
+SHORT, UNSIGNED_SHORT, BYTE = 5122, 5123, 5120
+ARRAY_BUFFER, ELEMENT_ARRAY_BUFFER = 34962, 34963
+QUANTIZATION_EXTENSION = "KHR_mesh_quantization"
+FACE_RANGES_EXTENSION = "CAD_brep_faces"
+
+MORTON_BITS = 10
+MAX_PRIMITIVE_VERTICES = 0xFFFF
+
+
+def _spread_bits(values: np.ndarray) -> np.ndarray:
+    """Interleave two zero bits between each of the low 10 bits of ``values``."""
+    v = values.astype(np.uint32) & 0x3FF
+    v = (v | (v << 16)) & 0x030000FF
+    v = (v | (v << 8)) & 0x0300F00F
+    v = (v | (v << 4)) & 0x030C30C3
+    v = (v | (v << 2)) & 0x09249249
+    return v
+
+
+def cache_friendly_order(
+    vertices: np.ndarray,
+    faces: np.ndarray,
+    face_ids: Optional[np.ndarray] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Reorder for vertex-cache locality.
+
+    Returns (vertex order, faces renumbered against that order): triangles
+    follow a Morton curve through their centroids and vertices are numbered
+    by first use in the new triangle order. With ``face_ids`` the triangles
+    are grouped by id first, in ascending order (so the reordered ids are
+    ``np.sort(face_ids)``).
+    """
+    centroids = vertices[faces].mean(axis=1)
+    lo = centroids.min(axis=0)
+    span = np.maximum(centroids.max(axis=0) - lo, 1e-12)
+    cells = ((centroids - lo) / span * ((1 << MORTON_BITS) - 1)).astype(np.uint32)
+    codes = _spread_bits(cells[:, 0]) | (_spread_bits(cells[:, 1]) << 1) | (_spread_bits(cells[:, 2]) << 2)
+    if face_ids is None:
+        faces = faces[np.argsort(codes, kind="stable")]
+    else:
+        faces = faces[np.lexsort((codes, face_ids))]
+
+    flat = faces.reshape(-1)
+    used, first_use = np.unique(flat, return_index=True)
+    vertex_order = used[np.argsort(first_use)]
+    renumber = np.empty(len(vertices), dtype=np.int64)
+    renumber[vertex_order] = np.arange(len(vertex_order))
+    return vertex_order, renumber[faces]
+
+
+def split_for_uint16(faces: np.ndarray, limit: int = MAX_PRIMITIVE_VERTICES) -> list[slice]:
+    """Split consecutive triangles into runs that each use at most ``limit`` vertices."""
+    runs, start = [], 0
+    while start < len(faces):
+        # Largest end with few enough distinct vertices (binary search); a closed
+        # mesh has about two triangles per vertex
+        lo, hi = start + 1, min(len(faces), start + 4 * limit)
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            if np.count_nonzero(np.bincount(faces[start:mid].reshape(-1))) <= limit:
+                lo = mid
+            else:
+                hi = mid - 1
+        runs.append(slice(start, lo))
+        start = lo
+    return runs
+
+
+def _pad4(data: bytes, fill: bytes = b"\x00") -> bytes:
+    return data + fill * (-len(data) % 4)
+
+
+def face_ranges(sorted_face_ids: np.ndarray) -> dict:
+    """``CAD_brep_faces`` payload for triangles already grouped by face id."""
+    sorted_face_ids = np.asarray(sorted_face_ids)
+    if len(sorted_face_ids) == 0:
+        return {"faceIds": [], "triangleCounts": []}
+    starts = np.flatnonzero(np.r_[True, sorted_face_ids[1:] != sorted_face_ids[:-1]])
+    counts = np.diff(np.r_[starts, len(sorted_face_ids)])
+    return {
+        "faceIds": [int(x) for x in sorted_face_ids[starts]],
+        "triangleCounts": [int(x) for x in counts],
+    }
+
+
+def _pack_glb(gltf: dict, bin_chunk: bytes) -> bytes:
+    json_chunk = _pad4(json.dumps(gltf, separators=(",", ":")).encode(), b" ")
+    total = 12 + 8 + len(json_chunk) + 8 + len(bin_chunk)
+    return b"".join([
+        struct.pack("<III", GLB_MAGIC, GLB_VERSION, total),
+        struct.pack("<II", len(json_chunk), CHUNK_JSON),
+        json_chunk,
+        struct.pack("<II", len(bin_chunk), CHUNK_BIN),
+        bin_chunk,
+    ])
+
+
+def _use_extension(gltf: dict, name: str) -> None:
+    used = gltf.setdefault("extensionsUsed", [])
+    if name not in used:
+        used.append(name)
+
+
+def add_face_ranges(glb_bytes: bytes, sorted_face_ids: np.ndarray) -> bytes:
+    """Add ``CAD_brep_faces`` to a single-primitive GLB (e.g. a trimesh export)
+    whose triangles are already grouped by ``sorted_face_ids``.
+    """
+    magic, _, _ = struct.unpack_from("<III", glb_bytes, 0)
+    json_length, chunk_type = struct.unpack_from("<II", glb_bytes, 12)
+    if magic != GLB_MAGIC or chunk_type != CHUNK_JSON:
+        raise ValueError("Not a GLB file")
+    gltf = json.loads(glb_bytes[20:20 + json_length])
+    primitives = [p for mesh in gltf.get("meshes", []) for p in mesh["primitives"]]
+    if len(primitives) != 1:
+        raise ValueError(f"Expected one primitive, found {len(primitives)}")
+    primitives[0].setdefault("extensions", {})[FACE_RANGES_EXTENSION] = face_ranges(sorted_face_ids)
+    _use_extension(gltf, FACE_RANGES_EXTENSION)
+    rest = glb_bytes[20 + json_length:]
+    bin_chunk = b""
+    if len(rest) >= 8:
+        bin_length, _ = struct.unpack_from("<II", rest, 0)
+        bin_chunk = rest[8:8 + bin_length]
+    return _pack_glb(gltf, bin_chunk)
+
+
+def encode_quantized_glb(
+    vertices: np.ndarray,
+    faces: np.ndarray,
+    normals: Optional[np.ndarray] = None,
+    face_ids: Optional[np.ndarray] = None,
+) -> bytes:
+    """Encode a triangle mesh as a quantized GLB (see module docstring)."""
+    vertices = np.asarray(vertices, dtype=np.float64)
+    faces = np.asarray(faces, dtype=np.int64)
+    vertex_order, faces = cache_friendly_order(vertices, faces, face_ids)
+    sorted_face_ids = np.sort(face_ids) if face_ids is not None else None
+    vertices = vertices[vertex_order]
+    if normals is not None:
+        normals = np.asarray(normals, dtype=np.float64)[vertex_order]
+
+    lo, hi = vertices.min(axis=0), vertices.max(axis=0)
+    center = (lo + hi) / 2.0
+    # Uniform scale keeps the node transform conformal, so normals need no correction
+    scale = max(float((hi - lo).max()) / 2.0, 1e-12)
+    positions = np.round((vertices - center) / scale * 32767.0).clip(-32767, 32767).astype(np.int16)
+    normal_values = None
+    if normals is not None:
+        normal_values = np.round(normals * 127.0).clip(-127, 127).astype(np.int8)
+
+    buffer_views, accessors, primitives = [], [], []
+    blob = bytearray()
+
+    def add_view(data: bytes, target: int, stride: Optional[int] = None) -> int:
+        view = {"buffer": 0, "byteOffset": len(blob), "byteLength": len(data), "target": target}
+        if stride:
+            view["byteStride"] = stride
+        blob.extend(_pad4(data))
+        buffer_views.append(view)
+        return len(buffer_views) - 1
+
+    for run in split_for_uint16(faces):
+        used, local_faces = np.unique(faces[run], return_inverse=True)
+        chunk_positions = positions[used]
+        position_block = np.zeros((len(used), 4), dtype=np.int16)  # 8-byte stride
+        position_block[:, :3] = chunk_positions
+
+        attributes = {"POSITION": len(accessors) + 1}
+        accessors.append({
+            "bufferView": add_view(local_faces.astype(np.uint16).tobytes(), ELEMENT_ARRAY_BUFFER),
+            "componentType": UNSIGNED_SHORT,
+            "count": int(local_faces.size),
+            "type": "SCALAR",
+        })
+        accessors.append({
+            "bufferView": add_view(position_block.tobytes(), ARRAY_BUFFER, stride=8),
+            "componentType": SHORT,
+            "normalized": True,
+            "count": int(len(used)),
+            "type": "VEC3",
+            "min": [int(x) for x in chunk_positions.min(axis=0)],
+            "max": [int(x) for x in chunk_positions.max(axis=0)],
+        })
+        if normal_values is not None:
+            normal_block = np.zeros((len(used), 4), dtype=np.int8)  # 4-byte stride
+            normal_block[:, :3] = normal_values[used]
+            attributes["NORMAL"] = len(accessors)
+            accessors.append({
+                "bufferView": add_view(normal_block.tobytes(), ARRAY_BUFFER, stride=4),
+                "componentType": BYTE,
+                "normalized": True,
+                "count": int(len(used)),
+                "type": "VEC3",
+            })
+        primitive = {"attributes": attributes, "indices": attributes["POSITION"] - 1, "mode": 4}
+        if sorted_face_ids is not None:
+            primitive["extensions"] = {FACE_RANGES_EXTENSION: face_ranges(sorted_face_ids[run])}
+        primitives.append(primitive)
+
+    gltf = {
+        "asset": {"version": "2.0", "generator": "cad-service"},
+        "extensionsUsed": [QUANTIZATION_EXTENSION],
+        "extensionsRequired": [QUANTIZATION_EXTENSION],
+        "scene": 0,
+        "scenes": [{"nodes": [0]}],
+        "nodes": [{
+            "mesh": 0,
+            "translation": [float(x) for x in center],
+            "scale": [scale, scale, scale],
+        }],
+        "meshes": [{"primitives": primitives}],
+        "buffers": [{"byteLength": len(blob)}],
+        "bufferViews": buffer_views,
+        "accessors": accessors,
+    }
+    if sorted_face_ids is not None:
+        _use_extension(gltf, FACE_RANGES_EXTENSION)
+    return _pack_glb(gltf, bytes(blob))
+
+
+def encode_mesh(mesh, face_ids: Optional[np.ndarray] = None) -> bytes:
+    """Quantized GLB for a trimesh.Trimesh, including its vertex normals."""
+    return encode_quantized_glb(mesh.vertices, mesh.faces, np.asarray(mesh.vertex_normals), face_ids)
@@ -0,0 +1,124 @@
+"""
+Mesh file writers that serialize vertex/face arrays directly.
+
+Converted parts can reach millions of triangles, so nothing here builds a
+per-triangle Python object or goes through a kernel writer and temp file:
+
+- binary STL is a structured record array written with ``tobytes``;
+- binary little-endian PLY is the float32 vertex block plus a structured
+  face block;
+- OBJ and 3MF are text, formatted a chunk at a time with a single ``%``
+  over a repeated line template, which runs in C rather than per row.
+
+3MF is a zip package (OPC) holding one XML model, usually the smallest
+download of the four. Every writer works in chunks of WRITE_CHUNK rows, so
+peak memory stays bounded regardless of mesh size.
+"""
+from __future__ import annotations
+
+import zipfile
+from typing import BinaryIO
+
+import numpy as np
+
+MESH_FORMATS = ("stl", "obj", "ply", "3mf")
+# Vertices/triangles encoded per write
+WRITE_CHUNK = 1 << 18
+# 50-byte binary STL triangle record
+STL_RECORD = np.dtype([("normal", "<f4", (3,)), ("vertices", "<f4", (3, 3)), ("attributes", "<u2")])
+PLY_FACE = np.dtype([("count", "u1"), ("vertices", "<i4", (3,))])
+
+THREEMF_MODEL = "3D/3dmodel.model"
+THREEMF_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="model" ContentType="application/vnd.ms-package.3dmanufacturing-3dmodel+xml"/>'
+    "</Types>"
+)
+THREEMF_RELS = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    f'<Relationship Target="/{THREEMF_MODEL}" Id="rel0" '
+    'Type="http://schemas.microsoft.com/3dmanufacturing/2013/01/3dmodel"/>'
+    "</Relationships>"
+)
+
+
+def _format_rows(template: str, rows: np.ndarray) -> bytes:
+    """``template`` applied to every row of ``rows`` in one formatting call."""
+    return ((template * len(rows)) % tuple(rows.ravel().tolist())).encode("ascii")
+
+
+def write_stl(vertices: np.ndarray, faces: np.ndarray, fh: BinaryIO) -> None:
+    fh.write(b"cad-service binary STL".ljust(80, b" "))
+    fh.write(np.uint32(len(faces)).tobytes())
+    for start in range(0, len(faces), WRITE_CHUNK):
+        triangles = vertices[faces[start:start + WRITE_CHUNK]]
+        normals = np.cross(triangles[:, 1] - triangles[:, 0], triangles[:, 2] - triangles[:, 0])
+        lengths = np.linalg.norm(normals, axis=1, keepdims=True)
+        records = np.zeros(len(triangles), dtype=STL_RECORD)
+        records["normal"] = np.divide(normals, lengths, out=np.zeros_like(normals), where=lengths > 0)
+        records["vertices"] = triangles
+        fh.write(records.tobytes())
+
+
+def write_obj(vertices: np.ndarray, faces: np.ndarray, fh: BinaryIO) -> None:
+    for start in range(0, len(vertices), WRITE_CHUNK):
+        fh.write(_format_rows("v %.9g %.9g %.9g\n", vertices[start:start + WRITE_CHUNK]))
+    for start in range(0, len(faces), WRITE_CHUNK):
+        fh.write(_format_rows("f %d %d %d\n", faces[start:start + WRITE_CHUNK] + 1))
+
+
+def write_ply(vertices: np.ndarray, faces: np.ndarray, fh: BinaryIO) -> None:
+    header = (
+        "ply\n"
+        "format binary_little_endian 1.0\n"
+        f"element vertex {len(vertices)}\n"
+        "property float x\nproperty float y\nproperty float z\n"
+        f"element face {len(faces)}\n"
+        "property list uchar int vertex_indices\n"
+        "end_header\n"
+    )
+    fh.write(header.encode("ascii"))
+    for start in range(0, len(vertices), WRITE_CHUNK):
+        fh.write(vertices[start:start + WRITE_CHUNK].astype("<f4").tobytes())
+    for start in range(0, len(faces), WRITE_CHUNK):
+        chunk = faces[start:start + WRITE_CHUNK]
+        records = np.empty(len(chunk), dtype=PLY_FACE)
+        records["count"] = 3
+        records["vertices"] = chunk
+        fh.write(records.tobytes())
+
+
+def write_3mf(vertices: np.ndarray, faces: np.ndarray, fh: BinaryIO) -> None:
+    # Roughly 60 bytes of XML per vertex or triangle decides whether zip64 is needed
+    zip64 = 60 * (len(vertices) + len(faces)) > zipfile.ZIP64_LIMIT
+    with zipfile.ZipFile(fh, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=1) as package:
+        package.writestr("[Content_Types].xml", THREEMF_CONTENT_TYPES)
+        package.writestr("_rels/.rels", THREEMF_RELS)
+        with package.open(THREEMF_MODEL, "w", force_zip64=zip64) as model:
+            model.write(
+                b'<?xml version="1.0" encoding="UTF-8"?>\n'
+                b'<model unit="millimeter" xml:lang="en-US" '
+                b'xmlns="http://schemas.microsoft.com/3dmanufacturing/core/2015/02">'
+                b'<resources><object id="1" type="model"><mesh><vertices>'
+            )
+            for start in range(0, len(vertices), WRITE_CHUNK):
+                model.write(_format_rows('<vertex x="%.9g" y="%.9g" z="%.9g"/>', vertices[start:start + WRITE_CHUNK]))
+            model.write(b"</vertices><triangles>")
+            for start in range(0, len(faces), WRITE_CHUNK):
+                model.write(_format_rows('<triangle v1="%d" v2="%d" v3="%d"/>', faces[start:start + WRITE_CHUNK]))
+            model.write(b'</triangles></mesh></object></resources><build><item objectid="1"/></build></model>')
+
+
+WRITERS = {"stl": write_stl, "obj": write_obj, "ply": write_ply, "3mf": write_3mf}
+
+
+def write_mesh(vertices: np.ndarray, faces: np.ndarray, output_format: str, fh: BinaryIO) -> None:
+    """Serialize a triangle mesh to ``fh`` in one of MESH_FORMATS."""
+    try:
+        writer = WRITERS[output_format]
+    except KeyError:
+        raise ValueError(f"Unsupported mesh format: {output_format}") from None
+    writer(np.asarray(vertices, dtype=np.float64), np.asarray(faces, dtype=np.int64), fh)
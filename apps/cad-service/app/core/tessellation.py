@@ -0,0 +1,241 @@
+"""
+Triangle-budget tessellation for B-rep shapes.
+
+Fixed deflections scale badly with part size. A 2 m weldment meshed at
+0.05 mm produces millions of triangles, while a 5 mm pin meshed at the same
+value is visibly faceted. The controller here works in two passes instead:
+
+1. Mesh once at a coarse deflection relative to the bounding-box diagonal,
+   and count triangles on planar and curved faces separately.
+2. Pick the linear and angular deflection expected to land the whole part
+   near a triangle budget, and mesh again.
+
+``BRepMesh_IncrementalMesh`` is incremental, so the second pass only
+re-meshes faces whose coarse triangulation misses the new tolerance. Planar
+faces are only re-meshed where their boundary edges were refined.
+
+The count model assumes curved triangles follow chord height h: an edge of
+length l on radius R deviates by about l^2 / 8R, so the count scales as 1/h.
+Planar faces are taken as fixed. The angular deflection is tightened with
+sqrt(h), which keeps it from becoming the binding limit on large radii.
+
+``triangulation_arrays`` reads the result back per B-rep face, keeping each
+triangle's face id.
+"""
+from __future__ import annotations
+
+import math
+import os
+from itertools import chain
+from dataclasses import asdict, dataclass
+from typing import Optional
+
+import numpy as np
+
+DEFAULT_TRIANGLE_BUDGET = int(os.getenv("CAD_TESSELLATION_BUDGET", "200000"))
+# Coarse pass deflection, as a fraction of the bounding-box diagonal
+COARSE_DEFLECTION_RATIO = 2e-3
+COARSE_ANGULAR_DEFLECTION = 0.5
+# Never refine below this fraction of the diagonal, however large the budget
+MIN_DEFLECTION_RATIO = 1e-4
+MIN_ANGULAR_DEFLECTION = 0.05
+
+
+@dataclass
+class TessellationPlan:
+    linear_deflection: float
+    angular_deflection: float
+    diagonal: float
+    budget: int
+    coarse_triangles: int
+    estimated_triangles: int
+    coarse_deflection: Optional[float] = None
+    coarse_flat_triangles: int = 0
+    triangles: Optional[int] = None
+
+    def as_dict(self) -> dict:
+        return asdict(self)
+
+
+def plan_tessellation(
+    diagonal: float,
+    curved_triangles: int,
+    flat_triangles: int,
+    budget: int = DEFAULT_TRIANGLE_BUDGET,
+    coarse_deflection: Optional[float] = None,
+    finest: Optional[float] = None,
+) -> TessellationPlan:
+    """Deflections expected to bring a coarse mesh close to ``budget`` triangles.
+
+    ``curved_triangles`` and ``flat_triangles`` are the counts from a pass at
+    ``coarse_deflection`` (default: COARSE_DEFLECTION_RATIO of the diagonal).
+    The result is never coarser than that pass and never finer than
+    ``finest`` (default: MIN_DEFLECTION_RATIO of the diagonal).
+    """
+    diagonal = max(float(diagonal), 1e-9)
+    coarse = coarse_deflection or diagonal * COARSE_DEFLECTION_RATIO
+    finest = finest or diagonal * MIN_DEFLECTION_RATIO
+    available = budget - flat_triangles
+    if curved_triangles <= 0 or available <= curved_triangles:
+        linear = coarse
+    else:
+        linear = max(coarse * curved_triangles / available, min(finest, coarse))
+    scale = linear / coarse
+    angular = min(COARSE_ANGULAR_DEFLECTION, max(MIN_ANGULAR_DEFLECTION, COARSE_ANGULAR_DEFLECTION * math.sqrt(scale)))
+    return TessellationPlan(
+        linear_deflection=linear,
+        angular_deflection=angular,
+        diagonal=diagonal,
+        budget=budget,
+        coarse_triangles=curved_triangles + flat_triangles,
+        estimated_triangles=estimate_triangles(curved_triangles, flat_triangles, coarse, linear),
+        coarse_deflection=coarse,
+        coarse_flat_triangles=flat_triangles,
+    )
+
+
+def estimate_triangles(curved_triangles: int, flat_triangles: int, coarse_deflection: float, linear_deflection: float) -> int:
+    """Triangle count at ``linear_deflection``, from counts at ``coarse_deflection``."""
+    return flat_triangles + int(round(curved_triangles * coarse_deflection / linear_deflection))
+
+
+def finest_deflection(diagonal: float, finest_ratio: float = MIN_DEFLECTION_RATIO, finest_mm: Optional[float] = None) -> float:
+    finest = diagonal * finest_ratio
+    if finest_mm is not None:
+        finest = min(finest, finest_mm)
+    return finest
+
+
+def shape_diagonal(shape) -> float:
+    from OCC.Core.Bnd import Bnd_Box
+    from OCC.Core.BRepBndLib import brepbndlib
+
+    box = Bnd_Box()
+    brepbndlib.Add(shape, box)
+    xmin, ymin, zmin, xmax, ymax, zmax = box.Get()
+    return math.sqrt((xmax - xmin) ** 2 + (ymax - ymin) ** 2 + (zmax - zmin) ** 2)
+
+
+def count_triangles(shape) -> tuple[int, int]:
+    """(curved, planar) triangle counts of the shape's current triangulation."""
+    from OCC.Core.BRep import BRep_Tool
+    from OCC.Core.BRepAdaptor import BRepAdaptor_Surface
+    from OCC.Core.GeomAbs import GeomAbs_Plane
+    from OCC.Core.TopAbs import TopAbs_FACE
+    from OCC.Core.TopExp import TopExp_Explorer
+    from OCC.Core.TopLoc import TopLoc_Location
+    from OCC.Core.TopoDS import topods
+
+    curved = flat = 0
+    explorer = TopExp_Explorer(shape, TopAbs_FACE)
+    while explorer.More():
+        face = topods.Face(explorer.Current())
+        explorer.Next()
+        triangulation = BRep_Tool.Triangulation(face, TopLoc_Location())
+        if triangulation is None:
+            continue
+        if BRepAdaptor_Surface(face, False).GetType() == GeomAbs_Plane:
+            flat += triangulation.NbTriangles()
+        else:
+            curved += triangulation.NbTriangles()
+    return curved, flat
+
+
+def mesh_to_budget(
+    shape,
+    budget: int = DEFAULT_TRIANGLE_BUDGET,
+    *,
+    finest_ratio: float = MIN_DEFLECTION_RATIO,
+    finest_mm: Optional[float] = None,
+) -> TessellationPlan:
+    """Triangulate ``shape`` in place so it lands near ``budget`` triangles.
+
+    Refinement stops at ``finest_ratio`` of the diagonal, or at ``finest_mm``
+    if that is smaller (callers that need an absolute accuracy pass it).
+    """
+    from OCC.Core.BRepMesh import BRepMesh_IncrementalMesh
+
+    diagonal = max(shape_diagonal(shape), 1e-9)
+    coarse = diagonal * COARSE_DEFLECTION_RATIO
+    finest = finest_deflection(diagonal, finest_ratio, finest_mm)
+    BRepMesh_IncrementalMesh(shape, coarse, False, COARSE_ANGULAR_DEFLECTION, True).Perform()
+    curved, flat = count_triangles(shape)
+    plan = plan_tessellation(diagonal, curved, flat, budget, coarse_deflection=coarse, finest=finest)
+    if plan.linear_deflection < coarse:
+        BRepMesh_IncrementalMesh(shape, plan.linear_deflection, False, plan.angular_deflection, True).Perform()
+        curved, flat = count_triangles(shape)
+    plan.triangles = curved + flat
+    return plan
+
+
+def weld_vertices(vertices: np.ndarray, faces: np.ndarray, tolerance: float) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Merge vertices closer than ``tolerance``; returns (vertices, faces, kept-face mask)."""
+    grid = np.round(vertices / max(tolerance, 1e-12)).astype(np.int64)
+    _, first, inverse = np.unique(grid, axis=0, return_index=True, return_inverse=True)
+    faces = inverse.reshape(-1)[faces]
+    kept = (faces[:, 0] != faces[:, 1]) & (faces[:, 1] != faces[:, 2]) & (faces[:, 2] != faces[:, 0])
+    return vertices[first], faces[kept], kept
+
+
+def triangulation_arrays(shape) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """(vertices, faces, face_ids) of the shape's current triangulation.
+
+    ``face_ids`` is the 1-based TopExp.MapShapes face index of each triangle,
+    the numbering DFM highlights use. Faces are meshed separately, so their
+    shared edge nodes are welded back together.
+
+    Each face's nodes and triangles are read from the triangulation's node
+    and triangle arrays (MapNodeArray / MapTriangleArray). pythonOCC exposes
+    no buffer view of these arrays, so this is still one Python-level call
+    per node and per triangle; the values are streamed into preallocated
+    numpy arrays with np.fromiter. The face location is applied to all nodes
+    at once as a matrix product, rather than one gp_Pnt.Transformed per node.
+    """
+    from OCC.Core.BRep import BRep_Tool
+    from OCC.Core.TopAbs import TopAbs_FACE, TopAbs_REVERSED
+    from OCC.Core.TopExp import TopExp
+    from OCC.Core.TopLoc import TopLoc_Location
+    from OCC.Core.TopTools import TopTools_IndexedMapOfShape
+    from OCC.Core.TopoDS import topods
+
+    face_map = TopTools_IndexedMapOfShape()
+    TopExp.MapShapes(shape, TopAbs_FACE, face_map)
+
+    points, triangles, face_ids = [], [], []
+    offset = 0
+    for face_id in range(1, face_map.Size() + 1):
+        face = topods.Face(face_map.FindKey(face_id))
+        location = TopLoc_Location()
+        triangulation = BRep_Tool.Triangulation(face, location)
+        if triangulation is None or triangulation.NbTriangles() == 0:
+            continue
+        nodes = triangulation.MapNodeArray()
+        n_nodes = nodes.Length()
+        coords = np.fromiter(
+            chain.from_iterable(nodes.Value(i).Coord() for i in range(nodes.Lower(), nodes.Upper() + 1)),
+            dtype=np.float64,
+            count=3 * n_nodes,
+        ).reshape(n_nodes, 3)
+        if not location.IsIdentity():
+            trsf = location.Transformation()
+            matrix = np.array([[trsf.Value(row, col) for col in range(1, 5)] for row in range(1, 4)])
+            coords = coords @ matrix[:, :3].T + matrix[:, 3]
+        points.append(coords)
+        tri_array = triangulation.MapTriangleArray()
+        tris = np.fromiter(
+            chain.from_iterable(tri_array.Value(i).Get() for i in range(tri_array.Lower(), tri_array.Upper() + 1)),
+            dtype=np.int64,
+            count=3 * tri_array.Length(),
+        ).reshape(-1, 3) - 1 + offset
+        if face.Orientation() == TopAbs_REVERSED:
+            tris = tris[:, [0, 2, 1]]
+        triangles.append(tris)
+        face_ids.append(np.full(len(tris), face_id, dtype=np.int32))
+        offset += n_nodes
+    if not triangles:
+        raise ValueError("Shape produced no triangles")
+
+    vertices = np.concatenate(points)
+    diagonal = float(np.linalg.norm(vertices.max(axis=0) - vertices.min(axis=0)))
+    vertices, faces, kept = weld_vertices(vertices, np.concatenate(triangles), diagonal * 1e-9)
+    return vertices, faces, np.concatenate(face_ids)[kept]
@@ -0,0 +1,122 @@
+"""
+Format detection and one B-rep loader for STEP, IGES and OCC BREP files.
+
+Uploads and signed URLs often have no extension, or a misleading one (a
+storage key, ``.dat``, ``.txt``), so the format is read from the content:
+
+- STEP (ISO 10303-21) files open with ``ISO-10303-21;``;
+- IGES files are 80-column card images whose first card has ``S`` in column 73;
+- native OCC BREP files, text or binary, name "CASCADE Topology" in the header;
+- binary STL is exactly 84 + 50 * n bytes; ASCII STL opens with ``solid``.
+
+The extension is only used when the content matches none of these.
+``load_cad_shape`` picks the kernel reader from the detected format, so
+STEP, IGES and BREP go through the same analysis, viewer and conversion
+paths. Those paths key their caches (tessellation store, LOD sets,
+single-flight results) on the file's sha256, so they work unchanged for
+every format.
+"""
+from __future__ import annotations
+
+import os
+import struct
+from typing import Optional
+
+from .step_loader import load_step_shape, occ_available
+
+SNIFF_BYTES = 4096
+BREP_FORMATS = ("step", "iges", "brep")
+FORMAT_BY_EXT = {
+    ".step": "step",
+    ".stp": "step",
+    ".iges": "iges",
+    ".igs": "iges",
+    ".brep": "brep",
+    ".brp": "brep",
+    ".stl": "stl",
+}
+
+
+def format_for_extension(path: str) -> Optional[str]:
+    return FORMAT_BY_EXT.get(os.path.splitext(path)[1].lower())
+
+
+def sniff_cad_format(path: str) -> Optional[str]:
+    """Detect "step", "iges", "brep" or "stl" from the file's first bytes.
+
+    Falls back to the extension; None if neither identifies the file.
+    """
+    with open(path, "rb") as fh:
+        head = fh.read(SNIFF_BYTES)
+    size = os.path.getsize(path)
+    text = head.lstrip(b"\xef\xbb\xbf \t\r\n")
+    if text.startswith(b"ISO-10303-21"):
+        return "step"
+    if b"CASCADE Topology" in head[:256]:
+        return "brep"
+    # Binary STL headers may start with "solid" too, so check the size first
+    if len(head) >= 84 and 84 + 50 * struct.unpack("<I", head[80:84])[0] == size:
+        return "stl"
+    if text[:5].lower() == b"solid" and b"facet" in head:
+        return "stl"
+    first_card = head.split(b"\n", 1)[0].rstrip(b"\r")
+    if 73 <= len(first_card) <= 80 and first_card[72:73] == b"S":
+        return "iges"
+    return format_for_extension(path)
+
+
+def is_brep_file(path: str) -> bool:
+    return sniff_cad_format(path) in BREP_FORMATS
+
+
+def load_iges_shape(path: str):
+    """Return a TopoDS_Shape from an IGES file using pythonOCC."""
+    if not occ_available():
+        raise RuntimeError("pythonocc-core is not available in this environment")
+
+    from OCC.Core.IGESControl import IGESControl_Reader
+    from OCC.Core.IFSelect import IFSelect_RetDone
+
+    reader = IGESControl_Reader()
+    status = reader.ReadFile(path)
+    if status != IFSelect_RetDone:
+        raise RuntimeError("IGES read failed")
+    reader.TransferRoots()
+    return reader.OneShape()
+
+
+def load_brep_shape(path: str):
+    """Return a TopoDS_Shape from a native OCC BREP file (text or binary)."""
+    if not occ_available():
+        raise RuntimeError("pythonocc-core is not available in this environment")
+
+    from OCC.Core.BRep import BRep_Builder
+    from OCC.Core.BRepTools import breptools
+    from OCC.Core.TopoDS import TopoDS_Shape
+
+    shape = TopoDS_Shape()
+    if breptools.Read(shape, path, BRep_Builder()) and not shape.IsNull():
+        return shape
+    from OCC.Core.BinTools import binTools
+
+    shape = TopoDS_Shape()
+    binTools.Read(shape, path)
+    if shape.IsNull():
+        raise RuntimeError("BREP read failed")
+    return shape
+
+
+LOADERS = {"step": load_step_shape, "iges": load_iges_shape, "brep": load_brep_shape}
+
+
+def load_cad_shape(path: str, fmt: Optional[str] = None):
+    """Return a TopoDS_Shape from a STEP, IGES or BREP file.
+
+    ``fmt`` defaults to the sniffed format. Raises RuntimeError if OCC is not
+    available, the file is not a B-rep format, or it can't be read.
+    """
+    fmt = fmt or sniff_cad_format(path)
+    loader = LOADERS.get(fmt)
+    if loader is None:
+        raise RuntimeError(f"Not a STEP, IGES or BREP file (detected format: {fmt or 'unknown'})")
+    return loader(path)
@@ -1,15 +1,29 @@
+from contextlib import asynccontextmanager, suppress
+import asyncio
+
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 import os
 
 from .routers import analyze, gltf, health
 from .workers.celery import celery_app
+from .workers.webhooks import start_embedded_dispatcher
 from . import otel
 from . import logging_config
 
 # Initialize OpenTelemetry first
 otel_initialized = False
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Deliver webhooks that analysis tasks queue in the Redis outbox
+    dispatcher = start_embedded_dispatcher()
+    yield
+    if dispatcher is not None:
+        dispatcher.cancel()
+        with suppress(asyncio.CancelledError):
+            await dispatcher
+
 def create_app():
     global otel_initialized
     
@@ -18,7 +32,8 @@ def create_app():
         description="CAD analysis and conversion service for CNC Quote",
         version="1.0.0",
         docs_url="/docs",
-        redoc_url="/redoc"
+        redoc_url="/redoc",
+        lifespan=lifespan,
     )
 
     # Initialize observability (once)
@@ -1,11 +1,47 @@
-from fastapi import APIRouter, HTTPException
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict
+
+import httpx
+from celery import states
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
-from typing import Optional
+from typing import AsyncIterator, List, Optional
 
-from ..workers.celery import celery_app
-from ..utils.download import download_to_temp
+from ..workers.celery import celery_app, HEAVY_QUEUE
+from ..workers.memory import MemoryLimitExceeded, RssGuard, check_memory_limit
+from ..workers.kernel_pool import KernelPool, KernelTimeout, kernel_pool
+from ..workers.webhooks import enqueue_webhook
+from .gltf import enqueue_gltf_conversion
+from ..workers.task_status import (
+    MAX_BULK_IDS,
+    MAX_WAIT_S,
+    fetch_task_meta,
+    fetch_task_metas,
+    summarize_task_meta,
+    wait_for_task_meta,
+)
+from ..workers.cost_model import (
+    SYNC_BUDGET_S,
+    profile_file,
+    record_stage_timing,
+    route_for_profile,
+    route_for_source,
+)
+from ..utils.archive import archive_kind, extracted_models
+from ..utils.download import download_to_temp, download_to_temp_async, sha256_of_file
+from ..utils.singleflight import single_flight
+from ..utils.tessellation_store import tessellation_store
 from ..utils.units import scale_to_mm
-from ..loaders.step_loader import occ_available, load_step_shape, shape_mass_props, count_solids_and_compounds
+from ..utils.deadline import Deadline
+from ..loaders.step_loader import occ_available, shape_mass_props, count_solids_and_compounds
+from ..loaders.cad_loader import BREP_FORMATS, is_brep_file, load_cad_shape, sniff_cad_format
 from ..loaders.stl_loader import load_stl, mesh_mass_props
 from ..extractors.holes import extract_holes_from_shape
 from ..extractors.pockets import extract_pockets_from_shape
@@ -21,6 +57,21 @@ from ..core.validation import validate_geometry
 
 router = APIRouter()
 
+BATCH_MAX_ITEMS = int(os.getenv("CAD_BATCH_MAX_ITEMS", "500"))
+BATCH_DOWNLOAD_CONCURRENCY = int(os.getenv("CAD_BATCH_DOWNLOAD_CONCURRENCY", "16"))
+BATCH_TIMEOUT_S = float(os.getenv("CAD_BATCH_TIMEOUT_S", "1800"))
+# Directory mounted by both the API and the workers. When set, batch parts the
+# API already downloaded are handed over by path instead of fetched again.
+BATCH_STAGING_DIR = os.getenv("CAD_BATCH_STAGING_DIR")
+# Thickness analysis mesh: at most this many triangles, refined down to
+# 0.05 mm (or 1e-3 of the diagonal on small parts)
+ANALYSIS_TRIANGLE_BUDGET = int(os.getenv("CAD_ANALYSIS_TRIANGLE_BUDGET", "300000"))
+ANALYSIS_FINEST_DEFLECTION_MM = 0.05
+ANALYSIS_FINEST_RATIO = 1e-3
+# Kernel helpers for the models inside one zip bundle, analyzed side by side
+ARCHIVE_WORKERS = int(os.getenv("CAD_ARCHIVE_WORKERS", str(min(4, os.cpu_count() or 1))))
+archive_pool = KernelPool(size=ARCHIVE_WORKERS)
+
 class AnalysisRequest(BaseModel):
     file_id: str
     file_path: Optional[str] = None
@@ -28,20 +79,134 @@ class AnalysisRequest(BaseModel):
     units_hint: Optional[str] = None
     org_id: Optional[str] = None
     webhook_url: Optional[str] = None
+    deadline_ms: Optional[int] = None
+    # Also queue viewer GLB generation so the 3D preview is cached before it is opened
+    pregenerate_gltf: bool = False
 
 class AnalysisResponse(BaseModel):
     file_id: str
     metrics: dict
     task_id: Optional[str] = None
+    gltf_task_id: Optional[str] = None
+
+class BatchItem(BaseModel):
+    file_id: str
+    file_url: str
+    units_hint: Optional[str] = None
+
+class BatchAnalysisRequest(BaseModel):
+    items: List[BatchItem]
+    org_id: Optional[str] = None
+    units_hint: Optional[str] = None
+
+class TaskStatusRequest(BaseModel):
+    task_ids: List[str]
+
+class TaskStatusResponse(BaseModel):
+    results: dict
+
+_shape_cache: dict = {}
 
-def analyze_file_path(file_path: str, units_hint: Optional[str] = None) -> dict:
-    """Analyze a CAD file (STEP/STL) and return normalized metrics.
+def load_shape_cached(file_path: str, fmt: str):
+    """load_cad_shape, reusing the last shape this process loaded from the same file.
+
+    Analysis stages take a path rather than a shape so they can run in a
+    kernel helper; consecutive stages on one helper share the parsed shape.
+    """
+    st = os.stat(file_path)
+    key = (file_path, st.st_ino, st.st_size, st.st_mtime_ns, fmt)
+    shape = _shape_cache.get(key)
+    if shape is None:
+        shape = load_cad_shape(file_path, fmt)
+        _shape_cache.clear()
+        _shape_cache[key] = shape
+    return shape
+
+def brep_mass_props(file_path: str, fmt: str) -> dict:
+    """Stage: assembly check, volume, area and bounding box of a B-rep file."""
+    shape = load_shape_cached(file_path, fmt)
+    assembly_info = count_solids_and_compounds(shape)
+    if assembly_info.is_assembly:
+        return {"assembly_info": asdict(assembly_info)}
+    vol_mm3, area_mm2 = shape_mass_props(shape)
+    from OCC.Core.Bnd import Bnd_Box
+    from OCC.Core.BRepBndLib import brepbndlib
+    box = Bnd_Box()
+    # Use new static method syntax (pythonocc-core 7.7.1+)
+    brepbndlib.Add(shape, box)
+    return {"assembly_info": asdict(assembly_info), "volume_mm3": vol_mm3, "area_mm2": area_mm2, "bbox": box.Get()}
+
+def mesh_thickness(file_path: str, scale: float, samples: int) -> float:
+    """Stage: minimum wall thickness of an STL by ray casting (0 if none found)."""
+    mesh = load_stl(file_path, scale=scale)
+    return min_wall_mesh(mesh, samples=samples, threshold_mm=10.0).global_min_mm
+
+def brep_thickness(file_path: str, fmt: str, samples: int) -> tuple:
+    """Stage: minimum wall thickness of a B-rep file and the triangle count of its analysis mesh."""
+    import trimesh
+
+    # Fine mesh for accurate wall thickness detection, capped by a
+    # triangle budget so large parts stay predictable. Shared with
+    # the viewer and conversion through the tessellation store.
+    tessellation, _ = tessellation_store.tessellate(
+        sha256_of_file(file_path),
+        lambda: load_shape_cached(file_path, fmt),
+        ANALYSIS_TRIANGLE_BUDGET,
+        finest_ratio=ANALYSIS_FINEST_RATIO,
+        finest_mm=ANALYSIS_FINEST_DEFLECTION_MM,
+        # Ray casting needs the mesher's deflection guarantee, not a viewer decimation
+        allow_decimated=False,
+    )
+    temp_mesh = trimesh.Trimesh(vertices=tessellation.vertices, faces=tessellation.faces)
+    mw = min_wall_mesh(temp_mesh, samples=samples, threshold_mm=10.0)
+    return mw.global_min_mm, int(temp_mesh.faces.shape[0])
+
+def brep_feature_counts(file_path: str, fmt: str) -> tuple:
+    """Stage: number of holes and pockets in a B-rep file."""
+    shape = load_shape_cached(file_path, fmt)
+    return len(extract_holes_from_shape(shape)), len(extract_pockets_from_shape(shape))
+
+def run_stage(deadline: Deadline, stage: str, pool: KernelPool, func, *args):
+    """Run an optional analysis stage; None if it was skipped or failed.
+
+    Under a deadline the stage runs in a kernel helper limited to the
+    remaining budget: a stage still running at the deadline has its helper
+    killed and is reported as skipped. Without one it runs in-process (the
+    whole analysis is already inside a helper).
+    """
+    check_memory_limit()
+    if not deadline.allows(stage):
+        return None
+    try:
+        if deadline.bounded:
+            result = pool.run(func, *args, timeout=max(deadline.remaining(), 0.001))
+        else:
+            result = func(*args)
+    except KernelTimeout:
+        print(f"⚠️ {stage} stopped at the deadline")
+        deadline.skip(stage)
+        return None
+    except Exception as e:
+        print(f"⚠️ {stage} failed: {str(e)[:100]}")
+        deadline.fail(stage)
+        return None
+    deadline.done(stage)
+    return result
+
+def analyze_file_path(file_path: str, units_hint: Optional[str] = None, deadline_ms: Optional[int] = None, pool: KernelPool = kernel_pool) -> dict:
+    """Analyze a CAD file (STEP/IGES/BREP/STL) and return normalized metrics.
     Returns a dict matching previous mock structure to limit integration changes.
+
+    Stages run in priority order (mass props/bbox, thickness, features). With a
+    deadline_ms, stages that would start after the deadline are skipped, thickness
+    sampling is reduced to fit, and each optional stage runs in a ``pool`` helper
+    that is stopped at the deadline (see run_stage). metrics["completeness"]
+    reports what ran, was skipped or failed.
     """
-    import os
-    ext = os.path.splitext(file_path)[1].lower()
+    fmt = sniff_cad_format(file_path)
     scale = scale_to_mm(units_hint)
-    if ext in (".stl",):
+    deadline = Deadline(deadline_ms)
+    if fmt == "stl":
         mesh = load_stl(file_path, scale=scale)
         vol_mm3, area_mm2 = mesh_mass_props(mesh)
         bbox_min = mesh.bounds[0]
@@ -55,12 +220,17 @@ def analyze_file_path(file_path: str, units_hint: Optional[str] = None) -> dict:
         ]
         bbox_dims.sort()
         
+        deadline.done("mass_props")
+        
         # Advanced ray-casting for actual wall thickness detection
-        mw = min_wall_mesh(mesh, samples=8000, threshold_mm=10.0)
+        thickness_samples = deadline.thickness_samples(8000)
+        global_min_mm = run_stage(deadline, "thickness", pool, mesh_thickness, file_path, scale, thickness_samples)
+        if global_min_mm is None:
+            thickness_samples = 0
+        detected_thickness = global_min_mm if global_min_mm else None
         
         # Calculate thickness confidence based on detection quality
         thickness_confidence = 0.0
-        detected_thickness = mw.global_min_mm if mw.global_min_mm > 0 else None
         
         if detected_thickness:
             min_bbox_dim = min(bbox_dims)
@@ -99,6 +269,7 @@ def analyze_file_path(file_path: str, units_hint: Optional[str] = None) -> dict:
             'detected_thickness_mm': detected_thickness,
             'thickness_confidence': thickness_confidence,
             'thickness_detection_method': 'ray_casting_statistical',
+            'thickness_samples': thickness_samples,
             'classification_confidence': confidence,
             **classification_metadata
         }
@@ -165,19 +336,21 @@ def analyze_file_path(file_path: str, units_hint: Optional[str] = None) -> dict:
             "sheet_metal_score": classification_metadata.get('sheet_metal_score', 0),
             "complexity": complexity,
             "complexity_score": complexity_score,
-            "advanced_metrics": advanced_metrics_dict
+            "advanced_metrics": advanced_metrics_dict,
+            "completeness": deadline.completeness()
         }
         return metrics
-    elif ext in (".step", ".stp"):
+    elif fmt in BREP_FORMATS:
         if not occ_available():
-            raise HTTPException(status_code=400, detail="STEP analysis requires pythonOCC; not available")
-        shape = load_step_shape(file_path)
+            raise HTTPException(status_code=400, detail="STEP/IGES analysis requires pythonOCC; not available")
+        # Required stage: no deadline applies, only the kernel call timeout
+        props = pool.run(brep_mass_props, file_path, fmt) if deadline.bounded else brep_mass_props(file_path, fmt)
         
         # === ASSEMBLY DETECTION ===
         # Check if this is a multi-body assembly that requires manual quoting
-        assembly_info = count_solids_and_compounds(shape)
-        if assembly_info.is_assembly:
-            print(f"⚠️ {assembly_info.reason}")
+        assembly_info = props["assembly_info"]
+        if assembly_info["is_assembly"]:
+            print(f"⚠️ {assembly_info['reason']}")
             # Return special metrics for assemblies
             return {
                 "volume": 0,
@@ -190,86 +363,60 @@ def analyze_file_path(file_path: str, units_hint: Optional[str] = None) -> dict:
                 "sheet_metal_score": 0,
                 "is_assembly": True,
                 "assembly_info": {
-                    "solid_count": assembly_info.solid_count,
-                    "compound_count": assembly_info.compound_count,
-                    "shell_count": assembly_info.shell_count,
-                    "reason": assembly_info.reason
+                    "solid_count": assembly_info["solid_count"],
+                    "compound_count": assembly_info["compound_count"],
+                    "shell_count": assembly_info["shell_count"],
+                    "reason": assembly_info["reason"]
                 },
                 "requires_manual_quote": True,
-                "manual_quote_reason": assembly_info.reason,
+                "manual_quote_reason": assembly_info["reason"],
                 "advanced_metrics": {}
             }
         
-        vol_mm3, area_mm2 = shape_mass_props(shape)
-        
-        # BBox using OCC
-        from OCC.Core.Bnd import Bnd_Box
-        from OCC.Core.BRepBndLib import brepbndlib
-        box = Bnd_Box()
-        # Use new static method syntax (pythonocc-core 7.7.1+)
-        brepbndlib.Add(shape, box)
-        xmin, ymin, zmin, xmax, ymax, zmax = box.Get()
+        vol_mm3, area_mm2 = props["volume_mm3"], props["area_mm2"]
+        xmin, ymin, zmin, xmax, ymax, zmax = props["bbox"]
         
         # Calculate bounding box dimensions
         bbox_dims = [xmax - xmin, ymax - ymin, zmax - zmin]
         bbox_dims.sort()
         
+        deadline.done("mass_props")
+        
         # ENTERPRISE-LEVEL: Extract actual material thickness using advanced ray-casting
         actual_thickness = None
         thickness_confidence = 0.0
         triangle_count = 0
         
-        try:
-            from OCC.Core.BRepMesh import BRepMesh_IncrementalMesh
-            import tempfile
-            import os
-            
-            # Fine meshing for accurate wall thickness detection
-            BRepMesh_IncrementalMesh(shape, 0.05, True, 0.1, True)
+        # Advanced ray-casting with 8000 samples (fewer under a deadline)
+        thickness_samples = deadline.thickness_samples(8000)
+        thickness = run_stage(deadline, "thickness", pool, brep_thickness, file_path, fmt, thickness_samples)
+        if thickness is None:
+            thickness_samples = 0
+            print("   Using bbox approximation")
+        else:
+            global_min_mm, triangle_count = thickness
+            if global_min_mm > 0:
+                actual_thickness = global_min_mm
             
-            # Export to STL temporarily for trimesh analysis
-            from OCC.Extend.DataExchange import write_stl_file
-            tmp_stl_fd, tmp_stl_path = tempfile.mkstemp(suffix='.stl')
-            os.close(tmp_stl_fd)
+                # Calculate confidence based on thickness/bbox ratio
+                min_bbox_dim = min(bbox_dims)
+                thickness_to_bbox_ratio = actual_thickness / max(min_bbox_dim, 0.1)
             
-            try:
-                write_stl_file(shape, tmp_stl_path, mode="binary", linear_deflection=0.05, angular_deflection=0.1)
-                temp_mesh = load_stl(tmp_stl_path, scale=1.0)
-                triangle_count = int(temp_mesh.faces.shape[0])
-                
-                # Advanced ray-casting with 8000 samples
-                mw = min_wall_mesh(temp_mesh, samples=8000, threshold_mm=10.0)
-                
-                if mw.global_min_mm > 0:
-                    actual_thickness = mw.global_min_mm
-                    
-                    # Calculate confidence based on thickness/bbox ratio
-                    min_bbox_dim = min(bbox_dims)
-                    thickness_to_bbox_ratio = actual_thickness / max(min_bbox_dim, 0.1)
-                    
-                    # High confidence for bent sheet metal signature
-                    if thickness_to_bbox_ratio < 0.3:
-                        thickness_confidence = 0.95
-                    elif thickness_to_bbox_ratio < 0.5:
-                        thickness_confidence = 0.80
-                    elif thickness_to_bbox_ratio < 0.7:
-                        thickness_confidence = 0.60
-                    else:
-                        thickness_confidence = 0.40
-                    
-                    print(f"✅ Detected wall thickness: {actual_thickness:.2f}mm "
-                          f"(bbox min: {min_bbox_dim:.2f}mm, ratio: {thickness_to_bbox_ratio:.1%}, "
-                          f"confidence: {thickness_confidence:.0%})")
+                # High confidence for bent sheet metal signature
+                if thickness_to_bbox_ratio < 0.3:
+                    thickness_confidence = 0.95
+                elif thickness_to_bbox_ratio < 0.5:
+                    thickness_confidence = 0.80
+                elif thickness_to_bbox_ratio < 0.7:
+                    thickness_confidence = 0.60
                 else:
-                    print("⚠️ Wall thickness detection returned 0")
-                    
-            finally:
-                if os.path.exists(tmp_stl_path):
-                    os.unlink(tmp_stl_path)
-                    
-        except Exception as e:
-            print(f"⚠️ Wall thickness detection failed: {str(e)[:100]}")
-            print("   Using bbox approximation")
+                    thickness_confidence = 0.40
+            
+                print(f"✅ Detected wall thickness: {actual_thickness:.2f}mm "
+                      f"(bbox min: {min_bbox_dim:.2f}mm, ratio: {thickness_to_bbox_ratio:.1%}, "
+                      f"confidence: {thickness_confidence:.0%})")
+            else:
+                print("⚠️ Wall thickness detection returned 0")
         
         # === USE NEW CORE MODULES FOR CLEAN CLASSIFICATION ===
         geom_metrics = GeometricMetrics(bbox_dims, vol_mm3, area_mm2)
@@ -295,6 +442,7 @@ def analyze_file_path(file_path: str, units_hint: Optional[str] = None) -> dict:
             'detected_thickness_mm': actual_thickness,
             'thickness_confidence': thickness_confidence,
             'thickness_detection_method': 'ray_casting_statistical',
+            'thickness_samples': thickness_samples,
             'classification_confidence': confidence,
             **classification_metadata
         }
@@ -303,13 +451,11 @@ def analyze_file_path(file_path: str, units_hint: Optional[str] = None) -> dict:
         if 'bend_report' in classification_metadata:
             print(classification_metadata['bend_report'])
         
-        holes = extract_holes_from_shape(shape)
-        pockets = extract_pockets_from_shape(shape)
+        feature_counts = run_stage(deadline, "features", pool, brep_feature_counts, file_path, fmt)
         
         # === ENTERPRISE COMPLEXITY CALCULATION FOR STEP FILES ===
         # Based on actual extracted features: holes, pockets, triangles, bends
-        hole_count = len(holes)
-        pocket_count = len(pockets)
+        hole_count, pocket_count = feature_counts or (0, 0)
         bend_analysis = classification_metadata.get('bend_analysis', {})
         bend_count = bend_analysis.get('bend_count', 0)
         bend_complexity = bend_analysis.get('complexity', 0)
@@ -381,11 +527,78 @@ def analyze_file_path(file_path: str, units_hint: Optional[str] = None) -> dict:
             "sheet_metal_score": classification_metadata.get('sheet_metal_score', 0),
             "complexity": complexity,
             "complexity_score": complexity_score,
-            "advanced_metrics": advanced_metrics_dict
+            "advanced_metrics": advanced_metrics_dict,
+            "completeness": deadline.completeness()
         }
         return metrics
     else:
-        raise HTTPException(status_code=400, detail="Unsupported CAD format. Use STEP or STL.")
+        raise HTTPException(status_code=400, detail="Unsupported CAD format. Use STEP, IGES, BREP or STL.")
+
+def analyze_file_path_shared(file_path: str, units_hint: Optional[str] = None, deadline_ms: Optional[int] = None, pool: KernelPool = kernel_pool) -> dict:
+    """Run analyze_file_path once per (file bytes, units) across all workers.
+    Concurrent callers for the same upload wait for the leader's result.
+
+    Deadline-bound callers never wait on a leader: they reuse a finished full
+    result if one exists, otherwise run their own (possibly partial) analysis.
+
+    gzip/zip inputs are unpacked first (see analyze_archive).
+    """
+    if archive_kind(file_path):
+        return analyze_archive(file_path, units_hint, deadline_ms)
+    file_sha = sha256_of_file(file_path)
+    params = {"units_hint": units_hint, "ext": os.path.splitext(file_path)[1].lower()}
+    if deadline_ms is not None:
+        cached = single_flight.peek(file_sha, "analyze", params)
+        if cached is not None:
+            return cached
+        # Runs here rather than in a helper so each stage can be stopped at the deadline
+        return analyze_file_path(file_path, units_hint, deadline_ms=deadline_ms, pool=pool)
+    return single_flight.run(file_sha, "analyze", params, lambda: analyze_file_path_timed(file_path, units_hint, pool))
+
+def analyze_archive(file_path: str, units_hint: Optional[str] = None, deadline_ms: Optional[int] = None) -> dict:
+    """Analyze the models in a gzip/zip upload (.stp.gz, STEPZ, zipped bundles).
+
+    A single model (the usual compressed STEP) returns that model's metrics
+    unchanged, cached under the decompressed file's sha like a plain upload.
+    Several models are analyzed in parallel in archive_pool helpers and
+    reported per part; a failed part does not fail the others. Like a
+    multi-body STEP, a bundle is flagged for manual quoting.
+    """
+    with extracted_models(file_path) as members:
+        if len(members) == 1:
+            return analyze_file_path_shared(members[0].path, units_hint, deadline_ms)
+        with ThreadPoolExecutor(max_workers=archive_pool.size) as executor:
+            futures = [
+                executor.submit(analyze_file_path_shared, member.path, units_hint, deadline_ms, archive_pool)
+                for member in members
+            ]
+        parts = []
+        for member, future in zip(members, futures):
+            part = {"name": member.name, "format": member.fmt, "size_bytes": member.size_bytes}
+            try:
+                part["metrics"] = future.result()
+            except Exception as e:
+                part["error"] = str(e)
+            parts.append(part)
+    reason = f"Archive contains {len(parts)} models"
+    return {
+        "process_type": "assembly",
+        "is_archive": True,
+        "parts": parts,
+        "requires_manual_quote": True,
+        "manual_quote_reason": reason,
+        "advanced_metrics": {},
+    }
+
+def analyze_file_path_timed(file_path: str, units_hint: Optional[str] = None, pool: KernelPool = kernel_pool) -> dict:
+    """analyze_file_path in an isolated kernel helper, recording the runtime
+    as a cost-model training sample.
+    """
+    profile = profile_file(file_path)
+    started = time.monotonic()
+    metrics = pool.run(analyze_file_path, file_path, units_hint)
+    record_stage_timing(profile, "analyze", time.monotonic() - started)
+    return metrics
 
 def calculate_stock_size(bbox: dict, thickness: Optional[float] = None) -> dict:
     """Calculate required stock material size."""
@@ -406,8 +619,41 @@ def calculate_stock_size(bbox: dict, thickness: Optional[float] = None) -> dict:
             "height": round(z_size + 15, 1)
         }
 
-@celery_app.task
-def analyze_file(file_id: str, file_path: str, units_hint: Optional[str] = None, file_url: Optional[str] = None, org_id: Optional[str] = None, webhook_url: Optional[str] = None):
+def schedule_refinement(metrics: dict, file_id: str, file_path: Optional[str], units_hint: Optional[str], file_url: Optional[str], org_id: Optional[str], webhook_url: Optional[str]) -> None:
+    """Queue a full (no deadline) analysis when a deadline cut stages short.
+    The refined result lands in the shared result cache and is sent to the webhook.
+    Stages that failed rather than ran out of time would fail again, so they
+    do not trigger one.
+    """
+    completeness = metrics.get("completeness") or {}
+    if not completeness.get("skipped_stages"):
+        return
+    queue, _ = route_for_source(file_path, file_url)
+    task = analyze_file.apply_async(
+        args=[file_id, file_path or "", units_hint, file_url, org_id, webhook_url],
+        queue=queue,
+    )
+    completeness["refinement_task_id"] = task.id
+
+def stage_for_workers(local_path: str) -> str:
+    """Move ``local_path`` into BATCH_STAGING_DIR, keeping its extension."""
+    fd, staged = tempfile.mkstemp(suffix=os.path.splitext(local_path)[1], dir=BATCH_STAGING_DIR)
+    os.close(fd)
+    shutil.move(local_path, staged)
+    return staged
+
+def discard_staged(file_path: str) -> None:
+    try:
+        os.remove(file_path)
+    except FileNotFoundError:
+        pass
+
+@celery_app.task(bind=True, max_retries=2)
+def analyze_file(self, file_id: str, file_path: str, units_hint: Optional[str] = None, file_url: Optional[str] = None, org_id: Optional[str] = None, webhook_url: Optional[str] = None, deadline_ms: Optional[int] = None, staged: bool = False):
+    """``staged``: ``file_path`` was handed over through BATCH_STAGING_DIR and
+    is removed once the task is done with it (not before a retry).
+    """
+    retrying = False
     try:
         local_path = file_path
         if not local_path and file_url:
@@ -415,73 +661,232 @@ def analyze_file(file_id: str, file_path: str, units_hint: Optional[str] = None,
         if not local_path:
             raise ValueError("file_path or file_url is required")
 
-        metrics = analyze_file_path(local_path, units_hint)
-        # Fire-and-forget webhook if provided
+        with RssGuard() as memory:
+            metrics = analyze_file_path_shared(local_path, units_hint, deadline_ms=deadline_ms)
+        print(f"📈 analyze_file {file_id} memory: {memory.as_dict()}")
+        # A staged file is gone by the time a refinement runs; it fetches file_url instead
+        schedule_refinement(metrics, file_id, "" if staged else file_path, units_hint, file_url, org_id, webhook_url)
+        # Queue the webhook; the dispatcher delivers it outside this worker
         if webhook_url:
-            try:
-                import httpx
-                headers = {}
-                secret = None
-                try:
-                    import os
-                    secret = os.getenv('GEOMETRY_WEBHOOK_SECRET')
-                except Exception:
-                    secret = None
-                if secret:
-                    headers['X-CAD-Webhook-Secret'] = secret
-                payload = {
-                    "part_id": file_id,
-                    "org_id": org_id,
-                    "metrics": metrics,
-                    "file_url": file_url,
-                    "units_hint": units_hint,
-                    "loader": 'occ' if local_path.lower().endswith(('.step', '.stp')) else 'trimesh'
-                }
-                if secret:
-                    import hmac, hashlib, json
-                    body = json.dumps(payload)
-                    sig = hmac.new(secret.encode(), body.encode(), hashlib.sha256).hexdigest()
-                    headers['X-CAD-Webhook-Signature'] = f'sha256={sig}'
-                httpx.post(webhook_url, json=payload, headers=headers, timeout=10.0)
-            except Exception:
-                pass
-        return {"file_id": file_id, "metrics": metrics}
+            enqueue_webhook(webhook_url, {
+                "part_id": file_id,
+                "org_id": org_id,
+                "metrics": metrics,
+                "file_url": file_url,
+                "units_hint": units_hint,
+                "loader": 'occ' if is_brep_file(local_path) else 'trimesh'
+            })
+        return {"file_id": file_id, "metrics": metrics, "resource_usage": memory.as_dict()}
+    except MemoryLimitExceeded:
+        # The child is recycled after this task (peak RSS > soft limit); retry on a fresh one
+        if self.request.retries >= self.max_retries:
+            return {"error": "Analysis exceeded the worker memory limit"}
+        retrying = True
+        raise self.retry(queue=HEAVY_QUEUE, countdown=5)
     except Exception as e:
         return {"error": str(e)}
+    finally:
+        if staged and not retrying:
+            discard_staged(file_path)
 
 @router.post("/", response_model=AnalysisResponse)
 async def analyze_cad_file(request: AnalysisRequest):
-    # Queue the analysis task
-    task = analyze_file.delay(request.file_id, request.file_path or "", request.units_hint, request.file_url, request.org_id, request.webhook_url)
+    # Routing may HEAD the URL or scan the file, so keep it off the event loop
+    task = await asyncio.to_thread(enqueue_analysis, request)
     
     return {
         "file_id": request.file_id,
         "metrics": {},
-        "task_id": task.id
+        "task_id": task.id,
+        "gltf_task_id": await asyncio.to_thread(schedule_viewer_assets, request),
     }
 
+def enqueue_analysis(request: AnalysisRequest):
+    """Queue the analysis task on the lane matching its estimated cost."""
+    queue, _ = route_for_source(request.file_path, request.file_url)
+    return analyze_file.apply_async(
+        args=[request.file_id, request.file_path or "", request.units_hint, request.file_url, request.org_id, request.webhook_url],
+        kwargs={"deadline_ms": request.deadline_ms},
+        queue=queue,
+    )
+
+def schedule_viewer_assets(request: AnalysisRequest) -> Optional[str]:
+    """Queue convert_to_gltf when the caller asked for pre-generated viewer assets."""
+    if not request.pregenerate_gltf:
+        return None
+    return enqueue_gltf_conversion(request.file_id, request.file_path, request.file_url).id
+
+async def await_task_result(task_id: str, timeout: float) -> dict:
+    """Long-poll a task until it is ready or ``timeout`` seconds pass."""
+    deadline = time.monotonic() + timeout
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return {"status": states.PENDING, "error": "Timed out waiting for analysis"}
+        meta = await wait_for_task_meta(task_id, min(remaining, MAX_WAIT_S))
+        if meta is not None and meta["status"] in states.READY_STATES:
+            return summarize_task_meta(meta)
+
+async def resolve_batch_part(local_path: str, file_sha: str, item: BatchItem, units_hint: Optional[str], org_id: Optional[str]) -> dict:
+    """Analysis outcome for one unique file: a cached result, or a queued task's result.
+    Takes ownership of ``local_path``.
+    """
+    try:
+        params = {"units_hint": units_hint, "ext": os.path.splitext(local_path)[1].lower()}
+        cached = await asyncio.to_thread(single_flight.peek, file_sha, "analyze", params)
+        if cached is not None:
+            return {"metrics": cached, "cached": True}
+        queue, _ = await asyncio.to_thread(lambda: route_for_profile(profile_file(local_path)))
+        if BATCH_STAGING_DIR:
+            staged_path = await asyncio.to_thread(stage_for_workers, local_path)
+            local_path = None
+    finally:
+        if local_path:
+            os.remove(local_path)
+    if BATCH_STAGING_DIR:
+        try:
+            task = await asyncio.to_thread(
+                analyze_file.apply_async,
+                args=[item.file_id, staged_path, units_hint, item.file_url, org_id, None],
+                kwargs={"staged": True},
+                queue=queue,
+            )
+        except BaseException:
+            discard_staged(staged_path)
+            raise
+    else:
+        # No shared storage: the API's temp copy is not visible to workers, so they fetch the URL
+        task = await asyncio.to_thread(
+            analyze_file.apply_async,
+            args=[item.file_id, "", units_hint, item.file_url, org_id, None],
+            queue=queue,
+        )
+    entry = await await_task_result(task.id, BATCH_TIMEOUT_S)
+    outcome = {"task_id": task.id, "cached": False}
+    if "result" in entry:
+        outcome["metrics"] = entry["result"]["metrics"]
+    else:
+        outcome["error"] = entry["error"]
+    return outcome
+
+async def iter_batch_results(request: BatchAnalysisRequest, http_client: httpx.AsyncClient) -> AsyncIterator[dict]:
+    """Yield one result per item, in completion order.
+
+    Items are downloaded concurrently and grouped by sha256, so each distinct
+    file is looked up in the result cache or analyzed at most once.
+    """
+    slots = asyncio.Semaphore(BATCH_DOWNLOAD_CONCURRENCY)
+    leaders: dict = {}
+
+    async def process(item: BatchItem) -> dict:
+        units_hint = item.units_hint or request.units_hint
+        line = {"file_id": item.file_id, "file_url": item.file_url}
+        local_path = None
+        try:
+            async with slots:
+                local_path, file_sha = await download_to_temp_async(item.file_url, http_client)
+            line["sha256"] = file_sha
+            key = (file_sha, units_hint, os.path.splitext(local_path)[1].lower())
+            leader = leaders.get(key)
+            if leader is None:
+                leader = leaders[key] = (item.file_id, asyncio.ensure_future(
+                    resolve_batch_part(local_path, file_sha, item, units_hint, request.org_id)
+                ))
+                local_path = None
+            else:
+                line["duplicate_of"] = leader[0]
+            line.update(await asyncio.shield(leader[1]))
+        except Exception as e:
+            line["error"] = str(e)
+        finally:
+            if local_path:
+                os.remove(local_path)
+        line["status"] = "failed" if "error" in line else "completed"
+        return line
+
+    pending = [asyncio.ensure_future(process(item)) for item in request.items]
+    try:
+        for next_done in asyncio.as_completed(pending):
+            yield await next_done
+    finally:
+        # Client went away mid-stream: stop downloading and polling
+        for future in pending + [leader for _, leader in leaders.values()]:
+            future.cancel()
+
+@router.post("/batch")
+async def analyze_cad_batch(request: BatchAnalysisRequest):
+    """Analyze many parts at once, streaming NDJSON lines as each part finishes."""
+    if len(request.items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_ITEMS} items per batch")
+
+    async def body():
+        limits = httpx.Limits(max_connections=BATCH_DOWNLOAD_CONCURRENCY)
+        async with httpx.AsyncClient(limits=limits) as client:
+            async for line in iter_batch_results(request, client):
+                yield json.dumps(line) + "\n"
+
+    return StreamingResponse(body(), media_type="application/x-ndjson")
+
+@router.post("/status", response_model=TaskStatusResponse)
+async def get_analysis_statuses(request: TaskStatusRequest):
+    """Resolve many analysis task ids in one pipelined Redis call."""
+    if len(request.task_ids) > MAX_BULK_IDS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BULK_IDS} task ids per request")
+    metas = await fetch_task_metas(request.task_ids)
+    return {"results": {task_id: summarize_task_meta(meta) for task_id, meta in metas.items()}}
+
 @router.get("/{task_id}", response_model=AnalysisResponse)
-async def get_analysis_result(task_id: str):
-    task = analyze_file.AsyncResult(task_id)
-    
-    if task.ready():
-        result = task.get()
-        if "error" in result:
-            raise HTTPException(status_code=400, detail=result["error"])
-        return result
+async def get_analysis_result(task_id: str, wait: float = Query(0, ge=0, le=MAX_WAIT_S)):
+    """Return the analysis result; with ``wait`` (seconds), long-poll until it is ready."""
+    if wait:
+        meta = await wait_for_task_meta(task_id, wait)
     else:
-        raise HTTPException(status_code=202, detail="Analysis in progress")
+        meta = await fetch_task_meta(task_id)
+    entry = summarize_task_meta(meta)
+    if "result" in entry:
+        return entry["result"]
+    if "error" in entry:
+        status_code = 400 if entry["status"] == "SUCCESS" else 500
+        raise HTTPException(status_code=status_code, detail=entry["error"])
+    raise HTTPException(status_code=202, detail="Analysis in progress")
 
 @router.post("/sync", response_model=AnalysisResponse)
 async def analyze_cad_file_sync(request: AnalysisRequest):
-    """Synchronous analysis for immediate results (smaller files)."""
+    """Synchronous analysis for immediate results (smaller files).
+    Jobs the cost model expects to exceed the sync budget are queued instead
+    and answered with 202 + task_id.
+    """
     try:
+        deadline = Deadline(request.deadline_ms)
         local_path = request.file_path
         if not local_path and request.file_url:
-            local_path = download_to_temp(request.file_url)
+            local_path = await asyncio.to_thread(download_to_temp, request.file_url)
         if not local_path:
             raise HTTPException(status_code=400, detail="file_path or file_url is required")
-        metrics = analyze_file_path(local_path, request.units_hint)
-        return {"file_id": request.file_id, "metrics": metrics}
+        queue, estimate = await asyncio.to_thread(lambda: route_for_profile(profile_file(local_path)))
+        # With a deadline the analysis degrades instead of overrunning, so keep it sync
+        if request.deadline_ms is None and estimate is not None and estimate > SYNC_BUDGET_S:
+            task = await asyncio.to_thread(
+                analyze_file.apply_async,
+                args=[request.file_id, request.file_path or "", request.units_hint, request.file_url, request.org_id, request.webhook_url],
+                queue=queue,
+            )
+            return JSONResponse(
+                status_code=202,
+                content={
+                    "file_id": request.file_id,
+                    "metrics": {},
+                    "task_id": task.id,
+                    "gltf_task_id": await asyncio.to_thread(schedule_viewer_assets, request),
+                },
+            )
+        # Download time counts against the caller's deadline
+        metrics = await asyncio.to_thread(
+            analyze_file_path_shared, local_path, request.units_hint, deadline_ms=deadline.remaining_ms()
+        )
+        await asyncio.to_thread(
+            schedule_refinement, metrics, request.file_id, request.file_path, request.units_hint, request.file_url, request.org_id, request.webhook_url
+        )
+        return {"file_id": request.file_id, "metrics": metrics, "gltf_task_id": await asyncio.to_thread(schedule_viewer_assets, request)}
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
@@ -1,44 +1,72 @@
 from __future__ import annotations
 
+import asyncio
+import gzip
 import hashlib
 import json
 import os
 import tempfile
+import time
 from pathlib import Path
-from typing import Literal
+import urllib.parse
+from typing import Literal, Optional
 
-from fastapi import APIRouter, HTTPException, Query, Response
+import httpx
+import numpy as np
+from fastapi import APIRouter, Header, HTTPException, Query, Response
+from fastapi.responses import FileResponse
 from pydantic import BaseModel
+from starlette.background import BackgroundTask
 
 from ..workers.celery import celery_app
+from ..workers.cost_model import route_for_source
+from ..workers.kernel_pool import kernel_pool
+from ..workers.task_status import MAX_WAIT_S, fetch_task_meta, summarize_task_meta, wait_for_task_meta
+from ..core.decimation import decimate, decimate_labeled
+from ..core.glb import FACE_RANGES_EXTENSION, add_face_ranges, encode_mesh
+from ..core.tessellation import triangulation_arrays
+from ..utils.artifact_cache import artifact_cache
 from ..utils.download import download_to_temp, sha256_of_file
+from ..utils.redis_client import get_redis
+from ..utils.singleflight import single_flight
+from ..utils.tessellation_store import tessellation_store
 from ..loaders.stl_loader import load_stl
-from ..loaders.step_loader import occ_available, load_step_shape
+from ..loaders.step_loader import occ_available
+from ..loaders.cad_loader import is_brep_file, load_cad_shape
 
 router = APIRouter()
 
 GLB_MIME_TYPE = "model/gltf-binary"
 CACHE_CONTROL_HEADER = "public, max-age=3600"
-CACHE_DIR = Path("/tmp/gltf-cache")
 DEFAULT_LODS: tuple[str, ...] = ("low", "med", "high")
 LOD_TARGETS: dict[str, int] = {"low": 50_000, "med": 150_000, "high": 400_000}
-STEP_DEFLECTION_BY_LOD: dict[str, float] = {"low": 0.5, "med": 0.2, "high": 0.05}
+# B-rep (STEP/IGES/BREP) sources are tessellated to about the finest LOD's size, then decimated
+STEP_TRIANGLE_BUDGET = max(LOD_TARGETS.values())
 MISSING_FILE_URL_ERROR = "file_url is required"
+# "raw": trimesh export (float32); "quantized": KHR_mesh_quantization + cache-ordered indices
+GLB_ENCODINGS: tuple[str, ...] = ("raw", "quantized")
+GLB_COMPRESSIONS: tuple[str, ...] = ("none", "gzip")
+# Per-triangle source face ids on meshes tessellated from B-rep (trimesh face attribute)
+BREP_FACE_ATTRIBUTE = "brep_face_id"
+# How long a file_url -> sha256 mapping is kept; it is only trusted while the origin's validators match
+URL_SHA_TTL_S = 3600
+URL_HEAD_TIMEOUT_S = 5.0
 
 
 class GltfRequest(BaseModel):
     file_id: str
-    file_path: str
+    file_path: Optional[str] = None
+    file_url: Optional[str] = None
+    deflection: Optional[float] = None
 
 
 class GltfResponse(BaseModel):
     file_id: str
     gltf_url: str
     task_id: str
-
-
-def ensure_cache_dir() -> None:
-    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    file_sha: Optional[str] = None
+    mesh_versions: Optional[dict[str, str]] = None
+    cached: Optional[bool] = None
 
 
 def resolve_lod(lod: str | None) -> Literal["low", "med", "high"]:
@@ -55,12 +83,173 @@ def build_mesh_key(prefix: str, file_sha: str, lod: str, target: int) -> str:
     return f"{prefix}-{file_sha}-{lod}-{target}"
 
 
-def mesh_cache_path(cache_key: str) -> Path:
-    return CACHE_DIR / f"{cache_key}.glb"
+def build_lod_set_key(prefix: str, file_sha: str) -> str:
+    return f"{prefix}-{file_sha}-lods"
+
+
+def lods_finest_first() -> list[str]:
+    return sorted(DEFAULT_LODS, key=lod_target, reverse=True)
+
+
+def mesh_cache_name(cache_key: str, encoding: str = "raw") -> str:
+    if encoding == "raw":
+        return f"{cache_key}.glb"
+    return f"{cache_key}.{encoding}.glb"
+
+
+def resolve_encoding(encoding: str | None) -> str:
+    if encoding in GLB_ENCODINGS:
+        return encoding
+    raise HTTPException(status_code=400, detail=f"encoding must be one of {', '.join(GLB_ENCODINGS)}")
+
 
+def resolve_compression(compression: str | None) -> str:
+    if compression in GLB_COMPRESSIONS:
+        return compression
+    raise HTTPException(status_code=400, detail=f"compression must be one of {', '.join(GLB_COMPRESSIONS)}")
 
-def metadata_cache_path(cache_key: str) -> Path:
-    return CACHE_DIR / f"{cache_key}.json"
+
+def glb_etag(mesh_version: str, encoding: str, compression: str) -> str:
+    """Strong ETag: the cache key already identifies the exact bytes."""
+    suffix = ".gz" if compression == "gzip" else ""
+    return f'"{mesh_version}.{encoding}{suffix}"'
+
+
+def glb_headers(mesh_version: str, encoding: str, compression: str) -> dict[str, str]:
+    headers = {
+        "X-Mesh-Version": mesh_version,
+        "Cache-Control": CACHE_CONTROL_HEADER,
+        "ETag": glb_etag(mesh_version, encoding, compression),
+    }
+    if compression == "gzip":
+        headers["Content-Encoding"] = "gzip"
+        headers["Vary"] = "Accept-Encoding"
+    return headers
+
+
+def etag_matches(etag: str, if_none_match: str | None) -> bool:
+    if not if_none_match:
+        return False
+    candidates = {tag.strip() for tag in if_none_match.split(",")}
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
+
+
+def not_modified_response(mesh_version: str, encoding: str, compression: str) -> Response:
+    return Response(status_code=304, headers=glb_headers(mesh_version, encoding, compression))
+
+
+def origin_validator(file_url: str) -> str | None:
+    """Strong ETag / Last-Modified / Content-Length of the object behind
+    ``file_url``, from a HEAD. None when the origin sends neither a strong
+    ETag nor Last-Modified, or the HEAD fails.
+    """
+    try:
+        response = httpx.head(file_url, timeout=URL_HEAD_TIMEOUT_S, follow_redirects=True)
+        response.raise_for_status()
+    except Exception:
+        return None
+    etag = response.headers.get("etag", "")
+    if etag.startswith("W/"):
+        etag = ""
+    last_modified = response.headers.get("last-modified", "")
+    if not etag and not last_modified:
+        return None
+    return "|".join((etag, last_modified, response.headers.get("content-length", "")))
+
+
+def url_sha_key(file_url: str) -> str:
+    return f"cad:url-sha:{hashlib.sha256(file_url.encode()).hexdigest()}"
+
+
+def remember_file_sha(file_url: str, file_sha: str, validator: str | None) -> None:
+    """Remember ``file_sha`` for ``file_url`` together with the origin
+    validator taken *before* the download. Without a validator nothing is
+    stored, since there is no way to tell later whether the object changed.
+    """
+    if not validator:
+        return
+    try:
+        get_redis().set(url_sha_key(file_url), json.dumps({"sha": file_sha, "validator": validator}), ex=URL_SHA_TTL_S)
+    except Exception:
+        pass
+
+
+def known_file_sha(file_url: str, validator: str | None) -> str | None:
+    """sha256 last seen for ``file_url``, so revalidations can skip the download,
+    but only while the origin still reports the validator it was stored with.
+    """
+    if not validator:
+        return None
+    try:
+        value = get_redis().get(url_sha_key(file_url))
+        entry = json.loads(value) if value else None
+    except Exception:
+        return None
+    if not isinstance(entry, dict) or entry.get("validator") != validator:
+        return None
+    return entry.get("sha")
+
+
+def gzip_cache_path(cache_path: Path) -> Path:
+    """Precompressed sibling of ``cache_path``, created on first use."""
+    gz_name = cache_path.name + ".gz"
+    gz_path = artifact_cache.peek(gz_name)
+    if gz_path is None:
+        gz_path = artifact_cache.put(gz_name, gzip.compress(cache_path.read_bytes(), compresslevel=6))
+    return gz_path
+
+
+def pinned_file_response(cache_path: Path, headers: dict[str, str]) -> FileResponse:
+    """FileResponse over a private hard link to ``cache_path``.
+
+    The body is sent after the handler returns, so a concurrent ``evict()``
+    could unlink the cache file first; the link keeps the inode alive until
+    the response is done. Dot-prefixed, so the cache ignores it.
+    """
+    fd, pin = tempfile.mkstemp(dir=cache_path.parent, prefix=f".{cache_path.name}.serve.")
+    os.close(fd)
+    os.unlink(pin)
+    os.link(cache_path, pin)
+    return FileResponse(pin, media_type=GLB_MIME_TYPE, headers=headers, background=BackgroundTask(unlink_quietly, pin))
+
+
+def unlink_quietly(path: str) -> None:
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+def glb_response(
+    mesh_version: str,
+    encoding: str,
+    compression: str,
+    glb_bytes: bytes | None = None,
+    cache_path: Path | None = None,
+) -> Response:
+    """Serve a GLB from the cache file (sendfile, Range requests), or from
+    ``glb_bytes`` when the cache file could not be written (or was evicted).
+    """
+    headers = glb_headers(mesh_version, encoding, compression)
+    cache_path = cache_path or artifact_cache.peek(mesh_cache_name(mesh_version, encoding))
+    if cache_path is not None:
+        try:
+            if compression == "gzip":
+                cache_path = gzip_cache_path(cache_path)
+            return pinned_file_response(cache_path, headers)
+        except FileNotFoundError:
+            # Evicted between lookup and pinning
+            if glb_bytes is None:
+                raise
+    if glb_bytes is None:
+        raise FileNotFoundError(f"GLB {mesh_version} is not cached")
+    if compression == "gzip":
+        glb_bytes = gzip.compress(glb_bytes, compresslevel=6)
+    return Response(content=glb_bytes, media_type=GLB_MIME_TYPE, headers=headers)
+
+
+def metadata_cache_name(cache_key: str) -> str:
+    return f"{cache_key}.json"
 
 
 def build_mesh_metadata(
@@ -95,62 +284,323 @@ def build_mesh_metadata(
 
 
 def read_metadata(cache_key: str) -> dict | None:
-    path = metadata_cache_path(cache_key)
-    if path.exists():
-        try:
-            with path.open("r") as fh:
-                return json.load(fh)
-        except Exception:
-            return None
-    return None
+    data = artifact_cache.read(metadata_cache_name(cache_key))
+    if data is None:
+        return None
+    try:
+        return json.loads(data)
+    except Exception:
+        return None
 
 
-def write_metadata(cache_key: str, metadata: dict) -> None:
-    path = metadata_cache_path(cache_key)
+def write_lod_set(set_key: str, sidecar: dict, glbs: dict[str, dict[str, bytes]]) -> None:
+    """Persist every LOD GLB, then the sidecar that describes them.
+
+    Each file is replaced atomically and the sidecar goes last, so a reader
+    that finds the sidecar also finds every GLB it lists.
+    """
     try:
-        with path.open("w") as fh:
-            json.dump(metadata, fh)
+        for lod, encoded in glbs.items():
+            for encoding, glb_bytes in encoded.items():
+                artifact_cache.put(mesh_cache_name(sidecar["lods"][lod]["mesh_version"], encoding), glb_bytes)
+        artifact_cache.put(metadata_cache_name(set_key), json.dumps(sidecar).encode())
     except Exception:
         pass
 
 
 def simplify_mesh(mesh, target: int):
+    """Reduce ``mesh`` to about ``target`` faces.
+
+    Prefers trimesh's native quadric decimation when a backend is installed and
+    falls back to the in-tree NumPy decimator, so LOD targets always hold.
+    Meshes with B-rep face ids always use the in-tree decimator, which keeps
+    each surviving triangle's id.
+    """
+    if len(mesh.faces) <= target:
+        return mesh
+    import trimesh
+
+    face_ids = brep_face_ids(mesh)
+    if face_ids is not None:
+        vertices, faces, face_ids = decimate_labeled(mesh.vertices, mesh.faces, face_ids, target)
+        return trimesh.Trimesh(
+            vertices=vertices,
+            faces=faces,
+            face_attributes={BREP_FACE_ATTRIBUTE: face_ids},
+            process=False,
+        )
     try:
-        if len(mesh.faces) > target:
-            return mesh.simplify_quadratic_decimation(target)
+        simplified = mesh.simplify_quadric_decimation(face_count=target)
+        if len(simplified.faces) <= target * 1.05:
+            return simplified
     except Exception:
-        return mesh
-    return mesh
-
+        pass
+    vertices, faces = decimate(mesh.vertices, mesh.faces, target)
+    return trimesh.Trimesh(vertices=vertices, faces=faces, process=False)
+
+
+def step_triangulation(path: str, deflection: float | None):
+    """Translate and tessellate a STEP, IGES or BREP file; returns (vertices, faces, face_ids,
+    tessellation) where tessellation describes the deflections used.
+
+    Without an explicit (relative) ``deflection`` the shape is meshed to
+    STEP_TRIANGLE_BUDGET triangles, whatever its size, via the shared
+    tessellation store. ``face_ids`` carries the B-rep face index that DFM
+    highlights use. Runs inside a kernel helper, so only plain arrays cross
+    the pipe.
+    """
+    if deflection is None:
+        tessellation, plan = tessellation_store.tessellate(
+            sha256_of_file(path), lambda: load_cad_shape(path), STEP_TRIANGLE_BUDGET
+        )
+        return tessellation.vertices, tessellation.faces, tessellation.face_ids, plan
 
-def load_step_tri_mesh(path: str, deflection: float):
     from OCC.Core.BRepMesh import BRepMesh_IncrementalMesh
-    from OCC.Core.StlAPI import StlAPI_Writer
 
-    shape = load_step_shape(path)
+    shape = load_cad_shape(path)
     angular_deflection = 0.5
     BRepMesh_IncrementalMesh(shape, deflection, True, angular_deflection, True).Perform()
-    fd, tmp_path = tempfile.mkstemp(suffix=".stl")
-    os.close(fd)
-    try:
-        StlAPI_Writer().Write(shape, tmp_path)
-        return load_stl(tmp_path)
-    finally:
-        try:
-            os.remove(tmp_path)
-        except OSError:
-            pass
+    vertices, faces, face_ids = triangulation_arrays(shape)
+    return vertices, faces, face_ids, {"linear_deflection": deflection, "relative": True, "angular_deflection": angular_deflection}
+
+
+def load_step_tri_mesh(path: str, deflection: float | None):
+    import trimesh
+
+    vertices, faces, face_ids, tessellation = kernel_pool.run(step_triangulation, path, deflection)
+    return trimesh.Trimesh(
+        vertices=vertices,
+        faces=faces,
+        face_attributes={BREP_FACE_ATTRIBUTE: face_ids},
+        metadata={"tessellation": tessellation},
+        process=False,
+    )
+
+
+def brep_face_ids(mesh) -> np.ndarray | None:
+    """Per-triangle B-rep face ids, when the mesh was tessellated from B-rep."""
+    face_ids = getattr(mesh, "face_attributes", {}).get(BREP_FACE_ATTRIBUTE)
+    if face_ids is None or len(face_ids) != len(mesh.faces):
+        return None
+    return np.asarray(face_ids)
+
+
+def group_by_face_id(mesh, face_ids: np.ndarray):
+    """Copy of ``mesh`` with triangles ordered by B-rep face id."""
+    import trimesh
+
+    order = np.argsort(face_ids, kind="stable")
+    return trimesh.Trimesh(
+        vertices=mesh.vertices,
+        faces=mesh.faces[order],
+        face_attributes={BREP_FACE_ATTRIBUTE: face_ids[order]},
+        process=False,
+    )
+
+
+def build_lod_set(
+    mesh,
+    *,
+    prefix: str,
+    file_sha: str,
+    cache_keys: dict[str, str],
+    extra_metadata: dict | None = None,
+) -> tuple[dict, dict[str, bytes]]:
+    """Decimate ``mesh`` progressively (high -> med -> low) and export each LOD.
+
+    Every step starts from the previous, already-reduced mesh, so the full
+    tessellation is only simplified once. Returns the sidecar and, per LOD,
+    the GLB bytes for every encoding. Meshes with B-rep face ids get their
+    triangles grouped by face and the CAD_brep_faces ranges in both GLBs.
+    """
+    lods: dict[str, dict] = {}
+    glbs: dict[str, dict[str, bytes]] = {}
+    tessellation = getattr(mesh, "metadata", {}).get("tessellation")
+    for lod in lods_finest_first():
+        target = lod_target(lod)
+        mesh = simplify_mesh(mesh, target)
+        face_ids = brep_face_ids(mesh)
+        if face_ids is not None:
+            mesh = group_by_face_id(mesh, face_ids)
+            face_ids = brep_face_ids(mesh)
+        raw = mesh.export(file_type="glb")
+        if face_ids is not None:
+            raw = add_face_ranges(raw, face_ids)
+        started = time.perf_counter()
+        quantized = encode_mesh(mesh, face_ids)
+        encode_ms = (time.perf_counter() - started) * 1000.0
+        glbs[lod] = {"raw": raw, "quantized": quantized}
+        metadata = build_mesh_metadata(
+            mesh,
+            prefix=prefix,
+            file_sha=file_sha,
+            lod=lod,
+            target=target,
+            mesh_version=cache_keys[lod],
+        )
+        metadata["encodings"] = {
+            "raw": {"bytes": len(raw)},
+            "quantized": {
+                "bytes": len(quantized),
+                "compression_ratio": round(len(raw) / max(len(quantized), 1), 2),
+                "encode_ms": round(encode_ms, 1),
+            },
+        }
+        if face_ids is not None:
+            metadata["face_ranges"] = {
+                "extension": FACE_RANGES_EXTENSION,
+                "face_count": int(len(np.unique(face_ids))),
+            }
+        if tessellation:
+            metadata["tessellation"] = tessellation
+        metadata.update(extra_metadata or {})
+        lods[lod] = metadata
+    return {"file_sha": file_sha, "lods": lods}, glbs
 
 
-@celery_app.task
-def convert_to_gltf(file_id: str, file_path: str):
-    # Conversion disabled until OCC dependencies are available in production environments.
-    return {"error": "GLTF conversion currently unavailable"}
+def ensure_mesh_artifacts(
+    load_mesh,
+    *,
+    prefix: str,
+    file_sha: str,
+    lod: str,
+    set_key: str,
+    cache_keys: dict[str, str],
+    extra_metadata: dict | None = None,
+    shared: bool = True,
+) -> tuple[dict, bytes | None]:
+    """Generate and cache every LOD for the set, returning the one for ``lod``.
+
+    The source is loaded (tessellated) once per set. With ``shared`` the work
+    is single-flighted across workers, so concurrent stream/metadata requests
+    for the same bytes build the set once. Returns the LOD metadata and, when
+    this caller did the work, its GLB bytes keyed by encoding.
+    """
+    produced: dict[str, dict[str, bytes]] = {}
+
+    def compute() -> dict:
+        sidecar, glbs = build_lod_set(
+            load_mesh(),
+            prefix=prefix,
+            file_sha=file_sha,
+            cache_keys=cache_keys,
+            extra_metadata=extra_metadata,
+        )
+        produced.update(glbs)
+        write_lod_set(set_key, sidecar, glbs)
+        return sidecar
+
+    if not shared:
+        sidecar = compute()
+    else:
+        sidecar = single_flight.run(file_sha, f"gltf-{prefix}", {"set_key": set_key}, compute)
+    return sidecar["lods"][lod], produced.get(lod)
+
+
+def ensure_glb_bytes(load_mesh, *, encoding: str = "raw", **kwargs) -> tuple[dict, bytes]:
+    """Like ensure_mesh_artifacts, but always return the GLB bytes for ``encoding``
+    (from the leader's cache file if another worker did the work).
+    """
+    metadata, encoded = ensure_mesh_artifacts(load_mesh, **kwargs)
+    if encoded is None:
+        glb_bytes = artifact_cache.read(mesh_cache_name(metadata["mesh_version"], encoding))
+        if glb_bytes is not None:
+            return metadata, glb_bytes
+        # The leader could not persist its GLBs; generate our own copy.
+        metadata, encoded = ensure_mesh_artifacts(load_mesh, **{**kwargs, "shared": False})
+    return metadata, encoded[encoding]
+
+
+def read_lod_metadata(set_key: str, lod: str) -> dict | None:
+    sidecar = read_metadata(set_key)
+    if sidecar:
+        return sidecar.get("lods", {}).get(lod)
+    return None
+
+
+def stl_lod_keys(file_sha: str) -> tuple[str, dict[str, str]]:
+    """(set key, per-LOD GLB cache keys) for an STL source."""
+    cache_keys = {lod: build_mesh_key("stl", file_sha, lod, lod_target(lod)) for lod in DEFAULT_LODS}
+    return build_lod_set_key("stl", file_sha), cache_keys
+
+
+def pregenerate_lod_set(path: str, deflection: float | None = None) -> dict:
+    """Build and cache every LOD GLB and the sidecar for ``path`` (STL, or STEP/IGES/BREP by content).
+
+    Returns the file sha, the per-LOD mesh versions and whether the set was
+    already cached. Uses the same keys and single-flight as the stream
+    endpoints, so a viewer request racing the task waits for it instead of
+    tessellating again.
+    """
+    file_sha = sha256_of_file(path)
+    if is_brep_file(path):
+        if not occ_available():
+            raise ValueError("pythonOCC is required for STEP->GLB")
+        deflection_value, set_key, cache_keys = step_lod_keys(file_sha, deflection)
+        prefix = "step"
+        load_mesh = lambda: load_step_tri_mesh(path, deflection_value)  # noqa: E731
+        extra_metadata = {"deflection": deflection_value}
+    else:
+        set_key, cache_keys = stl_lod_keys(file_sha)
+        prefix = "stl"
+        load_mesh = lambda: load_stl(path)  # noqa: E731
+        extra_metadata = None
+    cached = read_metadata(set_key) is not None
+    if not cached:
+        ensure_mesh_artifacts(
+            load_mesh,
+            prefix=prefix,
+            file_sha=file_sha,
+            lod=lods_finest_first()[0],
+            set_key=set_key,
+            cache_keys=cache_keys,
+            extra_metadata=extra_metadata,
+        )
+    return {"file_sha": file_sha, "mesh_versions": cache_keys, "cached": cached}
+
+
+def viewer_stream_url(file_url: str | None, path: str, lod: str = "low") -> str:
+    if not file_url:
+        return ""
+    endpoint = "stream-step" if is_brep_file(path) else "stream"
+    return f"/gltf/{endpoint}?" + urllib.parse.urlencode({"file_url": file_url, "lod": lod})
+
+
+@celery_app.task(bind=True)
+def convert_to_gltf(self, file_id: str, file_path: str, file_url: str | None = None, deflection: float | None = None):
+    """Pre-generate the viewer LOD set so the first 3D preview is a cache hit."""
+    try:
+        local_path = file_path
+        validator = None
+        if not local_path and file_url:
+            validator = origin_validator(file_url)
+            local_path = download_to_temp(file_url)
+        if not local_path:
+            raise ValueError("file_path or file_url is required")
+        result = pregenerate_lod_set(local_path, deflection)
+        if validator:
+            remember_file_sha(file_url, result["file_sha"], validator)
+        return {
+            "file_id": file_id,
+            "gltf_url": viewer_stream_url(file_url, local_path),
+            "task_id": self.request.id,
+            **result,
+        }
+    except Exception as e:
+        return {"error": str(e)}
+
+
+def enqueue_gltf_conversion(file_id: str, file_path: str | None, file_url: str | None, deflection: float | None = None):
+    queue, _ = route_for_source(file_path, file_url)
+    return convert_to_gltf.apply_async(args=[file_id, file_path or "", file_url, deflection], queue=queue)
 
 
 @router.post("/{file_id}", response_model=GltfResponse)
 async def create_gltf(file_id: str, request: GltfRequest):
-    task = convert_to_gltf.delay(file_id, request.file_path)
+    if not request.file_path and not request.file_url:
+        raise HTTPException(status_code=400, detail="file_path or file_url is required")
+    # Routing may HEAD the URL or scan the file, so keep it off the event loop
+    task = await asyncio.to_thread(enqueue_gltf_conversion, file_id, request.file_path, request.file_url, request.deflection)
     return {
         "file_id": file_id,
         "gltf_url": "",
@@ -158,44 +608,49 @@ async def create_gltf(file_id: str, request: GltfRequest):
     }
 
 
-@router.get("/{task_id}", response_model=GltfResponse)
-async def get_gltf_status(task_id: str):
-    task = convert_to_gltf.AsyncResult(task_id)
-    if task.ready():
-        result = task.get()
-        if "error" in result:
-            raise HTTPException(status_code=400, detail=result["error"])
-        return result
-    raise HTTPException(status_code=202, detail="Conversion in progress")
-
-
 @router.get("/stream")
-async def stream_gltf(file_url: str = Query(...), lod: str = Query("low")):
+async def stream_gltf(
+    file_url: str = Query(...),
+    lod: str = Query("low"),
+    encoding: str = Query("raw"),
+    compression: str = Query("none"),
+    if_none_match: str | None = Header(None),
+):
     """On-demand GLB streaming for mesh inputs (STL)."""
     if not file_url:
         raise HTTPException(status_code=400, detail=MISSING_FILE_URL_ERROR)
+    encoding_value = resolve_encoding(encoding)
+    compression = resolve_compression(compression)
+    lod_value = resolve_lod(lod)
+    # Taken before the download, so a change mid-download can only invalidate the mapping
+    validator = await asyncio.to_thread(origin_validator, file_url)
+    known_sha = await asyncio.to_thread(known_file_sha, file_url, validator) if if_none_match else None
+    if known_sha:
+        cache_key = stl_lod_keys(known_sha)[1][lod_value]
+        if etag_matches(glb_etag(cache_key, encoding_value, compression), if_none_match):
+            return not_modified_response(cache_key, encoding_value, compression)
     try:
-        ensure_cache_dir()
-        path = download_to_temp(file_url)
-        lod_value = resolve_lod(lod)
-        target = lod_target(lod_value)
-        file_sha = sha256_of_file(path)
-        cache_key = build_mesh_key("stl", file_sha, lod_value, target)
-        cache_path = mesh_cache_path(cache_key)
-        if cache_path.exists():
-            headers = {"X-Mesh-Version": cache_key, "Cache-Control": CACHE_CONTROL_HEADER}
-            return Response(content=cache_path.read_bytes(), media_type=GLB_MIME_TYPE, headers=headers)
-        mesh = load_stl(path)
-        mesh = simplify_mesh(mesh, target)
-        glb_bytes = mesh.export(file_type="glb")
-        try:
-            cache_path.write_bytes(glb_bytes)
-        except Exception:
-            pass
-        metadata = build_mesh_metadata(mesh, prefix="stl", file_sha=file_sha, lod=lod_value, target=target)
-        write_metadata(cache_key, metadata)
-        headers = {"X-Mesh-Version": metadata["mesh_version"], "Cache-Control": CACHE_CONTROL_HEADER}
-        return Response(content=glb_bytes, media_type=GLB_MIME_TYPE, headers=headers)
+        path = await asyncio.to_thread(download_to_temp, file_url)
+        file_sha = await asyncio.to_thread(sha256_of_file, path)
+        await asyncio.to_thread(remember_file_sha, file_url, file_sha, validator)
+        set_key, cache_keys = stl_lod_keys(file_sha)
+        cache_key = cache_keys[lod_value]
+        if etag_matches(glb_etag(cache_key, encoding_value, compression), if_none_match):
+            return not_modified_response(cache_key, encoding_value, compression)
+        cached_path = artifact_cache.path(mesh_cache_name(cache_key, encoding_value))
+        if cached_path is not None:
+            return glb_response(cache_key, encoding_value, compression, cache_path=cached_path)
+        metadata, glb_bytes = await asyncio.to_thread(
+            ensure_glb_bytes,
+            lambda: load_stl(path),
+            encoding=encoding_value,
+            prefix="stl",
+            file_sha=file_sha,
+            lod=lod_value,
+            set_key=set_key,
+            cache_keys=cache_keys,
+        )
+        return glb_response(metadata["mesh_version"], encoding_value, compression, glb_bytes)
     except Exception as exc:
         raise HTTPException(status_code=400, detail=str(exc)) from exc
 
@@ -205,71 +660,94 @@ async def stream_gltf_metadata(file_url: str = Query(...), lod: str = Query("low
     if not file_url:
         raise HTTPException(status_code=400, detail=MISSING_FILE_URL_ERROR)
     try:
-        ensure_cache_dir()
-        path = download_to_temp(file_url)
+        path = await asyncio.to_thread(download_to_temp, file_url)
         lod_value = resolve_lod(lod)
-        target = lod_target(lod_value)
-        file_sha = sha256_of_file(path)
-        cache_key = build_mesh_key("stl", file_sha, lod_value, target)
-        cached = read_metadata(cache_key)
+        file_sha = await asyncio.to_thread(sha256_of_file, path)
+        set_key, cache_keys = stl_lod_keys(file_sha)
+        cached = await asyncio.to_thread(read_lod_metadata, set_key, lod_value)
         if cached:
             return cached
-        mesh = load_stl(path)
-        mesh = simplify_mesh(mesh, target)
-        metadata = build_mesh_metadata(mesh, prefix="stl", file_sha=file_sha, lod=lod_value, target=target)
-        write_metadata(cache_key, metadata)
+        metadata, _ = await asyncio.to_thread(
+            ensure_mesh_artifacts,
+            lambda: load_stl(path),
+            prefix="stl",
+            file_sha=file_sha,
+            lod=lod_value,
+            set_key=set_key,
+            cache_keys=cache_keys,
+        )
         return metadata
     except Exception as exc:
         raise HTTPException(status_code=400, detail=str(exc)) from exc
 
 
-def build_step_cache_key(file_sha: str, lod: str, deflection: float) -> str:
-    payload = f"{file_sha}|{lod}|{deflection:.5f}".encode()
+def build_step_cache_key(file_sha: str, lod: str, deflection: float | None) -> str:
+    tessellation = f"{deflection:.5f}" if deflection is not None else f"budget:{STEP_TRIANGLE_BUDGET}"
+    payload = f"{file_sha}|{lod}|{tessellation}".encode()
     return hashlib.sha256(payload).hexdigest()
 
 
+def step_lod_keys(file_sha: str, deflection: float | None) -> tuple[float | None, str, dict[str, str]]:
+    """(tessellation deflection, set key, per-LOD GLB cache keys) for a STEP source.
+
+    All LODs come from one tessellation, sized to STEP_TRIANGLE_BUDGET (or at
+    the caller's explicit deflection), and are decimated from there.
+    """
+    deflection_value = float(deflection) if deflection is not None else None
+    cache_keys = {lod: build_step_cache_key(file_sha, lod, deflection_value) for lod in DEFAULT_LODS}
+    return deflection_value, build_step_cache_key(file_sha, "lods", deflection_value), cache_keys
+
+
 @router.get("/stream-step")
 async def stream_step_to_glb(
     file_url: str = Query(...),
     lod: str = Query("low"),
     deflection: float | None = Query(None),
+    encoding: str = Query("raw"),
+    compression: str = Query("none"),
+    if_none_match: str | None = Header(None),
 ):
-    """Stream GLB generated from STEP via OCC triangulation."""
+    """Stream GLB generated from STEP, IGES or BREP via OCC triangulation.
+
+    The format is sniffed from the downloaded bytes, not the URL extension.
+    """
     if not occ_available():
         raise HTTPException(status_code=400, detail="pythonOCC is required for STEP->GLB")
     if not file_url:
         raise HTTPException(status_code=400, detail=MISSING_FILE_URL_ERROR)
+    encoding_value = resolve_encoding(encoding)
+    compression = resolve_compression(compression)
+    lod_value = resolve_lod(lod)
+    # Taken before the download, so a change mid-download can only invalidate the mapping
+    validator = await asyncio.to_thread(origin_validator, file_url)
+    known_sha = await asyncio.to_thread(known_file_sha, file_url, validator) if if_none_match else None
+    if known_sha:
+        cache_key = step_lod_keys(known_sha, deflection)[2][lod_value]
+        if etag_matches(glb_etag(cache_key, encoding_value, compression), if_none_match):
+            return not_modified_response(cache_key, encoding_value, compression)
     try:
-        ensure_cache_dir()
-        path = download_to_temp(file_url)
-        lod_value = resolve_lod(lod)
-        target = lod_target(lod_value)
-        deflection_value = float(deflection) if deflection is not None else STEP_DEFLECTION_BY_LOD[lod_value]
-        file_sha = sha256_of_file(path)
-        cache_key = build_step_cache_key(file_sha, lod_value, deflection_value)
-        cache_path = mesh_cache_path(cache_key)
-        if cache_path.exists():
-            headers = {"X-Mesh-Version": cache_key, "Cache-Control": CACHE_CONTROL_HEADER}
-            return Response(content=cache_path.read_bytes(), media_type=GLB_MIME_TYPE, headers=headers)
-        mesh = load_step_tri_mesh(path, deflection_value)
-        mesh = simplify_mesh(mesh, target)
-        glb_bytes = mesh.export(file_type="glb")
-        try:
-            cache_path.write_bytes(glb_bytes)
-        except Exception:
-            pass
-        metadata = build_mesh_metadata(
-            mesh,
+        path = await asyncio.to_thread(download_to_temp, file_url)
+        file_sha = await asyncio.to_thread(sha256_of_file, path)
+        await asyncio.to_thread(remember_file_sha, file_url, file_sha, validator)
+        deflection_value, set_key, cache_keys = step_lod_keys(file_sha, deflection)
+        cache_key = cache_keys[lod_value]
+        if etag_matches(glb_etag(cache_key, encoding_value, compression), if_none_match):
+            return not_modified_response(cache_key, encoding_value, compression)
+        cached_path = artifact_cache.path(mesh_cache_name(cache_key, encoding_value))
+        if cached_path is not None:
+            return glb_response(cache_key, encoding_value, compression, cache_path=cached_path)
+        _, glb_bytes = await asyncio.to_thread(
+            ensure_glb_bytes,
+            lambda: load_step_tri_mesh(path, deflection_value),
+            encoding=encoding_value,
             prefix="step",
             file_sha=file_sha,
             lod=lod_value,
-            target=target,
-            mesh_version=cache_key,
+            set_key=set_key,
+            cache_keys=cache_keys,
+            extra_metadata={"deflection": deflection_value},
         )
-        metadata["deflection"] = deflection_value
-        write_metadata(cache_key, metadata)
-        headers = {"X-Mesh-Version": cache_key, "Cache-Control": CACHE_CONTROL_HEADER}
-        return Response(content=glb_bytes, media_type=GLB_MIME_TYPE, headers=headers)
+        return glb_response(cache_key, encoding_value, compression, glb_bytes)
     except Exception as exc:
         raise HTTPException(status_code=400, detail=str(exc)) from exc
 
@@ -285,28 +763,46 @@ async def stream_step_metadata(
     if not file_url:
         raise HTTPException(status_code=400, detail=MISSING_FILE_URL_ERROR)
     try:
-        ensure_cache_dir()
-        path = download_to_temp(file_url)
+        path = await asyncio.to_thread(download_to_temp, file_url)
         lod_value = resolve_lod(lod)
-        target = lod_target(lod_value)
-        deflection_value = float(deflection) if deflection is not None else STEP_DEFLECTION_BY_LOD[lod_value]
-        file_sha = sha256_of_file(path)
-        cache_key = build_step_cache_key(file_sha, lod_value, deflection_value)
-        cached = read_metadata(cache_key)
+        file_sha = await asyncio.to_thread(sha256_of_file, path)
+        deflection_value, set_key, cache_keys = step_lod_keys(file_sha, deflection)
+        cached = await asyncio.to_thread(read_lod_metadata, set_key, lod_value)
         if cached:
             return cached
-        mesh = load_step_tri_mesh(path, deflection_value)
-        mesh = simplify_mesh(mesh, target)
-        metadata = build_mesh_metadata(
-            mesh,
+        metadata, _ = await asyncio.to_thread(
+            ensure_mesh_artifacts,
+            lambda: load_step_tri_mesh(path, deflection_value),
             prefix="step",
             file_sha=file_sha,
             lod=lod_value,
-            target=target,
-            mesh_version=cache_key,
+            set_key=set_key,
+            cache_keys=cache_keys,
+            extra_metadata={"deflection": deflection_value},
         )
-        metadata["deflection"] = deflection_value
-        write_metadata(cache_key, metadata)
         return metadata
     except Exception as exc:
         raise HTTPException(status_code=400, detail=str(exc)) from exc
+
+
+@router.get("/cache/stats")
+async def artifact_cache_stats():
+    """Hit/miss/eviction counters and usage of this replica's GLB artifact cache."""
+    return artifact_cache.stats()
+
+
+# Registered last so the literal /stream and /metadata paths above take precedence
+@router.get("/{task_id}", response_model=GltfResponse)
+async def get_gltf_status(task_id: str, wait: float = Query(0, ge=0, le=MAX_WAIT_S)):
+    """Return the conversion result; with ``wait`` (seconds), long-poll until it is ready."""
+    if wait:
+        meta = await wait_for_task_meta(task_id, wait)
+    else:
+        meta = await fetch_task_meta(task_id)
+    entry = summarize_task_meta(meta)
+    if "result" in entry:
+        return entry["result"]
+    if "error" in entry:
+        status_code = 400 if entry["status"] == "SUCCESS" else 500
+        raise HTTPException(status_code=status_code, detail=entry["error"])
+    raise HTTPException(status_code=202, detail="Conversion in progress")
@@ -0,0 +1,203 @@
+"""
+Compressed and archived CAD inputs.
+
+Customers upload gzip-compressed models (``part.stp.gz``, gzip STEPZ) and
+zip bundles (several parts, or a zip STEPZ holding one STEP). The download
+size cap applies to the compressed bytes, so compressed uploads allow
+larger models without using more bandwidth.
+
+Archives are recognised by magic bytes, not extension. Members are streamed
+to scratch files a chunk at a time and never held in memory. Decompression
+is bounded so a small archive cannot fill the disk:
+
+- the total decompressed size is capped (``max_bytes``);
+- decompressed/compressed size may not exceed ``max_ratio``, checked as
+  bytes are written, since zip headers can lie about sizes;
+- at most ``max_members`` models are extracted.
+
+Only members that sniff as a CAD model (STEP, IGES, BREP, STL) are kept.
+Directories, OS metadata and nested archives are skipped.
+
+Configuration:
+    CAD_ARCHIVE_MAX_BYTES    decompressed byte cap per archive (default 1 GiB)
+    CAD_ARCHIVE_MAX_RATIO    compression-ratio cap (default 200)
+    CAD_ARCHIVE_MAX_MEMBERS  models per archive (default 64)
+"""
+from __future__ import annotations
+
+import contextlib
+import gzip
+import os
+import struct
+import tempfile
+import zipfile
+from dataclasses import dataclass
+from pathlib import PurePosixPath
+from typing import Iterator, List, Optional
+
+from ..loaders.cad_loader import FORMAT_BY_EXT, sniff_cad_format
+
+MAX_BYTES = int(os.getenv("CAD_ARCHIVE_MAX_BYTES", str(1024 ** 3)))
+MAX_RATIO = float(os.getenv("CAD_ARCHIVE_MAX_RATIO", "200"))
+MAX_MEMBERS = int(os.getenv("CAD_ARCHIVE_MAX_MEMBERS", "64"))
+CHUNK_BYTES = 1024 * 1024
+# Ratio limits only start counting past this many output bytes (tiny files compress absurdly well)
+RATIO_GRACE_BYTES = 1024 * 1024
+GZIP_MAGIC = b"\x1f\x8b"
+ZIP_MAGIC = b"PK\x03\x04"
+COMPRESSED_SUFFIXES = (".gz", ".gzip", ".stpz", ".stepz", ".zip")
+
+
+class ArchiveLimitExceeded(ValueError):
+    """Decompressing the archive would exceed the size, ratio or member limits."""
+
+
+@dataclass
+class ArchiveMember:
+    name: str
+    path: str
+    fmt: str
+    size_bytes: int
+
+
+def archive_kind(path: str) -> Optional[str]:
+    """"gzip" or "zip" if the file is a compressed container, else None."""
+    with open(path, "rb") as fh:
+        head = fh.read(4)
+    if head.startswith(GZIP_MAGIC):
+        return "gzip"
+    if head == ZIP_MAGIC:
+        return "zip"
+    return None
+
+
+def declared_size(path: str) -> Optional[int]:
+    """Uncompressed size recorded in the archive (unverified), for cost estimates."""
+    kind = archive_kind(path)
+    if kind == "gzip":
+        # ISIZE trailer: uncompressed size mod 2^32
+        with open(path, "rb") as fh:
+            fh.seek(-4, os.SEEK_END)
+            return struct.unpack("<I", fh.read(4))[0]
+    if kind == "zip":
+        with zipfile.ZipFile(path) as zf:
+            return sum(info.file_size for info in zf.infolist() if not info.is_dir())
+    return None
+
+
+def member_format(name: str) -> Optional[str]:
+    """Format implied by a member name, ignoring compression suffixes."""
+    stem = name
+    while os.path.splitext(stem)[1].lower() in COMPRESSED_SUFFIXES:
+        stem = os.path.splitext(stem)[0]
+    return FORMAT_BY_EXT.get(os.path.splitext(stem)[1].lower())
+
+
+class _Budget:
+    """Running decompressed-byte count against the size and ratio caps."""
+
+    def __init__(self, compressed_bytes: int, max_bytes: int, max_ratio: float):
+        self.compressed_bytes = max(compressed_bytes, 1)
+        self.max_bytes = max_bytes
+        self.max_ratio = max_ratio
+        self.written = 0
+
+    def add(self, n: int) -> None:
+        self.written += n
+        if self.written > self.max_bytes:
+            raise ArchiveLimitExceeded(f"Archive expands beyond {self.max_bytes} bytes")
+        if self.written > RATIO_GRACE_BYTES and self.written > self.compressed_bytes * self.max_ratio:
+            raise ArchiveLimitExceeded(f"Archive compression ratio exceeds {self.max_ratio:g}")
+
+
+def _stream_to_scratch(src, name: str, budget: _Budget) -> str:
+    fd, path = tempfile.mkstemp(suffix=os.path.splitext(name)[1].lower())
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while chunk := src.read(CHUNK_BYTES):
+                budget.add(len(chunk))
+                out.write(chunk)
+    except BaseException:
+        os.remove(path)
+        raise
+    return path
+
+
+def _keep_if_model(name: str, path: str, members: List[ArchiveMember]) -> None:
+    fmt = None if archive_kind(path) else sniff_cad_format(path) or member_format(name)
+    if fmt is None:
+        os.remove(path)
+        return
+    members.append(ArchiveMember(name=name, path=path, fmt=fmt, size_bytes=os.path.getsize(path)))
+
+
+def _skip_zip_member(info: zipfile.ZipInfo) -> bool:
+    parts = PurePosixPath(info.filename).parts
+    return info.is_dir() or not parts or parts[0] == "__MACOSX" or parts[-1].startswith(".")
+
+
+def extract_models(
+    path: str,
+    *,
+    max_bytes: int = MAX_BYTES,
+    max_ratio: float = MAX_RATIO,
+    max_members: int = MAX_MEMBERS,
+    name: Optional[str] = None,
+) -> List[ArchiveMember]:
+    """Decompress the CAD models in a gzip or zip file to scratch files.
+
+    ``name`` is the original file name, used to name a gzip's single member.
+    The caller owns the returned files (see ``extracted_models``). Raises
+    ArchiveLimitExceeded when a limit is hit and ValueError when the archive
+    holds no CAD model.
+    """
+    kind = archive_kind(path)
+    budget = _Budget(os.path.getsize(path), max_bytes, max_ratio)
+    members: List[ArchiveMember] = []
+    try:
+        if kind == "gzip":
+            inner = os.path.basename(name or path)
+            while os.path.splitext(inner)[1].lower() in (".gz", ".gzip"):
+                inner = os.path.splitext(inner)[0]
+            with gzip.open(path, "rb") as src:
+                scratch = _stream_to_scratch(src, inner, budget)
+            _keep_if_model(inner, scratch, members)
+        elif kind == "zip":
+            with zipfile.ZipFile(path) as zf:
+                for info in zf.infolist():
+                    if _skip_zip_member(info):
+                        continue
+                    if len(members) >= max_members:
+                        raise ArchiveLimitExceeded(f"Archive holds more than {max_members} models")
+                    # Cheap rejection first; the streamed count is what is enforced
+                    if budget.written + info.file_size > max_bytes:
+                        raise ArchiveLimitExceeded(f"Archive expands beyond {max_bytes} bytes")
+                    with zf.open(info) as src:
+                        scratch = _stream_to_scratch(src, info.filename, budget)
+                    _keep_if_model(info.filename, scratch, members)
+        else:
+            raise ValueError("Not a gzip or zip archive")
+    except BaseException:
+        remove_members(members)
+        raise
+    if not members:
+        raise ValueError("Archive contains no STEP, IGES, BREP or STL model")
+    return members
+
+
+def remove_members(members: List[ArchiveMember]) -> None:
+    for member in members:
+        try:
+            os.remove(member.path)
+        except OSError:
+            pass
+
+
+@contextlib.contextmanager
+def extracted_models(path: str, **kwargs) -> Iterator[List[ArchiveMember]]:
+    """``extract_models`` whose scratch files are removed on exit."""
+    members = extract_models(path, **kwargs)
+    try:
+        yield members
+    finally:
+        remove_members(members)
@@ -0,0 +1,352 @@
+"""
+Bounded cache for generated artifacts (viewer GLBs and their sidecars,
+converted STL/OBJ files).
+
+Artifacts live in a local directory so they can be served with sendfile. The
+directory is capped at a byte budget, and least-recently-used files are
+evicted first. File mtime is the LRU clock and is bumped on every hit, so all
+processes sharing the directory agree on the order. Each instance keeps a
+running index of sizes, updated on its own writes and evictions. The index is
+reconciled with the directory every CAD_ARTIFACT_CACHE_RESCAN_S seconds and on
+every eviction, so writes from other processes (conversion kernel helpers,
+workers) count against the same budget without a directory scan per write.
+
+An optional shared backend sits behind the local tier so replicas reuse each
+other's meshes. It is either S3-compatible object storage or a shared
+filesystem (also the stand-in used in tests). A local miss checks the shared
+store and pulls the artifact in.
+
+Configuration:
+    CAD_ARTIFACT_CACHE_DIR        local directory (default /tmp/gltf-cache)
+    CAD_ARTIFACT_CACHE_MAX_BYTES  local byte budget (default 2 GiB)
+    CAD_ARTIFACT_CACHE_RESCAN_S   seconds between reconciling the index with disk (default 30)
+    CAD_ARTIFACT_SHARED_URL       s3://bucket/prefix or file:///shared/path
+    CAD_ARTIFACT_S3_ENDPOINT      endpoint for S3-compatible stores (MinIO, R2, ...)
+"""
+from __future__ import annotations
+
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+import urllib.parse
+from pathlib import Path
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = Path(os.getenv("CAD_ARTIFACT_CACHE_DIR", "/tmp/gltf-cache"))
+MAX_BYTES = int(os.getenv("CAD_ARTIFACT_CACHE_MAX_BYTES", str(2 * 1024 ** 3)))
+SHARED_URL = os.getenv("CAD_ARTIFACT_SHARED_URL")
+S3_ENDPOINT = os.getenv("CAD_ARTIFACT_S3_ENDPOINT")
+RESCAN_INTERVAL_S = float(os.getenv("CAD_ARTIFACT_CACHE_RESCAN_S", "30"))
+# Eviction frees space down to this fraction of the budget, so it does not run on every write
+LOW_WATERMARK = 0.9
+
+
+def _write_atomic(path: Path, data: bytes) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+    try:
+        with os.fdopen(fd, "wb") as fh:
+            fh.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+class FilesystemBackend:
+    """Shared store on a mounted filesystem (NFS/EFS, or a temp dir in tests)."""
+
+    def __init__(self, root: Path | str):
+        self.root = Path(root)
+
+    def get(self, name: str) -> Optional[bytes]:
+        try:
+            return (self.root / name).read_bytes()
+        except FileNotFoundError:
+            return None
+
+    def put(self, name: str, data: bytes) -> None:
+        _write_atomic(self.root / name, data)
+
+    def put_file(self, name: str, src: Path) -> None:
+        dest = self.root / name
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=dest.parent, prefix=f".{dest.name}.")
+        os.close(fd)
+        try:
+            shutil.copyfile(src, tmp_path)
+            os.replace(tmp_path, dest)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    def names(self, prefix: str) -> set[str]:
+        try:
+            with os.scandir(self.root) as it:
+                return {entry.name for entry in it if entry.name.startswith(prefix)}
+        except FileNotFoundError:
+            return set()
+
+
+class S3Backend:
+    """Shared store in an S3-compatible bucket (requires boto3)."""
+
+    def __init__(self, bucket: str, prefix: str = "", client=None, endpoint_url: Optional[str] = S3_ENDPOINT):
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        if client is None:
+            import boto3
+
+            client = boto3.client("s3", endpoint_url=endpoint_url)
+        self.client = client
+
+    def _key(self, name: str) -> str:
+        return f"{self.prefix}/{name}" if self.prefix else name
+
+    def get(self, name: str) -> Optional[bytes]:
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=self._key(name))
+        except self.client.exceptions.NoSuchKey:
+            return None
+        return response["Body"].read()
+
+    def put(self, name: str, data: bytes) -> None:
+        self.client.put_object(Bucket=self.bucket, Key=self._key(name), Body=data)
+
+    def put_file(self, name: str, src: Path) -> None:
+        # Multipart upload straight from disk
+        self.client.upload_file(str(src), self.bucket, self._key(name))
+
+    def names(self, prefix: str) -> set[str]:
+        strip = len(self._key(""))
+        pages = self.client.get_paginator("list_objects_v2").paginate(Bucket=self.bucket, Prefix=self._key(prefix))
+        return {item["Key"][strip:] for page in pages for item in page.get("Contents", [])}
+
+
+def backend_from_url(url: Optional[str]):
+    """Build the shared backend for CAD_ARTIFACT_SHARED_URL, or None."""
+    if not url:
+        return None
+    parsed = urllib.parse.urlparse(url)
+    if parsed.scheme == "s3":
+        return S3Backend(parsed.netloc, parsed.path)
+    if parsed.scheme == "file":
+        return FilesystemBackend(parsed.path)
+    raise ValueError(f"Unsupported artifact store URL: {url}")
+
+
+class ArtifactCache:
+    """Byte-bounded LRU directory of artifacts, optionally backed by a shared store."""
+
+    def __init__(
+        self,
+        root: Path | str = CACHE_DIR,
+        max_bytes: int = MAX_BYTES,
+        shared=None,
+        rescan_interval: float = RESCAN_INTERVAL_S,
+    ):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.shared = shared
+        self.rescan_interval = rescan_interval
+        self._lock = threading.Lock()
+        # name -> size of the local artifacts, and their total
+        self._sizes: dict[str, int] = {}
+        self._bytes = 0
+        self._scanned_at: Optional[float] = None
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.evicted_bytes = 0
+
+    def _local(self, name: str) -> Path:
+        if "/" in name or name.startswith("."):
+            raise ValueError(f"Invalid artifact name: {name}")
+        return self.root / name
+
+    def peek(self, name: str) -> Optional[Path]:
+        """Local path if the artifact is cached here; no stats, no shared lookup."""
+        path = self._local(name)
+        return path if path.exists() else None
+
+    def path(self, name: str) -> Optional[Path]:
+        """Local path for ``name``, pulling it from the shared store if needed."""
+        path = self._local(name)
+        try:
+            os.utime(path)
+            self.hits += 1
+            return path
+        except FileNotFoundError:
+            pass
+        if self.shared is not None:
+            try:
+                data = self.shared.get(name)
+            except Exception as exc:
+                logger.warning(f"Shared artifact store read failed for {name}: {exc}")
+                data = None
+            if data is not None:
+                self._store_local(name, data)
+                self.shared_hits += 1
+                return path
+        self.misses += 1
+        return None
+
+    def read(self, name: str) -> Optional[bytes]:
+        path = self.path(name)
+        if path is None:
+            return None
+        try:
+            return path.read_bytes()
+        except FileNotFoundError:
+            # Evicted by another process in between
+            return None
+
+    def put(self, name: str, data: bytes) -> Path:
+        path = self._store_local(name, data)
+        if self.shared is not None:
+            try:
+                self.shared.put(name, data)
+            except Exception as exc:
+                logger.warning(f"Shared artifact store write failed for {name}: {exc}")
+        return path
+
+    def put_file(self, name: str, src: Path | str) -> Path:
+        """Move the file at ``src`` into the cache as ``name``.
+
+        Large artifacts are written to disk first and never held in memory
+        here; ``src`` is renamed in place when it is on the same filesystem.
+        """
+        path = self._local(name)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+        os.close(fd)
+        try:
+            shutil.move(str(src), tmp_path)
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+        self._account(path)
+        if self.shared is not None:
+            try:
+                self.shared.put_file(name, path)
+            except Exception as exc:
+                logger.warning(f"Shared artifact store write failed for {name}: {exc}")
+        return path
+
+    def names(self, prefix: str) -> set[str]:
+        """Names of the artifacts starting with ``prefix``, here or in the shared store."""
+        names = {path.name for _, _, path in self._entries() if path.name.startswith(prefix)}
+        if self.shared is not None:
+            try:
+                names |= self.shared.names(prefix)
+            except Exception as exc:
+                logger.warning(f"Shared artifact store listing failed for {prefix}: {exc}")
+        return names
+
+    def _store_local(self, name: str, data: bytes) -> Path:
+        path = self._local(name)
+        _write_atomic(path, data)
+        self._account(path)
+        return path
+
+    def _account(self, path: Path) -> None:
+        try:
+            size = path.stat().st_size
+        except FileNotFoundError:
+            size = 0
+        with self._lock:
+            if self._rescan_due():
+                self._reindex(self._entries())
+            else:
+                self._bytes += size - self._sizes.get(path.name, 0)
+                self._sizes[path.name] = size
+            over_budget = self._bytes > self.max_bytes
+        if over_budget:
+            self.evict()
+
+    def _rescan_due(self) -> bool:
+        return self._scanned_at is None or time.monotonic() - self._scanned_at >= self.rescan_interval
+
+    def _reindex(self, entries: list[tuple[float, int, Path]]) -> None:
+        self._sizes = {path.name: size for _, size, path in entries}
+        self._bytes = sum(self._sizes.values())
+        self._scanned_at = time.monotonic()
+
+    def _entries(self) -> list[tuple[float, int, Path]]:
+        entries = []
+        try:
+            with os.scandir(self.root) as it:
+                for entry in it:
+                    if entry.name.startswith(".") or not entry.is_file():
+                        continue
+                    try:
+                        st = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    entries.append((st.st_mtime, st.st_size, Path(entry.path)))
+        except FileNotFoundError:
+            pass
+        return entries
+
+    def evict(self) -> int:
+        """Delete least-recently-used artifacts until under the low watermark.
+
+        Rescans the directory, so writes and evictions by other processes are
+        accounted for, and rebuilds the index from what is left.
+        """
+        with self._lock:
+            entries = sorted(self._entries())
+            total = sum(size for _, size, _ in entries)
+            goal = self.max_bytes * LOW_WATERMARK
+            evicted = 0
+            for _, size, path in entries:
+                if total <= goal:
+                    break
+                try:
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
+                total -= size
+                evicted += 1
+                self.evicted_bytes += size
+            self.evictions += evicted
+            self._reindex(entries[evicted:])
+        if evicted:
+            logger.info(f"Evicted {evicted} artifacts from {self.root}; {total} bytes remain")
+        return evicted
+
+    def stats(self) -> dict:
+        with self._lock:
+            if self._scanned_at is None:
+                self._reindex(self._entries())
+            used = self._bytes
+        return {
+            "hits": self.hits,
+            "shared_hits": self.shared_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "evicted_bytes": self.evicted_bytes,
+            "bytes": used,
+            "max_bytes": self.max_bytes,
+            "shared": type(self.shared).__name__ if self.shared is not None else None,
+            "timestamp": time.time(),
+        }
+
+
+artifact_cache = ArtifactCache(shared=backend_from_url(SHARED_URL))
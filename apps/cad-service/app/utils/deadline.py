@@ -0,0 +1,74 @@
+from __future__ import annotations
+
+import math
+import time
+from typing import List, Optional
+
+# Rough ray-casting throughput used to shrink thickness sampling under a deadline
+THICKNESS_SAMPLES_PER_SECOND = 2000
+MIN_THICKNESS_SAMPLES = 500
+
+
+class Deadline:
+    """Wall-clock budget for a staged analysis.
+
+    Tracks which stages ran, were skipped or failed so the result can report
+    how complete it is. A Deadline built with ``deadline_ms=None`` never
+    expires.
+    """
+
+    def __init__(self, deadline_ms: Optional[int] = None):
+        self.started = time.monotonic()
+        self.expires_at = self.started + deadline_ms / 1000.0 if deadline_ms is not None else None
+        self.completed: List[str] = []
+        self.skipped: List[str] = []
+        self.failed: List[str] = []
+
+    @property
+    def bounded(self) -> bool:
+        return self.expires_at is not None
+
+    def remaining(self) -> float:
+        if self.expires_at is None:
+            return math.inf
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def remaining_ms(self) -> Optional[int]:
+        if self.expires_at is None:
+            return None
+        return int(self.remaining() * 1000)
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0.0
+
+    def allows(self, stage: str) -> bool:
+        """Return True if ``stage`` may start; otherwise record it as skipped."""
+        if self.expired():
+            self.skip(stage)
+            return False
+        return True
+
+    def done(self, stage: str) -> None:
+        self.completed.append(stage)
+
+    def skip(self, stage: str) -> None:
+        self.skipped.append(stage)
+
+    def fail(self, stage: str) -> None:
+        self.failed.append(stage)
+
+    def thickness_samples(self, full: int) -> int:
+        """Ray-casting sample count that fits the remaining budget (about half of it)."""
+        if self.expires_at is None:
+            return full
+        budget = int(self.remaining() * 0.5 * THICKNESS_SAMPLES_PER_SECOND)
+        return max(MIN_THICKNESS_SAMPLES, min(full, budget))
+
+    def completeness(self) -> dict:
+        return {
+            "level": "partial" if self.skipped or self.failed else "full",
+            "completed_stages": list(self.completed),
+            "skipped_stages": list(self.skipped),
+            "failed_stages": list(self.failed),
+            "elapsed_ms": int((time.monotonic() - self.started) * 1000),
+        }
@@ -40,3 +40,60 @@ def sha256_of_file(path: str) -> str:
         for chunk in iter(lambda: f.read(1024 * 1024), b''):
             h.update(chunk)
     return h.hexdigest()
+
+
+async def download_to_temp_async(url: str, client: httpx.AsyncClient, *, max_bytes: int = 80 * 1024 * 1024) -> tuple[str, str]:
+    """Async variant of download_to_temp that also hashes while streaming.
+    Returns (path, sha256 hex digest).
+    """
+    parsed = urllib.parse.urlparse(url)
+    if parsed.scheme not in ("http", "https"):
+        raise ValueError("Only http(s) URLs are supported")
+
+    async with client.stream('GET', url, timeout=30.0) as r:
+        r.raise_for_status()
+        suffix = os.path.splitext(parsed.path)[1].lower() or ""
+        fd, path = tempfile.mkstemp(suffix=suffix)
+        h = hashlib.sha256()
+        size = 0
+        try:
+            with os.fdopen(fd, "wb") as f:
+                async for chunk in r.aiter_bytes():
+                    if chunk:
+                        size += len(chunk)
+                        if size > max_bytes:
+                            raise ValueError("File exceeds maximum allowed size")
+                        h.update(chunk)
+                        f.write(chunk)
+        except Exception:
+            try:
+                os.remove(path)
+            finally:
+                raise
+    return path, h.hexdigest()
+
+
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+
+
+async def save_upload_to_temp(upload, *, suffix: str = "", max_bytes: int | None = None) -> tuple[str, str]:
+    """Stream a FastAPI/Starlette UploadFile to a temporary file in chunks,
+    hashing as it goes. Returns (path, sha256 hex digest).
+    """
+    fd, path = tempfile.mkstemp(suffix=suffix)
+    h = hashlib.sha256()
+    size = 0
+    try:
+        with os.fdopen(fd, "wb") as f:
+            while chunk := await upload.read(UPLOAD_CHUNK_BYTES):
+                size += len(chunk)
+                if max_bytes is not None and size > max_bytes:
+                    raise ValueError("File exceeds maximum allowed size")
+                h.update(chunk)
+                f.write(chunk)
+    except Exception:
+        try:
+            os.remove(path)
+        finally:
+            raise
+    return path, h.hexdigest()
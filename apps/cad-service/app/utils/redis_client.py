@@ -0,0 +1,23 @@
+from __future__ import annotations
+
+from functools import lru_cache
+
+from ..workers.celery import REDIS_URL
+
+
+@lru_cache(maxsize=1)
+def get_redis():
+    """Return a process-wide Redis client for coordination state (locks, caches).
+    Uses the same REDIS_URL as the Celery broker/backend.
+    """
+    import redis
+
+    return redis.Redis.from_url(REDIS_URL)
+
+
+@lru_cache(maxsize=1)
+def get_async_redis():
+    """Return an asyncio Redis client for use on the API event loop."""
+    import redis.asyncio as aioredis
+
+    return aioredis.Redis.from_url(REDIS_URL)
@@ -0,0 +1,183 @@
+"""
+Redis-backed single-flight for expensive, deterministic CAD operations.
+
+Concurrent callers asking for the same (sha256, operation, params) elect one
+leader through a Redis lock. The leader computes and publishes the result;
+followers wait for it instead of repeating the STEP translation/tessellation.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import time
+import uuid
+from typing import Any, Callable, Optional, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+SINGLE_FLIGHT_PREFIX = "cad:sf"
+LOCK_TTL_S = int(os.getenv("CAD_SINGLE_FLIGHT_LOCK_TTL_S", "900"))
+RESULT_TTL_S = int(os.getenv("CAD_SINGLE_FLIGHT_RESULT_TTL_S", "3600"))
+WAIT_TIMEOUT_S = float(os.getenv("CAD_SINGLE_FLIGHT_WAIT_TIMEOUT_S", "600"))
+POLL_INTERVAL_S = 0.25
+
+
+def single_flight_key(file_sha: str, operation: str, params: Optional[dict] = None) -> str:
+    """Stable key for one (sha256, operation, params) computation."""
+    params_json = json.dumps(params or {}, sort_keys=True, default=str)
+    params_digest = hashlib.sha256(params_json.encode()).hexdigest()[:16]
+    return f"{SINGLE_FLIGHT_PREFIX}:{operation}:{file_sha}:{params_digest}"
+
+
+class SingleFlight:
+    """Deduplicate identical computations across API processes and Celery workers.
+
+    Results are JSON-encoded by default and kept for ``result_ttl`` seconds so
+    late arrivals are served without recomputing. If Redis is unreachable, or
+    fails while a follower waits, the computation simply runs locally.
+
+    ``run`` blocks while following a leader; async callers go through
+    ``asyncio.to_thread``.
+    """
+
+    def __init__(
+        self,
+        client=None,
+        *,
+        lock_ttl: int = LOCK_TTL_S,
+        result_ttl: int = RESULT_TTL_S,
+        wait_timeout: float = WAIT_TIMEOUT_S,
+        poll_interval: float = POLL_INTERVAL_S,
+    ):
+        self._redis = client
+        self.lock_ttl = lock_ttl
+        self.result_ttl = result_ttl
+        self.wait_timeout = wait_timeout
+        self.poll_interval = poll_interval
+
+    @property
+    def client(self):
+        if self._redis is None:
+            from .redis_client import get_redis
+
+            self._redis = get_redis()
+        return self._redis
+
+    def peek(
+        self,
+        file_sha: str,
+        operation: str,
+        params: Optional[dict] = None,
+        *,
+        decode: Callable[[bytes], Any] = json.loads,
+    ) -> Any | None:
+        """Return a previously published result, or None."""
+        key = single_flight_key(file_sha, operation, params)
+        try:
+            raw = self.client.get(f"{key}:result")
+        except Exception as exc:
+            logger.warning(f"single-flight peek failed for {key}: {exc}")
+            return None
+        return decode(raw) if raw is not None else None
+
+    def run(
+        self,
+        file_sha: str,
+        operation: str,
+        params: Optional[dict],
+        compute: Callable[[], T],
+        *,
+        encode: Callable[[Any], str | bytes] = json.dumps,
+        decode: Callable[[bytes], Any] = json.loads,
+    ) -> T:
+        """Return ``compute()`` for this key, computing it at most once cluster-wide."""
+        key = single_flight_key(file_sha, operation, params)
+        result_key = f"{key}:result"
+        lock_key = f"{key}:lock"
+        try:
+            client = self.client
+            cached = client.get(result_key)
+            if cached is not None:
+                return decode(cached)
+            pubsub = client.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(key)
+        except Exception as exc:
+            logger.warning(f"single-flight unavailable for {key}, computing locally: {exc}")
+            return compute()
+
+        try:
+            deadline = time.monotonic() + self.wait_timeout
+            while True:
+                token = uuid.uuid4().hex
+                try:
+                    acquired = client.set(lock_key, token, nx=True, ex=self.lock_ttl)
+                    cached = None if acquired else client.get(result_key)
+                except Exception as exc:
+                    logger.warning(f"single-flight lost Redis for {key}, computing locally: {exc}")
+                    return compute()
+                if acquired:
+                    return self._lead(client, key, token, compute, encode, decode)
+                if cached is not None:
+                    return decode(cached)
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                # Woken early by the leader's publish; the poll covers a missed message
+                # or a leader that died without publishing (its lock then expires).
+                try:
+                    pubsub.get_message(timeout=min(self.poll_interval, remaining))
+                except Exception:
+                    # Subscription dropped; keep polling the result key
+                    time.sleep(min(self.poll_interval, remaining))
+        finally:
+            try:
+                pubsub.close()
+            except Exception:
+                pass
+
+        logger.warning(f"single-flight wait timed out for {key}, computing locally")
+        return compute()
+
+    def _lead(self, client, key: str, token: str, compute: Callable[[], T], encode, decode) -> T:
+        lock_key = f"{key}:lock"
+        try:
+            # A previous leader may have published between our last check and the lock.
+            try:
+                cached = client.get(f"{key}:result")
+            except Exception:
+                cached = None
+            if cached is not None:
+                return decode(cached)
+            value = compute()
+            try:
+                client.set(f"{key}:result", encode(value), ex=self.result_ttl)
+                client.publish(key, "done")
+            except Exception as exc:
+                logger.warning(f"single-flight publish failed for {key}: {exc}")
+            return value
+        finally:
+            self._release(client, lock_key, token)
+
+    @staticmethod
+    def _release(client, lock_key: str, token: str) -> None:
+        """Delete the lock only if we still own it (it may have expired and been re-taken)."""
+        try:
+            with client.pipeline() as pipe:
+                pipe.watch(lock_key)
+                owner = pipe.get(lock_key)
+                if owner is not None and owner.decode() == token:
+                    pipe.multi()
+                    pipe.delete(lock_key)
+                    pipe.execute()
+                else:
+                    pipe.unwatch()
+        except Exception as exc:
+            logger.warning(f"single-flight lock release failed for {lock_key}: {exc}")
+
+
+single_flight = SingleFlight()
@@ -0,0 +1,263 @@
+"""
+Shared store of B-rep tessellations, keyed by source file sha256.
+
+Analysis, viewer LODs and STL/OBJ conversion all triangulate the same upload.
+Each triangulation (vertices, faces, per-triangle B-rep face ids) is kept as
+a compressed ``.npz`` with a small JSON manifest of its own (deflections,
+triangle count, whether it was decimated). The coarse-pass triangle counts
+from the budget controller go in one stats file per source file. Nothing is
+read-modify-written, so concurrent writers (kernel helpers, replicas) never
+lose each other's entries. A file's index is assembled by listing its
+manifests.
+
+A consumer that asks for an equal or coarser deflection is served from the
+store without loading the shape. A close match is reused as-is. A much finer
+one is decimated (face ids are kept) to the count the triangle model
+predicts, and the result is stored too, marked as derived: it only
+approximates the deflection it is filed under. Consumers that need the
+mesher's guarantee (wall-thickness analysis) pass ``allow_decimated=False``
+and get only meshed entries, never decimated. Storage goes through ArtifactCache,
+so it is byte-bounded, LRU-evicted and shared across replicas when
+CAD_ARTIFACT_SHARED_URL is set.
+
+Configuration:
+    CAD_TESSELLATION_CACHE_DIR        local directory (default /tmp/tessellation-cache)
+    CAD_TESSELLATION_CACHE_MAX_BYTES  local byte budget (default 4 GiB)
+"""
+from __future__ import annotations
+
+import io
+import json
+import logging
+import os
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Optional
+
+import numpy as np
+
+from ..core.decimation import decimate_labeled
+from ..core.tessellation import (
+    DEFAULT_TRIANGLE_BUDGET,
+    MIN_DEFLECTION_RATIO,
+    TessellationPlan,
+    estimate_triangles,
+    finest_deflection,
+    mesh_to_budget,
+    plan_tessellation,
+    triangulation_arrays,
+)
+from .artifact_cache import SHARED_URL, ArtifactCache, backend_from_url
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = Path(os.getenv("CAD_TESSELLATION_CACHE_DIR", "/tmp/tessellation-cache"))
+MAX_BYTES = int(os.getenv("CAD_TESSELLATION_CACHE_MAX_BYTES", str(4 * 1024 ** 3)))
+# A stored mesh with at most this much more than the needed triangle count is reused as-is
+REUSE_SLACK = 1.25
+# Matching deflections within this relative tolerance count as equal
+DEFLECTION_RTOL = 1e-6
+
+
+@dataclass
+class Tessellation:
+    vertices: np.ndarray
+    faces: np.ndarray
+    face_ids: np.ndarray
+    linear_deflection: float
+    angular_deflection: float
+    # Decimated from a finer mesh rather than meshed at these deflections
+    derived: bool = False
+
+    def to_npz(self) -> bytes:
+        buffer = io.BytesIO()
+        np.savez_compressed(
+            buffer,
+            vertices=self.vertices.astype(np.float32),
+            faces=self.faces.astype(np.uint32),
+            face_ids=self.face_ids.astype(np.int32),
+        )
+        return buffer.getvalue()
+
+    @classmethod
+    def from_npz(cls, data: bytes, linear_deflection: float, angular_deflection: float, derived: bool = False) -> "Tessellation":
+        with np.load(io.BytesIO(data)) as arrays:
+            return cls(
+                vertices=arrays["vertices"].astype(np.float64),
+                faces=arrays["faces"].astype(np.int64),
+                face_ids=arrays["face_ids"],
+                linear_deflection=linear_deflection,
+                angular_deflection=angular_deflection,
+                derived=derived,
+            )
+
+
+class TessellationStore:
+    def __init__(self, cache: ArtifactCache):
+        self.cache = cache
+
+    @staticmethod
+    def _stats_name(file_sha: str) -> str:
+        return f"{file_sha}.tess-stats.json"
+
+    @staticmethod
+    def _entry_name(file_sha: str, linear: float, angular: float, derived: bool) -> str:
+        kind = "derived" if derived else "meshed"
+        return f"{file_sha}-{linear:.6e}-{angular:.4f}-{kind}.tess.npz"
+
+    def _read_json(self, name: str) -> Optional[dict]:
+        data = self.cache.read(name)
+        if data is None:
+            return None
+        try:
+            return json.loads(data)
+        except ValueError:
+            return None
+
+    def read_index(self, file_sha: str) -> dict:
+        """Stored entries of ``file_sha`` (finest first) and its coarse-pass stats, if known."""
+        index: dict = {"entries": []}
+        for name in self.cache.names(f"{file_sha}-"):
+            if name.endswith(".tess.json"):
+                entry = self._read_json(name)
+                if entry is not None:
+                    index["entries"].append(entry)
+        index["entries"].sort(key=lambda e: e["linear_deflection"])
+        stats = self._read_json(self._stats_name(file_sha))
+        if stats is not None:
+            index["stats"] = stats
+        return index
+
+    def put(self, file_sha: str, tessellation: Tessellation, plan: Optional[TessellationPlan] = None) -> None:
+        """Store ``tessellation``; ``plan`` (from mesh_to_budget) records the coarse-pass stats.
+
+        The mesh goes in before its manifest, so a listed entry always has data.
+        """
+        name = self._entry_name(
+            file_sha, tessellation.linear_deflection, tessellation.angular_deflection, tessellation.derived
+        )
+        try:
+            self.cache.put(name, tessellation.to_npz())
+            manifest = {
+                "name": name,
+                "linear_deflection": tessellation.linear_deflection,
+                "angular_deflection": tessellation.angular_deflection,
+                "triangles": int(len(tessellation.faces)),
+                "derived": tessellation.derived,
+            }
+            self.cache.put(name[: -len(".npz")] + ".json", json.dumps(manifest).encode())
+            if plan is not None and plan.coarse_deflection:
+                # The coarse pass is deterministic per file, so concurrent writers agree
+                stats = {
+                    "diagonal": plan.diagonal,
+                    "coarse_deflection": plan.coarse_deflection,
+                    "coarse_triangles": plan.coarse_triangles,
+                    "coarse_flat_triangles": plan.coarse_flat_triangles,
+                }
+                self.cache.put(self._stats_name(file_sha), json.dumps(stats).encode())
+        except Exception as exc:
+            logger.warning(f"Could not store tessellation for {file_sha}: {exc}")
+
+    def _needed_triangles(self, index: dict, entry: dict, linear: float) -> int:
+        stats = index.get("stats")
+        if stats:
+            curved = stats["coarse_triangles"] - stats["coarse_flat_triangles"]
+            return estimate_triangles(curved, stats["coarse_flat_triangles"], stats["coarse_deflection"], linear)
+        return int(entry["triangles"] * entry["linear_deflection"] / linear)
+
+    def lookup(
+        self,
+        file_sha: str,
+        linear: float,
+        angular: float,
+        index: Optional[dict] = None,
+        *,
+        allow_decimated: bool = True,
+    ) -> Optional[Tessellation]:
+        """A tessellation at least as fine as (``linear``, ``angular``), or None.
+
+        Uses the coarsest stored mesh that qualifies, decimated if it is much
+        finer than needed. With ``allow_decimated=False`` only meshed entries
+        qualify and they are returned as stored, however fine.
+        """
+        index = index if index is not None else self.read_index(file_sha)
+        candidates = [
+            e for e in index["entries"]
+            if e["linear_deflection"] <= linear * (1 + DEFLECTION_RTOL)
+            and e["angular_deflection"] <= angular * (1 + DEFLECTION_RTOL)
+            and (allow_decimated or not e.get("derived"))
+        ]
+        for entry in sorted(candidates, key=lambda e: e["linear_deflection"], reverse=True):
+            data = self.cache.read(entry["name"])
+            if data is None:
+                continue
+            stored = Tessellation.from_npz(data, entry["linear_deflection"], entry["angular_deflection"], entry.get("derived", False))
+            needed = self._needed_triangles(index, entry, linear)
+            if not allow_decimated or len(stored.faces) <= needed * REUSE_SLACK:
+                return stored
+            vertices, faces, face_ids = decimate_labeled(stored.vertices, stored.faces, stored.face_ids, needed)
+            derived = Tessellation(vertices, faces, face_ids, linear, angular, derived=True)
+            self.put(file_sha, derived)
+            return derived
+        return None
+
+    def tessellate(
+        self,
+        file_sha: str,
+        load_shape: Callable[[], object],
+        budget: int = DEFAULT_TRIANGLE_BUDGET,
+        *,
+        finest_ratio: float = MIN_DEFLECTION_RATIO,
+        finest_mm: Optional[float] = None,
+        allow_decimated: bool = True,
+    ) -> tuple[Tessellation, dict]:
+        """Budget-driven tessellation (see mesh_to_budget), from the store when possible.
+
+        Returns the tessellation and a description of the plan; ``load_shape``
+        is only called on a miss. ``allow_decimated`` is passed to lookup.
+        """
+        index = self.read_index(file_sha)
+        stats = index.get("stats")
+        if stats:
+            curved = stats["coarse_triangles"] - stats["coarse_flat_triangles"]
+            plan = plan_tessellation(
+                stats["diagonal"],
+                curved,
+                stats["coarse_flat_triangles"],
+                budget,
+                coarse_deflection=stats["coarse_deflection"],
+                finest=finest_deflection(stats["diagonal"], finest_ratio, finest_mm),
+            )
+            hit = self.lookup(
+                file_sha, plan.linear_deflection, plan.angular_deflection, index, allow_decimated=allow_decimated
+            )
+            if hit is not None:
+                plan.triangles = int(len(hit.faces))
+                return hit, {**plan.as_dict(), "source": "store"}
+        shape = load_shape()
+        plan = mesh_to_budget(shape, budget, finest_ratio=finest_ratio, finest_mm=finest_mm)
+        tessellation = Tessellation(*triangulation_arrays(shape), plan.linear_deflection, plan.angular_deflection)
+        self.put(file_sha, tessellation, plan)
+        return tessellation, {**plan.as_dict(), "source": "mesher"}
+
+    def tessellate_at(
+        self,
+        file_sha: str,
+        load_shape: Callable[[], object],
+        linear: float,
+        angular: float,
+    ) -> Tessellation:
+        """Tessellation at an explicit absolute deflection, from the store when possible."""
+        hit = self.lookup(file_sha, linear, angular)
+        if hit is not None:
+            return hit
+        from OCC.Core.BRepMesh import BRepMesh_IncrementalMesh
+
+        shape = load_shape()
+        BRepMesh_IncrementalMesh(shape, linear, False, angular, True).Perform()
+        tessellation = Tessellation(*triangulation_arrays(shape), linear, angular)
+        self.put(file_sha, tessellation)
+        return tessellation
+
+
+tessellation_store = TessellationStore(ArtifactCache(CACHE_DIR, MAX_BYTES, shared=backend_from_url(SHARED_URL)))
@@ -1,14 +1,31 @@
+"""
+Celery app for CAD jobs.
+
+Tasks are routed by estimated cost (see cost_model) onto two queues, each
+served by its own worker pool, e.g.:
+
+    celery -A app.workers.celery worker -Q cad-fast --concurrency=8
+    celery -A app.workers.celery worker -Q cad-heavy --concurrency=2
+"""
 import os
 from celery import Celery
+from celery.signals import worker_process_init, worker_process_shutdown
+from kombu import Queue
+
+from .memory import SOFT_RSS_MB
 
 # Get Redis URL from environment or use default
 REDIS_URL = os.getenv('REDIS_URL', 'redis://redis:6379/0')
 
+FAST_QUEUE = os.getenv('CAD_FAST_QUEUE', 'cad-fast')
+HEAVY_QUEUE = os.getenv('CAD_HEAVY_QUEUE', 'cad-heavy')
+
 # Initialize Celery
 celery_app = Celery(
     'cad',
     broker=os.getenv('CELERY_BROKER_URL', REDIS_URL),
-    backend=os.getenv('CELERY_RESULT_BACKEND', REDIS_URL)
+    backend=os.getenv('CELERY_RESULT_BACKEND', REDIS_URL),
+    include=['app.routers.analyze', 'app.routers.gltf'],
 )
 
 # Configure Celery
@@ -21,5 +38,30 @@ celery_app.conf.update(
     task_track_started=True,
     task_time_limit=3600,  # 1 hour max runtime
     worker_prefetch_multiplier=1,  # Process one task at a time
-    worker_max_tasks_per_child=100  # Restart worker after 100 tasks
+    worker_max_tasks_per_child=100,  # Restart worker after 100 tasks
+    worker_max_memory_per_child=SOFT_RSS_MB * 1024,  # KB; recycle child after a task that left it bloated
+    task_queues=(Queue(FAST_QUEUE), Queue(HEAVY_QUEUE)),
+    task_default_queue=FAST_QUEUE,  # Unrouted tasks are assumed cheap
 )
+
+
+@celery_app.task(name='cad.retrain_cost_model')
+def retrain_cost_model_task():
+    from .cost_model import retrain_cost_model
+    return retrain_cost_model()
+
+
+@worker_process_init.connect
+def warm_kernel_pool(**kwargs):
+    """Start kernel helpers with the child so the first task pays no OCC import."""
+    from .kernel_pool import kernel_pool
+    try:
+        kernel_pool.warm()
+    except Exception as e:
+        print(f"⚠️ Kernel pool warm-up failed: {e}")
+
+
+@worker_process_shutdown.connect
+def stop_kernel_pool(**kwargs):
+    from .kernel_pool import kernel_pool
+    kernel_pool.shutdown()
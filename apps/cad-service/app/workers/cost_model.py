@@ -0,0 +1,277 @@
+"""
+Cost model for CAD jobs: estimates runtime from cheap file statistics and
+routes Celery tasks onto a fast or heavy queue.
+
+Features are file size, format, a STEP entity census (text scan, no kernel)
+and STL triangle count. Coefficients start from hand-tuned priors and are
+refit (ridge regression towards the priors) from stage timings that workers
+record in Redis.
+"""
+from __future__ import annotations
+
+import json
+import logging
+import os
+import re
+import struct
+import urllib.parse
+from dataclasses import dataclass, field, asdict
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from ..loaders.cad_loader import format_for_extension, sniff_cad_format
+from ..utils.archive import archive_kind, declared_size
+from .celery import FAST_QUEUE, HEAVY_QUEUE, celery_app
+
+logger = logging.getLogger(__name__)
+
+# Jobs estimated above this many seconds go to the heavy lane
+HEAVY_THRESHOLD_S = float(os.getenv("CAD_HEAVY_THRESHOLD_S", "20"))
+# /analyze/sync hands jobs estimated above this off to the async path
+SYNC_BUDGET_S = float(os.getenv("CAD_SYNC_BUDGET_S", "25"))
+
+SAMPLES_KEY = "cad:cost:samples"
+MODEL_KEY = "cad:cost:model"
+MAX_SAMPLES = 5000
+RETRAIN_EVERY = 200
+MIN_FIT_SAMPLES = 20
+RIDGE_LAMBDA = 5.0
+
+# Scan at most this much of a STEP file; counts are extrapolated by size beyond it
+CENSUS_SCAN_BYTES = 32 * 1024 * 1024
+STEP_ENTITY_RE = re.compile(rb"#\d+\s*=\s*([A-Z_][A-Z0-9_]*)\s*\(")
+CENSUS_ENTITIES = (
+    "ADVANCED_FACE",
+    "B_SPLINE_SURFACE_WITH_KNOTS",
+    "B_SPLINE_CURVE_WITH_KNOTS",
+    "MANIFOLD_SOLID_BREP",
+    "CYLINDRICAL_SURFACE",
+)
+
+FEATURE_NAMES = ("intercept", "size_mb", "kfaces", "kbsplines", "ktriangles")
+
+# seconds = w . features, per format
+PRIOR_COEFFICIENTS: Dict[str, List[float]] = {
+    "step": [1.0, 0.35, 0.8, 2.0, 0.0],
+    "iges": [1.5, 0.5, 1.0, 2.5, 0.0],
+    # Native BREP needs no translation; size is the only cheap signal
+    "brep": [0.5, 0.2, 0.0, 0.0, 0.0],
+    "stl": [0.5, 0.05, 0.0, 0.0, 0.03],
+    "other": [1.0, 0.3, 0.0, 0.0, 0.0],
+}
+
+@dataclass
+class FileProfile:
+    """Cheap statistics describing how expensive a CAD file is to process."""
+    size_bytes: int
+    fmt: str
+    entity_counts: Dict[str, int] = field(default_factory=dict)
+    triangle_count: int = 0
+
+    def features(self) -> List[float]:
+        size_mb = self.size_bytes / (1024 * 1024)
+        faces = self.entity_counts.get("ADVANCED_FACE")
+        bsplines = self.entity_counts.get("B_SPLINE_SURFACE_WITH_KNOTS")
+        if self.fmt in ("step", "iges") and faces is None:
+            # No census (e.g. only a HEAD request): typical STEP density is ~250 faces/MB
+            faces = int(size_mb * 250)
+            bsplines = int(size_mb * 40)
+        triangles = self.triangle_count
+        if self.fmt == "stl" and not triangles:
+            triangles = int(self.size_bytes / 50)
+        return [
+            1.0,
+            size_mb,
+            (faces or 0) / 1000.0,
+            (bsplines or 0) / 1000.0,
+            triangles / 1000.0,
+        ]
+
+
+def format_for_path(path: str) -> str:
+    """Format by extension, for remote files known only by URL."""
+    return format_for_extension(path) or "other"
+
+
+def step_entity_census(path: str, *, scan_bytes: int = CENSUS_SCAN_BYTES) -> Dict[str, int]:
+    """Count STEP entity instances by type with a text scan of the DATA section."""
+    counts: Dict[str, int] = {}
+    scanned = 0
+    tail = b""
+    with open(path, "rb") as fh:
+        while scanned < scan_bytes:
+            chunk = fh.read(1024 * 1024)
+            if not chunk:
+                break
+            scanned += len(chunk)
+            # Keep the partial last line so entities split across chunks are counted once
+            buf = tail + chunk
+            cut = buf.rfind(b";")
+            if cut < 0:
+                tail = buf
+                continue
+            tail = buf[cut + 1:]
+            for match in STEP_ENTITY_RE.finditer(buf, 0, cut + 1):
+                name = match.group(1).decode()
+                counts[name] = counts.get(name, 0) + 1
+    total_size = os.path.getsize(path)
+    if scanned and total_size > scanned:
+        factor = total_size / scanned
+        counts = {name: int(count * factor) for name, count in counts.items()}
+    counts["_total"] = sum(counts.values())
+    return {name: counts[name] for name in (*CENSUS_ENTITIES, "_total") if name in counts}
+
+
+def stl_triangle_count(path: str) -> int:
+    """Triangle count from the binary STL header, or an estimate for ASCII STL."""
+    size = os.path.getsize(path)
+    with open(path, "rb") as fh:
+        header = fh.read(84)
+    if len(header) == 84:
+        (count,) = struct.unpack("<I", header[80:84])
+        if 84 + count * 50 == size:
+            return int(count)
+    # ASCII: roughly 250 bytes per facet block
+    return int(size / 250)
+
+
+def profile_file(path: str) -> FileProfile:
+    """Profile a local file without touching the CAD kernel."""
+    if archive_kind(path):
+        # Size by what the archive declares it expands to; contents are not scanned
+        try:
+            size = declared_size(path) or os.path.getsize(path)
+        except Exception as exc:
+            logger.warning(f"Archive profiling failed for {path}: {exc}")
+            size = os.path.getsize(path)
+        return FileProfile(size_bytes=size, fmt="other")
+    fmt = sniff_cad_format(path) or "other"
+    profile = FileProfile(size_bytes=os.path.getsize(path), fmt=fmt)
+    try:
+        if fmt == "step":
+            profile.entity_counts = step_entity_census(path)
+        elif fmt == "stl":
+            profile.triangle_count = stl_triangle_count(path)
+    except Exception as exc:
+        logger.warning(f"File profiling failed for {path}: {exc}")
+    return profile
+
+
+def profile_url(url: str) -> Optional[FileProfile]:
+    """Profile a remote file from a HEAD request (size + extension only)."""
+    import httpx
+
+    try:
+        r = httpx.head(url, timeout=5.0, follow_redirects=True)
+        r.raise_for_status()
+        size = int(r.headers.get("content-length", "0"))
+    except Exception as exc:
+        logger.warning(f"HEAD profiling failed for {url}: {exc}")
+        return None
+    path = urllib.parse.urlparse(url).path
+    return FileProfile(size_bytes=size, fmt=format_for_path(path))
+
+
+class CostModel:
+    """Linear runtime model per format: seconds = coefficients[fmt] . features."""
+
+    def __init__(self, coefficients: Optional[Dict[str, List[float]]] = None):
+        self.coefficients = {fmt: list(w) for fmt, w in PRIOR_COEFFICIENTS.items()}
+        if coefficients:
+            self.coefficients.update({fmt: list(w) for fmt, w in coefficients.items()})
+
+    def estimate_seconds(self, profile: FileProfile) -> float:
+        weights = self.coefficients.get(profile.fmt, self.coefficients["other"])
+        return max(0.0, float(np.dot(weights, profile.features())))
+
+    def fit(self, samples: List[dict]) -> Dict[str, int]:
+        """Refit coefficients from recorded samples, shrinking towards the priors.
+        Returns the number of samples used per format.
+        """
+        by_format: Dict[str, List[dict]] = {}
+        for sample in samples:
+            by_format.setdefault(sample["profile"]["fmt"], []).append(sample)
+
+        used: Dict[str, int] = {}
+        for fmt, rows in by_format.items():
+            if len(rows) < MIN_FIT_SAMPLES:
+                continue
+            X = np.array([FileProfile(**row["profile"]).features() for row in rows])
+            y = np.array([row["seconds"] for row in rows])
+            prior = np.array(PRIOR_COEFFICIENTS.get(fmt, PRIOR_COEFFICIENTS["other"]))
+            reg = RIDGE_LAMBDA * np.eye(X.shape[1])
+            weights = np.linalg.solve(X.T @ X + reg, X.T @ y + RIDGE_LAMBDA * prior)
+            # Runtime never decreases with size/complexity
+            self.coefficients[fmt] = [float(w) for w in np.maximum(weights, 0.0)]
+            used[fmt] = len(rows)
+        return used
+
+    def to_json(self) -> str:
+        return json.dumps({"coefficients": self.coefficients, "features": FEATURE_NAMES})
+
+    @classmethod
+    def from_json(cls, raw: str | bytes) -> "CostModel":
+        return cls(json.loads(raw).get("coefficients"))
+
+
+def load_cost_model() -> CostModel:
+    """Return the trained model from Redis, or the priors."""
+    try:
+        from ..utils.redis_client import get_redis
+
+        raw = get_redis().get(MODEL_KEY)
+        if raw:
+            return CostModel.from_json(raw)
+    except Exception as exc:
+        logger.warning(f"Could not load cost model, using priors: {exc}")
+    return CostModel()
+
+
+def choose_queue(estimated_seconds: float) -> str:
+    return HEAVY_QUEUE if estimated_seconds >= HEAVY_THRESHOLD_S else FAST_QUEUE
+
+
+def route_for_profile(profile: Optional[FileProfile], model: Optional[CostModel] = None) -> tuple[str, float | None]:
+    """Return (queue, estimated seconds). Unknown files go to the fast lane."""
+    if profile is None:
+        return FAST_QUEUE, None
+    estimate = (model or load_cost_model()).estimate_seconds(profile)
+    return choose_queue(estimate), estimate
+
+
+def route_for_source(file_path: Optional[str], file_url: Optional[str] = None) -> tuple[str, float | None]:
+    """Route a job from a local path if this node has it, else from a HEAD of the URL."""
+    if file_path and os.path.exists(file_path):
+        return route_for_profile(profile_file(file_path))
+    if file_url:
+        return route_for_profile(profile_url(file_url))
+    return route_for_profile(None)
+
+
+def record_stage_timing(profile: FileProfile, stage: str, seconds: float) -> None:
+    """Append a (profile, seconds) sample; periodically schedule a retrain."""
+    try:
+        from ..utils.redis_client import get_redis
+
+        client = get_redis()
+        sample = json.dumps({"profile": asdict(profile), "stage": stage, "seconds": seconds})
+        length = client.lpush(SAMPLES_KEY, sample)
+        client.ltrim(SAMPLES_KEY, 0, MAX_SAMPLES - 1)
+        if length % RETRAIN_EVERY == 0:
+            celery_app.send_task("cad.retrain_cost_model", queue=FAST_QUEUE)
+    except Exception as exc:
+        logger.warning(f"Could not record stage timing: {exc}")
+
+
+def retrain_cost_model(stage: str = "analyze") -> Dict[str, int]:
+    """Fit a new model from recorded samples of ``stage`` and publish it."""
+    from ..utils.redis_client import get_redis
+
+    client = get_redis()
+    samples = [json.loads(raw) for raw in client.lrange(SAMPLES_KEY, 0, -1)]
+    model = CostModel()
+    used = model.fit([s for s in samples if s.get("stage") == stage])
+    if used:
+        client.set(MODEL_KEY, model.to_json())
+    return used
@@ -0,0 +1,322 @@
+"""
+Supervised subprocess pool for CAD kernel operations.
+
+Malformed STEP/IGES files can make STEPControl_Reader or BRepMesh spin for an
+hour or segfault. Kernel calls therefore run in pre-warmed helper processes
+(``python -m app.workers.kernel_pool``) that talk to the parent over a pipe.
+The parent enforces a per-call deadline: a hung call kills its helper and
+raises KernelTimeout, and a dead helper raises KernelCrashed. Either way the
+helper is replaced, and the Celery worker and its queue slot survive.
+
+Helpers are spawned with subprocess rather than multiprocessing because Celery
+prefork children are daemonic and may not fork multiprocessing children.
+"""
+from __future__ import annotations
+
+import importlib
+import logging
+import os
+import pickle
+import selectors
+import struct
+import subprocess
+import sys
+import threading
+import time
+import traceback
+import weakref
+from pathlib import Path
+from typing import Any, Callable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+POOL_SIZE = int(os.getenv("CAD_KERNEL_POOL_SIZE", "1"))
+CALL_TIMEOUT_S = float(os.getenv("CAD_KERNEL_TIMEOUT_S", "300"))
+STARTUP_TIMEOUT_S = float(os.getenv("CAD_KERNEL_STARTUP_TIMEOUT_S", "60"))
+# Set CAD_KERNEL_ISOLATION=0 to run kernel calls in-process (e.g. local debugging)
+ISOLATION_ENABLED = os.getenv("CAD_KERNEL_ISOLATION", "1") != "0"
+
+SERVICE_ROOT = Path(__file__).resolve().parents[2]
+FRAME_HEADER = struct.Struct("<Q")
+READY = "ready"
+
+# Every pool in this process, for recycle_helpers
+_pools: "weakref.WeakSet[KernelPool]" = weakref.WeakSet()
+
+
+class KernelError(RuntimeError):
+    """A kernel call failed inside the helper with a non-picklable exception."""
+
+
+class KernelTimeout(KernelError, TimeoutError):
+    """A kernel call exceeded its deadline; the helper was killed."""
+
+
+class KernelCrashed(KernelError):
+    """The helper died (e.g. segfault) while running a kernel call."""
+
+
+def _write_frame(stream, payload: Any) -> None:
+    data = pickle.dumps(payload, protocol=pickle.HIGHEST_PROTOCOL)
+    stream.write(FRAME_HEADER.pack(len(data)))
+    stream.write(data)
+    stream.flush()
+
+
+def _read_exact_blocking(stream, size: int) -> bytes:
+    chunks = []
+    while size:
+        chunk = stream.read(size)
+        if not chunk:
+            raise EOFError("pipe closed")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+def _func_path(func: Callable) -> str:
+    return f"{func.__module__}:{func.__qualname__}"
+
+
+def _resolve(func_path: str) -> Callable:
+    module_name, _, qualname = func_path.partition(":")
+    target: Any = importlib.import_module(module_name)
+    for part in qualname.split("."):
+        target = getattr(target, part)
+    return target
+
+
+class KernelProcess:
+    """One helper process and its request/response pipe."""
+
+    def __init__(self):
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.pathsep.join(filter(None, [str(SERVICE_ROOT), env.get("PYTHONPATH")]))
+        # Code running inside the helper must not spawn helpers of its own
+        env["CAD_KERNEL_ISOLATION"] = "0"
+        self.proc = subprocess.Popen(
+            [sys.executable, "-m", "app.workers.kernel_pool"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            cwd=str(SERVICE_ROOT),
+            env=env,
+        )
+        self._fd = self.proc.stdout.fileno()
+        os.set_blocking(self._fd, False)
+        status = self._read_frame(time.monotonic() + STARTUP_TIMEOUT_S)
+        if status != READY:
+            self.kill()
+            raise KernelError(f"kernel helper failed to start: {status!r}")
+
+    @property
+    def alive(self) -> bool:
+        return self.proc.poll() is None
+
+    def call(self, func_path: str, args: tuple, kwargs: dict, timeout: float) -> Any:
+        try:
+            _write_frame(self.proc.stdin, (func_path, args, kwargs))
+        except (BrokenPipeError, OSError) as exc:
+            raise KernelCrashed(f"kernel helper unavailable: {exc}") from exc
+        status, payload = self._read_frame(time.monotonic() + timeout)
+        if status == "ok":
+            return payload
+        if isinstance(payload, BaseException):
+            raise payload
+        raise KernelError(payload)
+
+    def _read_frame(self, deadline: float) -> Any:
+        header = self._read_exact(FRAME_HEADER.size, deadline)
+        (size,) = FRAME_HEADER.unpack(header)
+        return pickle.loads(self._read_exact(size, deadline))
+
+    def _read_exact(self, size: int, deadline: float) -> bytes:
+        buf = bytearray()
+        with selectors.DefaultSelector() as sel:
+            sel.register(self._fd, selectors.EVENT_READ)
+            while len(buf) < size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise KernelTimeout("kernel operation exceeded its deadline")
+                if not sel.select(timeout=min(remaining, 1.0)):
+                    if not self.alive:
+                        raise KernelCrashed(f"kernel helper died (exit code {self.proc.returncode})")
+                    continue
+                try:
+                    chunk = os.read(self._fd, min(size - len(buf), 1 << 20))
+                except BlockingIOError:
+                    continue
+                if not chunk:
+                    self.proc.wait(timeout=5)
+                    raise KernelCrashed(f"kernel helper died (exit code {self.proc.returncode})")
+                buf.extend(chunk)
+        return bytes(buf)
+
+    def kill(self) -> None:
+        try:
+            self.proc.kill()
+            self.proc.wait(timeout=5)
+        except Exception:
+            pass
+
+
+class KernelPool:
+    """Fixed-size pool of pre-warmed kernel helpers with per-call deadlines."""
+
+    def __init__(self, size: int = POOL_SIZE, timeout: float = CALL_TIMEOUT_S):
+        self.size = max(1, size)
+        self.timeout = timeout
+        self._idle: List[KernelProcess] = []
+        self._live = 0
+        self._cond = threading.Condition()
+        self.restarts = 0
+        _pools.add(self)
+
+    def warm(self) -> None:
+        """Start helpers up to the pool size so the first call pays no import cost."""
+        while True:
+            with self._cond:
+                if self._live >= self.size:
+                    return
+                self._live += 1
+            try:
+                proc = KernelProcess()
+            except BaseException:
+                with self._cond:
+                    self._live -= 1
+                    self._cond.notify()
+                raise
+            self._checkin(proc)
+
+    def run(self, func: Callable, *args, timeout: Optional[float] = None, **kwargs) -> Any:
+        """Run module-level ``func(*args, **kwargs)`` in a helper and return its result."""
+        if not ISOLATION_ENABLED:
+            return func(*args, **kwargs)
+        proc = self._checkout()
+        try:
+            result = proc.call(_func_path(func), args, kwargs, timeout or self.timeout)
+        except (KernelTimeout, KernelCrashed) as exc:
+            logger.error(f"{func.__qualname__} failed in kernel helper, restarting it: {exc}")
+            self._discard(proc)
+            raise
+        except BaseException as exc:
+            if isinstance(exc, Exception) and proc.alive:
+                # Ordinary exception raised by func; the helper itself is fine
+                self._checkin(proc)
+            else:
+                # Interrupted mid-call (e.g. KeyboardInterrupt); the helper state is unknown
+                self._discard(proc)
+            raise
+        self._checkin(proc)
+        return result
+
+    def _checkout(self) -> KernelProcess:
+        with self._cond:
+            while True:
+                while self._idle:
+                    proc = self._idle.pop()
+                    if proc.alive:
+                        return proc
+                    self._live -= 1
+                if self._live < self.size:
+                    self._live += 1
+                    break
+                self._cond.wait()
+        try:
+            return KernelProcess()
+        except BaseException:
+            with self._cond:
+                self._live -= 1
+                self._cond.notify()
+            raise
+
+    def _checkin(self, proc: KernelProcess) -> None:
+        with self._cond:
+            self._idle.append(proc)
+            self._cond.notify()
+
+    def _discard(self, proc: KernelProcess) -> None:
+        proc.kill()
+        with self._cond:
+            self._live -= 1
+            self.restarts += 1
+            self._cond.notify()
+
+    def recycle(self, max_rss: int) -> int:
+        """Replace idle helpers whose RSS exceeds ``max_rss`` bytes; returns how many.
+
+        OCC fragments the helper heap, so a helper that meshed one huge part
+        stays large. Replacements start on the next call.
+        """
+        import psutil
+
+        bloated = []
+        with self._cond:
+            for proc in self._idle:
+                try:
+                    rss = psutil.Process(proc.proc.pid).memory_info().rss
+                except psutil.Error:
+                    continue  # already dead; _checkout drops it
+                if rss > max_rss:
+                    bloated.append(proc)
+            self._idle = [proc for proc in self._idle if proc not in bloated]
+            self._live -= len(bloated)
+            self.restarts += len(bloated)
+            self._cond.notify_all()
+        for proc in bloated:
+            proc.kill()
+        return len(bloated)
+
+    def shutdown(self) -> None:
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._live -= len(idle)
+        for proc in idle:
+            proc.kill()
+
+
+kernel_pool = KernelPool()
+
+
+def recycle_helpers(max_rss: int) -> int:
+    """KernelPool.recycle on every pool in this process (analysis, archive, conversion)."""
+    return sum(pool.recycle(max_rss) for pool in list(_pools))
+
+
+def _serve() -> None:
+    """Helper main loop: read (func, args, kwargs) frames, reply with results."""
+    # Keep the protocol on a private copy of stdout; kernel code prints freely.
+    out = os.fdopen(os.dup(1), "wb")
+    os.dup2(2, 1)
+    sys.stdout = sys.stderr
+    inp = sys.stdin.buffer
+
+    # Pre-warm: pay the OCC/trimesh import cost before the first request
+    for module in ("OCC.Core.STEPControl", "OCC.Core.BRepMesh", "trimesh", "app.routers.analyze"):
+        try:
+            importlib.import_module(module)
+        except Exception:
+            pass
+    _write_frame(out, READY)
+
+    while True:
+        try:
+            (size,) = FRAME_HEADER.unpack(_read_exact_blocking(inp, FRAME_HEADER.size))
+            func_path, args, kwargs = pickle.loads(_read_exact_blocking(inp, size))
+        except EOFError:
+            return
+        try:
+            reply = ("ok", _resolve(func_path)(*args, **kwargs))
+            _write_frame(out, reply)
+            continue
+        except Exception as exc:
+            error: Any = exc
+            traceback.print_exc()
+        try:
+            # Some exceptions pickle but cannot be rebuilt (e.g. keyword-only __init__)
+            pickle.loads(pickle.dumps(error))
+        except Exception:
+            error = f"{type(error).__name__}: {error}"
+        _write_frame(out, ("error", error))
+
+if __name__ == "__main__":
+    _serve()
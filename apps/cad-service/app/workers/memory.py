@@ -0,0 +1,162 @@
+"""
+Per-task RSS monitoring for CAD workers.
+
+OCC and trimesh fragment the heap, so a child that processed one huge file
+stays large long after the task ends. Two limits apply:
+
+- soft (CAD_WORKER_SOFT_RSS_MB): checked when the task ends. Kernel helpers
+  above it are replaced (recycle_helpers), since the OCC memory lives in
+  them and Celery never sees it; a child above it on its own RSS is recycled
+  by Celery (worker_max_memory_per_child, wired up in workers.celery);
+- hard (CAD_WORKER_HARD_RSS_MB): the running task is aborted with
+  MemoryLimitExceeded so it can be retried in a fresh child instead of the
+  whole child being OOM-killed mid-task.
+
+The task is never interrupted at an arbitrary bytecode: that could land in a
+``finally`` (a lock release, temp-file cleanup) and skip it. Instead the
+guard kills the task's subprocesses (the kernel helpers, where the geometry
+work and its memory live), whose calls then fail in the task as
+KernelCrashed, and sets a flag. The task raises MemoryLimitExceeded at its
+next stage boundary (check_memory_limit), or on leaving the guard.
+"""
+from __future__ import annotations
+
+import logging
+import os
+import threading
+from typing import Optional
+
+import psutil
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+SOFT_RSS_MB = int(os.getenv("CAD_WORKER_SOFT_RSS_MB", "2048"))
+HARD_RSS_MB = int(os.getenv("CAD_WORKER_HARD_RSS_MB", "6144"))
+SAMPLE_INTERVAL_S = float(os.getenv("CAD_RSS_SAMPLE_INTERVAL_S", "0.25"))
+
+
+class MemoryLimitExceeded(BaseException):
+    """Raised inside a task whose worker crossed the hard RSS limit.
+
+    Derives from BaseException so the broad ``except Exception`` fallbacks in the
+    analysis pipeline cannot swallow it; tasks catch it explicitly and retry.
+    """
+
+
+def current_rss() -> int:
+    """RSS of this process plus its children (kernel helpers run as subprocesses)."""
+    proc = psutil.Process(os.getpid())
+    rss = proc.memory_info().rss
+    for child in proc.children(recursive=True):
+        try:
+            rss += child.memory_info().rss
+        except psutil.Error:
+            pass
+    return rss
+
+
+_local = threading.local()
+
+
+def check_memory_limit() -> None:
+    """Stage boundary: raise MemoryLimitExceeded if this thread's RssGuard has tripped."""
+    guard = getattr(_local, "guard", None)
+    if guard is not None and guard.tripped:
+        raise MemoryLimitExceeded(f"RSS exceeded hard limit {guard.hard_limit // MB} MB")
+
+
+def _kill_children() -> int:
+    killed = 0
+    for child in psutil.Process(os.getpid()).children(recursive=True):
+        try:
+            child.kill()
+            killed += 1
+        except psutil.Error:
+            pass
+    return killed
+
+
+class RssGuard:
+    """Context manager that samples RSS while a task runs.
+
+    Records start/peak/end RSS for the task. If RSS crosses ``hard_limit_mb``
+    the task's subprocesses are killed and the task is aborted with
+    MemoryLimitExceeded at its next check_memory_limit, or on exit if a
+    subprocess was killed (its result is then incomplete).
+    """
+
+    def __init__(
+        self,
+        *,
+        soft_limit_mb: int = SOFT_RSS_MB,
+        hard_limit_mb: int = HARD_RSS_MB,
+        interval: float = SAMPLE_INTERVAL_S,
+    ):
+        self.soft_limit = soft_limit_mb * MB
+        self.hard_limit = hard_limit_mb * MB
+        self.interval = interval
+        self.start_rss = 0
+        self.peak_rss = 0
+        self.end_rss = 0
+        self.tripped = False
+        self.killed = 0
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._sampler: Optional[threading.Thread] = None
+        self._outer: Optional["RssGuard"] = None
+
+    def __enter__(self) -> "RssGuard":
+        self.start_rss = self.peak_rss = current_rss()
+        self._outer = getattr(_local, "guard", None)
+        _local.guard = self
+        self._sampler = threading.Thread(target=self._sample, name="rss-guard", daemon=True)
+        self._sampler.start()
+        return self
+
+    def _sample(self) -> None:
+        while not self._stop.wait(self.interval):
+            rss = current_rss()
+            self.peak_rss = max(self.peak_rss, rss)
+            if rss > self.hard_limit:
+                with self._lock:
+                    if self._stop.is_set():
+                        return
+                    self.tripped = True
+                    self.killed = _kill_children()
+                    logger.error(
+                        f"Task RSS {rss // MB} MB exceeded hard limit {self.hard_limit // MB} MB; "
+                        f"killed {self.killed} kernel subprocesses, aborting task"
+                    )
+                return
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        with self._lock:
+            self._stop.set()
+        if self._sampler is not None:
+            self._sampler.join()
+        _local.guard = self._outer
+        self.end_rss = current_rss()
+        self.peak_rss = max(self.peak_rss, self.end_rss)
+        if self.end_rss > self.soft_limit:
+            from .kernel_pool import recycle_helpers
+
+            recycled = recycle_helpers(self.soft_limit)
+            own_rss = psutil.Process(os.getpid()).memory_info().rss
+            logger.warning(
+                f"Worker RSS {self.end_rss // MB} MB above soft limit {self.soft_limit // MB} MB; "
+                f"replaced {recycled} kernel helpers"
+                + ("; child will be recycled after this task" if own_rss > self.soft_limit else "")
+            )
+        if self.killed and not isinstance(exc, MemoryLimitExceeded):
+            # Whatever the task made of its killed helpers (an error, a partial result) is discarded
+            raise MemoryLimitExceeded(f"RSS exceeded hard limit {self.hard_limit // MB} MB") from exc
+        return False
+
+    def as_dict(self) -> dict:
+        return {
+            "start_rss_mb": round(self.start_rss / MB, 1),
+            "peak_rss_mb": round(self.peak_rss / MB, 1),
+            "end_rss_mb": round(self.end_rss / MB, 1),
+            "hard_limit_tripped": self.tripped,
+        }
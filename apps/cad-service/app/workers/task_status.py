@@ -0,0 +1,104 @@
+"""
+Non-blocking task status lookups against the Celery Redis result backend.
+
+``AsyncResult.ready()`` is a blocking Redis round trip per call, which stalls
+the API event loop when clients poll thousands of tasks. These helpers read
+the backend's ``celery-task-meta-<id>`` keys with redis.asyncio instead:
+
+- ``fetch_task_metas`` resolves many ids in one pipelined MGET-style call;
+- ``wait_for_task_meta`` long-polls a single id by subscribing to the channel
+  the Redis backend publishes each result on.
+"""
+from __future__ import annotations
+
+import asyncio
+import time
+from typing import Dict, Iterable, Optional
+
+from celery import states
+
+from .celery import celery_app
+
+MAX_WAIT_S = 60.0
+MAX_BULK_IDS = 1000
+
+
+def task_meta_key(task_id: str) -> bytes:
+    return celery_app.backend.get_key_for_task(task_id)
+
+
+def decode_task_meta(raw: Optional[bytes]) -> Optional[dict]:
+    if raw is None:
+        return None
+    return celery_app.backend.decode_result(raw)
+
+
+def _client(client):
+    if client is not None:
+        return client
+    from ..utils.redis_client import get_async_redis
+
+    return get_async_redis()
+
+
+async def fetch_task_meta(task_id: str, *, client=None) -> Optional[dict]:
+    """Return the stored meta for ``task_id``, or None while it is still pending."""
+    return decode_task_meta(await _client(client).get(task_meta_key(task_id)))
+
+
+async def fetch_task_metas(task_ids: Iterable[str], *, client=None) -> Dict[str, Optional[dict]]:
+    """Resolve many task ids with a single pipelined round trip."""
+    ids = list(dict.fromkeys(task_ids))
+    if not ids:
+        return {}
+    async with _client(client).pipeline(transaction=False) as pipe:
+        for task_id in ids:
+            pipe.get(task_meta_key(task_id))
+        raws = await pipe.execute()
+    return {task_id: decode_task_meta(raw) for task_id, raw in zip(ids, raws)}
+
+
+async def wait_for_task_meta(task_id: str, timeout: float, *, client=None) -> Optional[dict]:
+    """Wait up to ``timeout`` seconds for ``task_id`` to reach a ready state.
+
+    Returns the latest meta (possibly not ready, or None) when the wait expires.
+    """
+    client = _client(client)
+    key = task_meta_key(task_id)
+    timeout = max(0.0, min(timeout, MAX_WAIT_S))
+    pubsub = client.pubsub()
+    try:
+        # Subscribe before reading so a result stored in between is not missed
+        await pubsub.subscribe(key)
+        meta = decode_task_meta(await client.get(key))
+        deadline = time.monotonic() + timeout
+        while meta is None or meta["status"] not in states.READY_STATES:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=min(remaining, 1.0))
+            if message is None:
+                await asyncio.sleep(0)
+                continue
+            meta = decode_task_meta(message["data"])
+        return meta
+    finally:
+        await pubsub.unsubscribe(key)
+        await pubsub.aclose()
+
+
+def summarize_task_meta(meta: Optional[dict]) -> dict:
+    """Compact per-task entry for bulk status responses."""
+    if meta is None:
+        return {"status": states.PENDING}
+    status = meta["status"]
+    entry: dict = {"status": status}
+    if status == states.SUCCESS:
+        result = meta.get("result")
+        if isinstance(result, dict) and "error" in result:
+            entry["error"] = result["error"]
+        else:
+            entry["result"] = result
+    elif status in states.EXCEPTION_STATES:
+        entry["error"] = str(meta.get("result"))
+    return entry
@@ -0,0 +1,302 @@
+"""
+Webhook delivery through a Redis outbox.
+
+Celery tasks only LPUSH the result onto the outbox and return. A
+lightweight async dispatcher delivers entries over a pooled httpx client.
+The API service (app.main) runs one in its event loop unless
+CAD_WEBHOOK_DISPATCHER=0; it can also run on its own with
+``python -m app.workers.webhooks``. Any number may run: they elect a single
+active dispatcher through a Redis lease, and the others stand by to take
+over if it stops renewing. Entries sit on an in-flight list while being
+delivered, so a dispatcher restart re-sends rather than loses them
+(at-least-once delivery). Failures are retried with exponential
+backoff through a Redis sorted set, and entries that exhaust their attempts
+are parked on a dead-letter list.
+
+With CAD_WEBHOOK_BATCH_MAX > 1, entries queued for the same receiver are
+sent together as ``{"batch": [...]}``. The HMAC signature always covers the
+exact bytes sent.
+"""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import os
+import random
+import time
+import uuid
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_KEY = "cad:webhooks:outbox"
+INFLIGHT_KEY = "cad:webhooks:inflight"
+RETRY_KEY = "cad:webhooks:retry"
+DEAD_KEY = "cad:webhooks:dead"
+LEASE_KEY = "cad:webhooks:dispatcher"
+
+BATCH_MAX = int(os.getenv("CAD_WEBHOOK_BATCH_MAX", "1"))
+MAX_ATTEMPTS = int(os.getenv("CAD_WEBHOOK_MAX_ATTEMPTS", "8"))
+BACKOFF_BASE_S = float(os.getenv("CAD_WEBHOOK_BACKOFF_BASE_S", "2"))
+BACKOFF_MAX_S = float(os.getenv("CAD_WEBHOOK_BACKOFF_MAX_S", "600"))
+REQUEST_TIMEOUT_S = float(os.getenv("CAD_WEBHOOK_TIMEOUT_S", "10"))
+MAX_CONNECTIONS = int(os.getenv("CAD_WEBHOOK_MAX_CONNECTIONS", "50"))
+CONCURRENCY = int(os.getenv("CAD_WEBHOOK_CONCURRENCY", "20"))
+# Entries pulled from the outbox per dispatch round
+DRAIN_CHUNK = 100
+# The active dispatcher renews its lease every round; standbys take over once it lapses
+LEASE_TTL_S = int(os.getenv("CAD_WEBHOOK_LEASE_TTL_S", "30"))
+# Run a dispatcher inside the API process (app.main)
+EMBEDDED_DISPATCHER = os.getenv("CAD_WEBHOOK_DISPATCHER", "1") != "0"
+
+
+def webhook_secret() -> Optional[str]:
+    return os.getenv("GEOMETRY_WEBHOOK_SECRET")
+
+
+def enqueue_webhook(url: str, payload: dict, *, client=None) -> bool:
+    """Queue ``payload`` for delivery to ``url``. Returns False if Redis is unavailable."""
+    entry = {
+        "id": uuid.uuid4().hex,
+        "url": url,
+        "payload": payload,
+        "attempts": 0,
+        "created_at": time.time(),
+    }
+    try:
+        if client is None:
+            from ..utils.redis_client import get_redis
+
+            client = get_redis()
+        client.lpush(OUTBOX_KEY, json.dumps(entry))
+        return True
+    except Exception as exc:
+        logger.error(f"Could not queue webhook for {url}: {exc}")
+        return False
+
+
+def encode_body(entries: List[dict]) -> bytes:
+    """Serialize once; these exact bytes are signed and sent."""
+    if len(entries) == 1:
+        body = entries[0]["payload"]
+    else:
+        body = {"batch": [entry["payload"] for entry in entries]}
+    return json.dumps(body, separators=(",", ":")).encode()
+
+
+def sign_headers(body: bytes, secret: Optional[str]) -> Dict[str, str]:
+    headers = {"Content-Type": "application/json"}
+    if secret:
+        headers["X-CAD-Webhook-Secret"] = secret
+        sig = hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+        headers["X-CAD-Webhook-Signature"] = f"sha256={sig}"
+    return headers
+
+
+def backoff_delay(attempts: int) -> float:
+    """Exponential backoff with full jitter, capped at BACKOFF_MAX_S."""
+    return random.uniform(0, min(BACKOFF_MAX_S, BACKOFF_BASE_S * (2 ** attempts)))
+
+
+class WebhookDispatcher:
+    """Drains the outbox with a pooled async HTTP client."""
+
+    def __init__(
+        self,
+        redis_client,
+        http_client=None,
+        *,
+        batch_max: int = BATCH_MAX,
+        max_attempts: int = MAX_ATTEMPTS,
+        concurrency: int = CONCURRENCY,
+        lease_ttl: int = LEASE_TTL_S,
+    ):
+        import httpx
+
+        self.redis = redis_client
+        self.http = http_client or httpx.AsyncClient(
+            timeout=REQUEST_TIMEOUT_S,
+            limits=httpx.Limits(max_connections=MAX_CONNECTIONS, max_keepalive_connections=MAX_CONNECTIONS),
+        )
+        self.batch_max = max(1, batch_max)
+        self.max_attempts = max_attempts
+        self._slots = asyncio.Semaphore(concurrency)
+        self.lease_ttl = lease_ttl
+        self.token = uuid.uuid4().hex
+        self.delivered = 0
+        self.failed = 0
+
+    async def acquire_lease(self) -> bool:
+        """Become (or stay) the active dispatcher if no other holds the lease."""
+        if await self.redis.set(LEASE_KEY, self.token, nx=True, ex=self.lease_ttl):
+            return True
+        return await self.renew_lease()
+
+    async def renew_lease(self) -> bool:
+        """Extend our lease; False if it lapsed and another dispatcher took over."""
+        from redis.exceptions import WatchError
+
+        try:
+            async with self.redis.pipeline() as pipe:
+                await pipe.watch(LEASE_KEY)
+                owner = await pipe.get(LEASE_KEY)
+                if owner is None or owner.decode() != self.token:
+                    await pipe.unwatch()
+                    return False
+                pipe.multi()
+                pipe.expire(LEASE_KEY, self.lease_ttl)
+                await pipe.execute()
+        except WatchError:
+            # Changed under us: another dispatcher took the lapsed lease
+            return False
+        return True
+
+    async def release_lease(self) -> None:
+        async with self.redis.pipeline() as pipe:
+            await pipe.watch(LEASE_KEY)
+            owner = await pipe.get(LEASE_KEY)
+            if owner is not None and owner.decode() == self.token:
+                pipe.multi()
+                pipe.delete(LEASE_KEY)
+                await pipe.execute()
+            else:
+                await pipe.unwatch()
+
+    async def recover_inflight(self) -> int:
+        """Requeue entries a previous dispatcher left in flight (call on taking the lease)."""
+        moved = 0
+        while await self.redis.lmove(INFLIGHT_KEY, OUTBOX_KEY, "RIGHT", "RIGHT") is not None:
+            moved += 1
+        return moved
+
+    async def promote_due_retries(self) -> int:
+        """Move retries whose backoff has elapsed back onto the outbox."""
+        due = await self.redis.zrangebyscore(RETRY_KEY, 0, time.time())
+        moved = 0
+        for raw in due:
+            # zrem guards against two dispatchers promoting the same entry
+            if await self.redis.zrem(RETRY_KEY, raw):
+                await self.redis.rpush(OUTBOX_KEY, raw)
+                moved += 1
+        return moved
+
+    async def drain_once(self, *, block_s: float = 0) -> int:
+        """Deliver one round of outbox entries. Returns the number of entries handled."""
+        await self.promote_due_retries()
+        raws: List[bytes] = []
+        if block_s:
+            raw = await self.redis.blmove(OUTBOX_KEY, INFLIGHT_KEY, block_s, "RIGHT", "LEFT")
+            if raw is not None:
+                raws.append(raw)
+        while len(raws) < DRAIN_CHUNK:
+            raw = await self.redis.lmove(OUTBOX_KEY, INFLIGHT_KEY, "RIGHT", "LEFT")
+            if raw is None:
+                break
+            raws.append(raw)
+        if not raws:
+            return 0
+
+        by_url: Dict[str, List[tuple]] = {}
+        for raw in raws:
+            entry = json.loads(raw)
+            by_url.setdefault(entry["url"], []).append((raw, entry))
+
+        groups = []
+        for url, items in by_url.items():
+            for i in range(0, len(items), self.batch_max):
+                groups.append((url, items[i:i + self.batch_max]))
+        await asyncio.gather(*(self._deliver(url, items) for url, items in groups))
+        return len(raws)
+
+    async def _deliver(self, url: str, items: List[tuple]) -> None:
+        entries = [entry for _, entry in items]
+        body = encode_body(entries)
+        headers = sign_headers(body, webhook_secret())
+        if len(entries) > 1:
+            headers["X-CAD-Webhook-Batch"] = str(len(entries))
+        async with self._slots:
+            try:
+                response = await self.http.post(url, content=body, headers=headers)
+                response.raise_for_status()
+                self.delivered += len(entries)
+                delivered = True
+            except Exception as exc:
+                logger.warning(f"Webhook delivery to {url} failed ({len(entries)} entries): {exc}")
+                delivered = False
+        if not delivered:
+            self.failed += len(entries)
+            for entry in entries:
+                await self._reschedule(entry)
+        for raw, _ in items:
+            await self.redis.lrem(INFLIGHT_KEY, 1, raw)
+
+    async def _reschedule(self, entry: dict) -> None:
+        entry["attempts"] += 1
+        if entry["attempts"] >= self.max_attempts:
+            logger.error(f"Webhook {entry['id']} to {entry['url']} dead after {entry['attempts']} attempts")
+            await self.redis.lpush(DEAD_KEY, json.dumps(entry))
+            return
+        due = time.time() + backoff_delay(entry["attempts"])
+        await self.redis.zadd(RETRY_KEY, {json.dumps(entry): due})
+
+    async def run_forever(self) -> None:
+        active = False
+        try:
+            while True:
+                # The Redis client can swallow a cancellation that lands mid-command
+                if asyncio.current_task().cancelling():
+                    raise asyncio.CancelledError()
+                try:
+                    if not active:
+                        active = await self.acquire_lease()
+                        if not active:
+                            await asyncio.sleep(self.lease_ttl / 3)
+                            continue
+                        logger.info("Webhook dispatcher is active")
+                        await self.recover_inflight()
+                    await self.drain_once(block_s=1.0)
+                    active = await self.renew_lease()
+                    # Yield between rounds; the API's event loop is shared with request handlers
+                    await asyncio.sleep(0)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as exc:
+                    logger.error(f"Webhook dispatcher round failed: {exc}")
+                    await asyncio.sleep(1.0)
+        finally:
+            if active:
+                try:
+                    await asyncio.shield(self.release_lease())
+                except Exception:
+                    pass
+
+    async def aclose(self) -> None:
+        await self.http.aclose()
+
+
+async def main() -> None:
+    import redis.asyncio as aioredis
+
+    from .celery import REDIS_URL
+
+    dispatcher = WebhookDispatcher(aioredis.Redis.from_url(REDIS_URL))
+    logger.info(f"Webhook dispatcher started (batch_max={dispatcher.batch_max})")
+    try:
+        await dispatcher.run_forever()
+    finally:
+        await dispatcher.aclose()
+
+
+def start_embedded_dispatcher() -> Optional[asyncio.Task]:
+    """Run the dispatcher as a task on the current event loop (app.main lifespan)."""
+    if not EMBEDDED_DISPATCHER:
+        return None
+    return asyncio.get_running_loop().create_task(main(), name="webhook-dispatcher")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
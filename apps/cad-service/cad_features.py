@@ -1,134 +1,45 @@
 #!/usr/bin/env python3
 """
 FastAPI endpoint for CAD feature extraction using OpenCascade
-Extracts geometric features from STEP/IGES files and returns structured data
+Extracts geometric features from STEP/IGES/BREP files and returns structured data.
+The format is sniffed from the file content, not the upload's extension.
 
 Usage:
   uvicorn cad_features:app --host 0.0.0.0 --port 8001 --reload
 
+Configuration:
+  CAD_FEATURE_WORKERS  processes for /batch-extract (default: CPU count)
+
 Dependencies:
   pip install fastapi uvicorn python-multipart OCP numpy
 """
 
 from fastapi import FastAPI, File, UploadFile, HTTPException
-from fastapi.responses import JSONResponse
-from typing import Dict, Any, List, Optional
+from fastapi.responses import JSONResponse, StreamingResponse
+from typing import Dict, Any, AsyncIterator, List, Optional, Tuple
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import asyncio
+import multiprocessing
 import tempfile
 import os
 import json
 
-try:
-    from OCP.STEPControl import STEPControl_Reader
-    from OCP.IGESControl import IGESControl_Reader
-    from OCP.TopExp import TopExp_Explorer
-    from OCP.TopAbs import TopAbs_SOLID, TopAbs_FACE, TopAbs_EDGE
-    from OCP.GProp import GProp_GProps
-    from OCP.BRepGProp import brepgprop
-    from OCP.BRepBndLib import brepbndlib
-    from OCP.Bnd import Bnd_Box
-    HAS_OCP = True
-except ImportError:
-    HAS_OCP = False
-    print("Warning: OpenCascade (OCP) not installed. Install with: pip install OCP")
+from app.core.features import (  # FEATURE_COLUMNS and SURFACE_KINDS re-exported for model code
+    FEATURE_COLUMNS, HAS_OCP, SURFACE_KINDS, FeatureExtractionError,
+    detect_format, extract_step_features, isolated_extraction, timed_feature_extraction,
+)
+from app.utils.download import save_upload_to_temp
 
-import numpy as np
+if not HAS_OCP:
+    print("Warning: OpenCascade (OCP) not installed. Install with: pip install OCP")
 
 app = FastAPI(title="CAD Feature Extractor", version="1.0.0")
 
+FEATURE_WORKERS = int(os.getenv("CAD_FEATURE_WORKERS", str(os.cpu_count() or 1)))
+BATCH_MAX_FILES = 200
 
-def extract_step_features(file_path: str) -> Dict[str, Any]:
-    """Extract geometric features from STEP file using OpenCascade"""
-    if not HAS_OCP:
-        raise HTTPException(status_code=500, detail="OpenCascade not installed")
-    
-    reader = STEPControl_Reader()
-    status = reader.ReadFile(file_path)
-    
-    if status != 1:  # IFSelect_RetDone
-        raise HTTPException(status_code=400, detail="Failed to read STEP file")
-    
-    reader.TransferRoots()
-    shape = reader.OneShape()
-    
-    # Extract basic properties
-    props = GProp_GProps()
-    brepgprop.VolumeProperties_s(shape, props)
-    
-    volume = props.Mass()
-    centroid = props.CentreOfMass()
-    
-    # Bounding box
-    bbox = Bnd_Box()
-    brepbndlib.Add_s(shape, bbox)
-    xmin, ymin, zmin, xmax, ymax, zmax = bbox.Get()
-    
-    dimensions = {
-        'x': xmax - xmin,
-        'y': ymax - ymin,
-        'z': zmax - zmin,
-    }
-    
-    # Count topology elements
-    explorer = TopExp_Explorer()
-    
-    solid_count = 0
-    explorer.Init(shape, TopAbs_SOLID)
-    while explorer.More():
-        solid_count += 1
-        explorer.Next()
-    
-    face_count = 0
-    explorer.Init(shape, TopAbs_FACE)
-    while explorer.More():
-        face_count += 1
-        explorer.Next()
-    
-    edge_count = 0
-    explorer.Init(shape, TopAbs_EDGE)
-    while explorer.More():
-        edge_count += 1
-        explorer.Next()
-    
-    # Calculate complexity metrics
-    surface_area = 0.0
-    props_surf = GProp_GProps()
-    brepgprop.SurfaceProperties_s(shape, props_surf)
-    surface_area = props_surf.Mass()
-    
-    # Feature vector for ML (normalized)
-    features = {
-        # Dimensions
-        'dim_x': dimensions['x'],
-        'dim_y': dimensions['y'],
-        'dim_z': dimensions['z'],
-        'max_dim': max(dimensions.values()),
-        'min_dim': min(dimensions.values()),
-        'dim_ratio': max(dimensions.values()) / (min(dimensions.values()) + 0.001),
-        
-        # Volume and area
-        'volume': volume,
-        'surface_area': surface_area,
-        'surface_to_volume_ratio': surface_area / (volume + 0.001),
-        
-        # Topology counts (complexity indicators)
-        'solid_count': solid_count,
-        'face_count': face_count,
-        'edge_count': edge_count,
-        
-        # Complexity score (normalized)
-        'complexity_score': (face_count * 0.5 + edge_count * 0.3 + solid_count * 0.2) / 100.0,
-        
-        # Bounding box
-        'bbox_volume': dimensions['x'] * dimensions['y'] * dimensions['z'],
-        'bbox_utilization': volume / (dimensions['x'] * dimensions['y'] * dimensions['z'] + 0.001),
-        
-        # Centroid
-        'centroid_x': centroid.X(),
-        'centroid_y': centroid.Y(),
-        'centroid_z': centroid.Z(),
-    }
-    
-    return features
+_feature_pool: Optional[ProcessPoolExecutor] = None
 
 
 @app.get("/")
@@ -146,27 +57,22 @@ async def extract_step_geometry(
     file: UploadFile = File(...),
 ):
     """
-    Extract basic geometry from STEP file (volume, surface area, dimensions)
+    Extract basic geometry from STEP/IGES/BREP file (volume, surface area, dimensions)
     Simplified endpoint for quick geometry extraction
     """
     if not HAS_OCP:
         raise HTTPException(status_code=500, detail="OpenCascade not installed")
     
-    # Determine format
-    format = file.filename.split('.')[-1].lower() if file.filename else 'step'
-    
-    if format not in ['step', 'stp', 'iges', 'igs']:
-        raise HTTPException(status_code=400, detail=f"Unsupported format: {format}")
-    
     # Save uploaded file temporarily
-    with tempfile.NamedTemporaryFile(delete=False, suffix=f'.{format}') as tmp:
+    suffix = os.path.splitext(file.filename or '')[1].lower()
+    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
         content = await file.read()
         tmp.write(content)
         tmp_path = tmp.name
     
     try:
         # Extract basic geometry
-        features = extract_step_features(tmp_path)
+        features = extract_step_features(tmp_path, detect_format(tmp_path))
         
         return JSONResponse(content={
             "volume": features['volume'],
@@ -180,6 +86,10 @@ async def extract_step_geometry(
             "features": features
         })
         
+    except HTTPException:
+        raise
+    except FeatureExtractionError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Geometry extraction failed: {str(e)}")
     
@@ -195,38 +105,30 @@ async def extract_features(
     format: Optional[str] = None
 ):
     """
-    Extract geometric features from CAD file
+    Extract geometric features from CAD file (STEP, IGES or BREP)
+    
+    The format is sniffed from the content; ``format`` (an extension such as
+    "igs") is only used when the content is not recognised.
     
     Returns a feature vector suitable for ML pricing models
     """
     
-    # Determine format
-    if format is None:
-        format = file.filename.split('.')[-1].lower() if file.filename else 'step'
-    
-    if format not in ['step', 'stp', 'iges', 'igs']:
-        raise HTTPException(status_code=400, detail=f"Unsupported format: {format}")
-    
     # Save uploaded file temporarily
-    with tempfile.NamedTemporaryFile(delete=False, suffix=f'.{format}') as tmp:
+    suffix = os.path.splitext(file.filename or '')[1].lower()
+    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
         content = await file.read()
         tmp.write(content)
         tmp_path = tmp.name
     
     try:
         # Extract features
-        if format in ['step', 'stp']:
-            features = extract_step_features(tmp_path)
-        elif format in ['iges', 'igs']:
-            # Similar implementation for IGES
-            features = extract_step_features(tmp_path)  # Placeholder
-        else:
-            raise HTTPException(status_code=400, detail="Unsupported format")
+        fmt = detect_format(tmp_path, format)
+        features = extract_step_features(tmp_path, fmt)
         
         # Add metadata
         features['file_name'] = file.filename
         features['file_size_bytes'] = len(content)
-        features['format'] = format
+        features['format'] = fmt
         
         return JSONResponse(content={
             "success": True,
@@ -234,6 +136,10 @@ async def extract_features(
             "feature_vector": list(features.values()),  # For direct ML input
         })
         
+    except HTTPException:
+        raise
+    except FeatureExtractionError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Feature extraction failed: {str(e)}")
     
@@ -243,25 +149,106 @@ async def extract_features(
             os.unlink(tmp_path)
 
 
+def get_feature_pool() -> ProcessPoolExecutor:
+    """Process pool for batch extraction, created on first use.
+
+    Spawned rather than forked: the OCP kernel is not fork-safe once the
+    server's threads are running.
+    """
+    global _feature_pool
+    if _feature_pool is None:
+        _feature_pool = ProcessPoolExecutor(
+            max_workers=FEATURE_WORKERS, mp_context=multiprocessing.get_context("spawn")
+        )
+    return _feature_pool
+
+
+def reset_feature_pool(pool: Optional[ProcessPoolExecutor] = None) -> None:
+    """Drop a pool whose worker died (e.g. a kernel crash) so the next batch gets a fresh one.
+
+    With ``pool`` given, only that pool is dropped: a concurrent batch may
+    already have replaced it, and its new pool must survive.
+    """
+    global _feature_pool
+    if pool is not None and _feature_pool is not pool:
+        return
+    pool, _feature_pool = _feature_pool, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+async def iter_batch_features(saved: List[Tuple[str, str]]) -> AsyncIterator[Dict[str, Any]]:
+    """Yield one result per (file name, scratch path) as each extraction finishes.
+
+    Extraction runs in the process pool, so OCP calls never block the event
+    loop and files are processed in parallel. A kernel crash fails only the
+    file that caused it. Scratch files are removed as results come back, or
+    when the client disconnects.
+    """
+    loop = asyncio.get_running_loop()
+    retry_slots = asyncio.Semaphore(FEATURE_WORKERS)
+
+    async def process(index: int, name: str, path: str) -> Dict[str, Any]:
+        line: Dict[str, Any] = {"index": index, "file": name}
+        pool = get_feature_pool()
+        try:
+            try:
+                line.update(await loop.run_in_executor(pool, timed_feature_extraction, path, name))
+            except BrokenProcessPool:
+                reset_feature_pool(pool)
+                # Every file queued on a broken pool fails with it; rerun each
+                # alone so only the one that crashed the kernel is reported
+                async with retry_slots:
+                    line.update(await loop.run_in_executor(None, isolated_extraction, timed_feature_extraction, path, name))
+        finally:
+            if os.path.exists(path):
+                os.unlink(path)
+        line["status"] = "failed" if "error" in line else "completed"
+        return line
+
+    pending = [asyncio.ensure_future(process(i, name, path)) for i, (name, path) in enumerate(saved)]
+    try:
+        for next_done in asyncio.as_completed(pending):
+            yield await next_done
+    finally:
+        for future in pending:
+            future.cancel()
+        for _, path in saved:
+            if os.path.exists(path):
+                os.unlink(path)
+
+
 @app.post("/batch-extract")
 async def batch_extract(files: List[UploadFile] = File(...)):
-    """Extract features from multiple CAD files"""
-    results = []
+    """
+    Extract features from multiple CAD files in parallel
     
-    for file in files:
-        try:
-            result = await extract_features(file)
-            results.append({
-                "file": file.filename,
-                "features": result['features']
-            })
-        except Exception as e:
-            results.append({
-                "file": file.filename,
-                "error": str(e)
-            })
+    Streams NDJSON, one line per file in completion order, each with the
+    file's upload ``index``, ``status`` and ``seconds`` plus its ``features``
+    or ``error``.
+    """
+    if not HAS_OCP:
+        raise HTTPException(status_code=500, detail="OpenCascade not installed")
+    if len(files) > BATCH_MAX_FILES:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_FILES} files per batch")
+    
+    # Spool every upload to scratch before streaming starts; the request body is gone after that
+    saved: List[Tuple[str, str]] = []
+    try:
+        for file in files:
+            suffix = os.path.splitext(file.filename or '')[1].lower()
+            path, _ = await save_upload_to_temp(file, suffix=suffix)
+            saved.append((file.filename or '', path))
+    except Exception:
+        for _, path in saved:
+            os.unlink(path)
+        raise
+    
+    async def body():
+        async for line in iter_batch_features(saved):
+            yield json.dumps(line) + "\n"
     
-    return {"batch_results": results}
+    return StreamingResponse(body(), media_type="application/x-ndjson")
 
 
 if __name__ == "__main__":
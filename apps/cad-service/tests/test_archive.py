@@ -0,0 +1,102 @@
+"""
+Tests for compressed/archived CAD inputs: bounded extraction and bundle analysis.
+"""
+import gzip
+import io
+import zipfile
+
+import pytest
+
+from app.utils import archive
+from app.utils.archive import ArchiveLimitExceeded, archive_kind, declared_size, extract_models, extracted_models
+
+STEP = b"ISO-10303-21;\nHEADER;\nENDSEC;\nDATA;\nENDSEC;\nEND-ISO-10303-21;\n"
+
+
+def write_zip(path, members):
+    with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for name, data in members.items():
+            zf.writestr(name, data)
+    return str(path)
+
+
+@pytest.fixture
+def scratch(tmp_path, monkeypatch):
+    """Send extracted members to a directory the test can inspect."""
+    directory = tmp_path / "scratch"
+    directory.mkdir()
+    monkeypatch.setattr(archive.tempfile, "tempdir", str(directory))
+    return directory
+
+
+class TestExtraction:
+    def test_gzip_step_is_named_after_upload(self, tmp_path, scratch):
+        path = tmp_path / "upload"
+        path.write_bytes(gzip.compress(STEP))
+        assert archive_kind(str(path)) == "gzip"
+        assert declared_size(str(path)) == len(STEP)
+
+        with extracted_models(str(path), name="bracket.stp.gz") as members:
+            assert [(m.name, m.fmt) for m in members] == [("bracket.stp", "step")]
+            with open(members[0].path, "rb") as fh:
+                assert fh.read() == STEP
+        assert not list(scratch.iterdir())
+
+    def test_zip_bundle_keeps_only_models(self, tmp_path, scratch):
+        nested = io.BytesIO()
+        with zipfile.ZipFile(nested, "w") as zf:
+            zf.writestr("inner.step", STEP)
+        path = write_zip(tmp_path / "bundle.zip", {
+            "parts/a.step": STEP,
+            "parts/b.dat": STEP,
+            "README.txt": b"see drawings",
+            "__MACOSX/parts/._a.step": b"\x00\x05\x16\x07",
+            "nested.zip": nested.getvalue(),
+        })
+        assert declared_size(path) > 2 * len(STEP)
+
+        members = extract_models(path)
+        try:
+            assert sorted((m.name, m.fmt) for m in members) == [("parts/a.step", "step"), ("parts/b.dat", "step")]
+            assert len(list(scratch.iterdir())) == 2
+        finally:
+            archive.remove_members(members)
+
+    def test_ratio_limit_stops_zip_bomb(self, tmp_path, scratch):
+        path = write_zip(tmp_path / "bomb.zip", {"a.step": STEP, "b.step": STEP + b"\0" * (8 * 1024 * 1024)})
+        with pytest.raises(ArchiveLimitExceeded):
+            extract_models(path, max_ratio=50)
+        assert not list(scratch.iterdir())
+
+    def test_byte_and_member_limits(self, tmp_path, scratch):
+        path = write_zip(tmp_path / "many.zip", {f"p{i}.step": STEP for i in range(3)})
+        with pytest.raises(ArchiveLimitExceeded):
+            extract_models(path, max_bytes=2 * len(STEP))
+        with pytest.raises(ArchiveLimitExceeded):
+            extract_models(path, max_members=2)
+        assert not list(scratch.iterdir())
+
+    def test_archive_without_models_is_rejected(self, tmp_path, scratch):
+        path = write_zip(tmp_path / "docs.zip", {"notes.txt": b"no geometry here"})
+        with pytest.raises(ValueError, match="no STEP"):
+            extract_models(path)
+        assert not list(scratch.iterdir())
+
+
+class TestBundleAnalysis:
+    def test_parts_are_analyzed_separately(self, tmp_path, monkeypatch):
+        trimesh = pytest.importorskip("trimesh")
+        from app.routers import analyze
+        from app.workers import kernel_pool
+
+        monkeypatch.setattr(kernel_pool, "ISOLATION_ENABLED", False)
+        monkeypatch.setattr(analyze.single_flight, "peek", lambda *args: None)
+        plate = trimesh.creation.box(extents=(100, 50, 2)).export(file_type="stl")
+        path = write_zip(tmp_path / "bundle.zip", {"plate.stl": plate, "broken.stl": b"solid x\nfacet\n"})
+
+        result = analyze.analyze_file_path_shared(path, "mm", deadline_ms=60_000)
+
+        assert result["is_archive"] and result["requires_manual_quote"]
+        parts = {part["name"]: part for part in result["parts"]}
+        assert parts["plate.stl"]["metrics"]["volume"] == pytest.approx(10.0, rel=1e-3)
+        assert set(parts) == {"plate.stl", "broken.stl"}
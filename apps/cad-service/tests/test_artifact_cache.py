@@ -0,0 +1,110 @@
+"""
+Tests for the bounded GLB artifact cache: LRU eviction, counters and the shared tier.
+"""
+import os
+
+from app.utils.artifact_cache import ArtifactCache, FilesystemBackend, backend_from_url
+
+
+def _age(cache, name, seconds_ago):
+    path = cache.root / name
+    stamp = path.stat().st_mtime - seconds_ago
+    os.utime(path, (stamp, stamp))
+
+
+class TestArtifactCache:
+    def test_put_and_read_count_hits_and_misses(self, tmp_path):
+        cache = ArtifactCache(tmp_path, max_bytes=1024)
+        assert cache.read("a.glb") is None
+        cache.put("a.glb", b"glTF")
+        assert cache.read("a.glb") == b"glTF"
+        stats = cache.stats()
+        assert (stats["hits"], stats["misses"], stats["bytes"]) == (1, 1, 4)
+
+    def test_evicts_least_recently_used_over_budget(self, tmp_path):
+        cache = ArtifactCache(tmp_path, max_bytes=300)
+        for name in ("a.glb", "b.glb", "c.glb"):
+            cache.put(name, b"x" * 100)
+        _age(cache, "a.glb", 30)
+        _age(cache, "b.glb", 20)
+        _age(cache, "c.glb", 10)
+        # A hit moves "a" to the front of the LRU order
+        assert cache.path("a.glb") is not None
+
+        cache.put("d.glb", b"x" * 100)
+
+        assert cache.peek("b.glb") is None
+        assert cache.peek("a.glb") is not None
+        assert cache.peek("d.glb") is not None
+        stats = cache.stats()
+        assert stats["evictions"] >= 1
+        assert stats["bytes"] <= 300
+
+    def test_budget_counts_other_processes_writes(self, tmp_path):
+        # Two instances on one directory, as in separate conversion helpers;
+        # rescan_interval=0 reconciles with the directory on every write
+        helpers = [ArtifactCache(tmp_path, max_bytes=300, rescan_interval=0) for _ in range(2)]
+        for i in range(4):
+            helpers[i % 2].put(f"{i}.stl", b"x" * 100)
+
+        assert sum(p.stat().st_size for p in tmp_path.iterdir()) <= 300
+
+    def test_writes_update_the_index_without_rescanning(self, tmp_path, monkeypatch):
+        cache = ArtifactCache(tmp_path, max_bytes=1024, rescan_interval=3600)
+        cache.put("a.glb", b"x" * 100)
+        scans = []
+        original = cache._entries
+        monkeypatch.setattr(cache, "_entries", lambda: scans.append(1) or original())
+
+        cache.put("b.glb", b"x" * 200)
+        cache.put("a.glb", b"x" * 50)
+
+        assert scans == []
+        assert cache.stats()["bytes"] == 250
+
+    def test_periodic_rescan_picks_up_other_processes_writes(self, tmp_path):
+        cache = ArtifactCache(tmp_path, max_bytes=300, rescan_interval=3600)
+        other = ArtifactCache(tmp_path, max_bytes=300, rescan_interval=3600)
+        cache.put("a.stl", b"x" * 100)
+        other.put("b.stl", b"x" * 100)
+        other.put("c.stl", b"x" * 100)
+        assert cache.stats()["bytes"] == 100
+
+        cache._scanned_at -= 3600
+        cache.put("d.stl", b"x" * 100)
+
+        assert sum(p.stat().st_size for p in tmp_path.iterdir()) <= 300
+        assert cache.stats()["bytes"] == sum(p.stat().st_size for p in tmp_path.iterdir())
+
+    def test_shared_backend_serves_other_replicas(self, tmp_path):
+        shared = FilesystemBackend(tmp_path / "shared")
+        writer = ArtifactCache(tmp_path / "replica-a", shared=shared)
+        reader = ArtifactCache(tmp_path / "replica-b", shared=shared)
+        writer.put("part.json", b"{}")
+
+        path = reader.path("part.json")
+
+        assert path is not None and path.read_bytes() == b"{}"
+        assert path.parent == tmp_path / "replica-b"
+        assert reader.stats()["shared_hits"] == 1
+        # Now local to the reader
+        reader.path("part.json")
+        assert reader.stats()["hits"] == 1
+
+    def test_backend_from_url(self, tmp_path):
+        assert backend_from_url(None) is None
+        backend = backend_from_url(f"file://{tmp_path}")
+        assert isinstance(backend, FilesystemBackend)
+        assert backend.root == tmp_path
+
+    def test_put_file_moves_artifact_in(self, tmp_path):
+        cache = ArtifactCache(tmp_path / "cache", max_bytes=1024, shared=FilesystemBackend(tmp_path / "shared"))
+        src = tmp_path / "part.stl"
+        src.write_bytes(b"x" * 100)
+
+        path = cache.put_file("abc.stl", src)
+
+        assert not src.exists()
+        assert path.read_bytes() == b"x" * 100
+        assert (tmp_path / "shared" / "abc.stl").exists()
+        assert cache.stats()["bytes"] == 100
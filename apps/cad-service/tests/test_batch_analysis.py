@@ -0,0 +1,107 @@
+"""
+Tests for batch analysis: concurrent download, sha256 dedup, cache reuse and fan-out.
+"""
+import asyncio
+import hashlib
+import os
+from types import SimpleNamespace
+
+import httpx
+
+from app.routers import analyze
+from app.routers.analyze import BatchAnalysisRequest, iter_batch_results
+
+FILES = {
+    "/a.stl": b"solid a\nendsolid a\n",
+    "/a-copy.stl": b"solid a\nendsolid a\n",
+    "/cached.stl": b"solid cached\nendsolid cached\n",
+}
+CACHED_SHA = hashlib.sha256(FILES["/cached.stl"]).hexdigest()
+
+
+def serve(request):
+    body = FILES.get(request.url.path)
+    return httpx.Response(200, content=body) if body is not None else httpx.Response(404)
+
+
+def run_batch(monkeypatch, paths):
+    queued = []
+
+    def peek(file_sha, operation, params):
+        return {"volume": 1.0} if file_sha == CACHED_SHA else None
+
+    def apply_async(args, queue, kwargs=None):
+        queued.append((args, kwargs or {}))
+        return SimpleNamespace(id=f"task-{len(queued)}")
+
+    async def wait_for_task_meta(task_id, timeout):
+        await asyncio.sleep(0.01)
+        return {"status": "SUCCESS", "result": {"file_id": task_id, "metrics": {"volume": 2.0}}}
+
+    monkeypatch.setattr(analyze.single_flight, "peek", peek)
+    monkeypatch.setattr(analyze.analyze_file, "apply_async", apply_async)
+    monkeypatch.setattr(analyze, "wait_for_task_meta", wait_for_task_meta)
+
+    request = BatchAnalysisRequest(
+        items=[{"file_id": path.strip("/"), "file_url": f"https://files.example{path}"} for path in paths]
+    )
+
+    async def scenario():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(serve)) as client:
+            return [line async for line in iter_batch_results(request, client)]
+
+    lines = asyncio.run(scenario())
+    return {line["file_id"]: line for line in lines}, queued
+
+
+class TestBatchAnalysis:
+    def test_identical_files_are_analyzed_once(self, monkeypatch):
+        results, queued = run_batch(monkeypatch, ["/a.stl", "/a-copy.stl"])
+
+        assert len(queued) == 1
+        assert {line["metrics"]["volume"] for line in results.values()} == {2.0}
+        assert results["a.stl"]["sha256"] == results["a-copy.stl"]["sha256"]
+        assert sum("duplicate_of" in line for line in results.values()) == 1
+
+    def test_cached_results_skip_the_queue(self, monkeypatch):
+        results, queued = run_batch(monkeypatch, ["/cached.stl"])
+
+        assert queued == []
+        assert results["cached.stl"] == {
+            "file_id": "cached.stl",
+            "file_url": "https://files.example/cached.stl",
+            "sha256": CACHED_SHA,
+            "metrics": {"volume": 1.0},
+            "cached": True,
+            "status": "completed",
+        }
+
+    def test_failed_download_does_not_abort_batch(self, monkeypatch):
+        results, _ = run_batch(monkeypatch, ["/missing.stl", "/a.stl"])
+
+        assert results["missing.stl"]["status"] == "failed"
+        assert "404" in results["missing.stl"]["error"]
+        assert results["a.stl"]["status"] == "completed"
+
+    def test_staging_dir_hands_the_download_to_the_worker(self, monkeypatch, tmp_path):
+        monkeypatch.setattr(analyze, "BATCH_STAGING_DIR", str(tmp_path))
+        results, queued = run_batch(monkeypatch, ["/a.stl", "/a-copy.stl"])
+
+        assert len(queued) == 1
+        args, kwargs = queued[0]
+        staged_path = args[1]
+        assert os.path.dirname(staged_path) == str(tmp_path) and staged_path.endswith(".stl")
+        with open(staged_path, "rb") as staged:
+            assert staged.read() == FILES["/a.stl"]
+        assert kwargs == {"staged": True}
+        assert results["a.stl"]["status"] == "completed"
+
+    def test_staged_file_is_removed_after_analysis(self, monkeypatch, tmp_path):
+        staged_path = tmp_path / "part.stl"
+        staged_path.write_bytes(FILES["/a.stl"])
+        monkeypatch.setattr(analyze, "analyze_file_path_shared", lambda *args, **kwargs: {"volume": 2.0})
+
+        result = analyze.analyze_file.apply(args=["a", str(staged_path), None, None], kwargs={"staged": True}).get()
+
+        assert result["metrics"] == {"volume": 2.0}
+        assert not staged_path.exists()
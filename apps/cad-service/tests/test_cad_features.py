@@ -0,0 +1,93 @@
+"""
+Tests for cad_features batch extraction: per-file isolation and scratch cleanup.
+"""
+import asyncio
+import os
+
+import pytest
+
+import cad_features
+
+
+@pytest.fixture
+def feature_pool(monkeypatch):
+    monkeypatch.setattr(cad_features, "FEATURE_WORKERS", 2)
+    cad_features.reset_feature_pool()
+    yield
+    cad_features.reset_feature_pool()
+
+
+def collect(saved):
+    async def scenario():
+        return [line async for line in cad_features.iter_batch_features(saved)]
+
+    return asyncio.run(scenario())
+
+
+def test_each_file_reports_its_own_result(tmp_path, feature_pool):
+    step = tmp_path / "part"
+    step.write_bytes(b"ISO-10303-21;\nHEADER;\nENDSEC;\n")
+    notes = tmp_path / "notes"
+    notes.write_bytes(b"not a model")
+    saved = [("bracket.step", str(step)), ("notes.txt", str(notes))]
+
+    lines = {line["file"]: line for line in collect(saved)}
+
+    assert sorted(line["index"] for line in lines.values()) == [0, 1]
+    assert lines["notes.txt"]["status"] == "failed"
+    assert "Unsupported format" in lines["notes.txt"]["error"]
+    assert all(line["seconds"] >= 0 for line in lines.values())
+    if not cad_features.HAS_OCP:
+        assert lines["bracket.step"]["error"] == "OpenCascade not installed"
+    assert not step.exists() and not notes.exists()
+
+
+def crash_on_marker(file_path, file_name):
+    """Stands in for a kernel segfault on one file; runs in the spawned workers."""
+    if file_name == "crash.step":
+        os._exit(1)
+    return {"features": {"file_name": file_name}, "seconds": 0.0}
+
+
+def test_kernel_crash_fails_only_its_file(tmp_path, feature_pool, monkeypatch):
+    monkeypatch.setattr(cad_features, "timed_feature_extraction", crash_on_marker)
+    saved = []
+    for name in ("a.step", "crash.step", "b.step", "c.step"):
+        (tmp_path / name).write_bytes(b"ISO-10303-21;\n")
+        saved.append((name, str(tmp_path / name)))
+
+    lines = {line["file"]: line for line in collect(saved)}
+
+    assert lines["crash.step"]["error"] == "Feature extraction worker crashed"
+    assert all(lines[name]["status"] == "completed" for name in ("a.step", "b.step", "c.step"))
+
+
+def test_reset_leaves_a_newer_pool_alone(feature_pool):
+    stale = cad_features.get_feature_pool()
+    cad_features.reset_feature_pool(stale)
+    current = cad_features.get_feature_pool()
+    cad_features.reset_feature_pool(stale)
+    assert cad_features.get_feature_pool() is current
+
+
+def test_feature_columns_cover_surface_histogram():
+    histogram = [name for name in cad_features.FEATURE_COLUMNS if name.startswith("surface_") and name.endswith("_count")]
+    assert histogram == [f"surface_{kind}_count" for kind in cad_features.SURFACE_KINDS]
+    assert len(set(cad_features.FEATURE_COLUMNS)) == len(cad_features.FEATURE_COLUMNS)
+
+
+def test_topology_census_of_a_box():
+    pytest.importorskip("OCP")
+    from OCP.BRepPrimAPI import BRepPrimAPI_MakeBox
+    from app.core.features import topology_census
+
+    census = topology_census(BRepPrimAPI_MakeBox(10.0, 20.0, 30.0).Shape())
+
+    assert {name: census[name] for name in ("solid_count", "shell_count", "face_count", "wire_count", "vertex_count")} == {
+        "solid_count": 1, "shell_count": 1, "face_count": 6, "wire_count": 6, "vertex_count": 8,
+    }
+    # Every box edge borders two faces: counted per face in edge_count, once in unique_edge_count
+    assert census["unique_edge_count"] == 12
+    assert census["edge_count"] == 24
+    assert census["surface_plane_count"] == 6
+    assert sum(census[f"surface_{kind}_count"] for kind in cad_features.SURFACE_KINDS) == 6
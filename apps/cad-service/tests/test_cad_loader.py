@@ -0,0 +1,62 @@
+"""
+Tests for CAD format sniffing: content decides, the extension is only a fallback.
+"""
+import struct
+
+import pytest
+
+from app.loaders.cad_loader import is_brep_file, load_cad_shape, sniff_cad_format
+from app.workers.cost_model import profile_file
+
+IGES_START = "Exported by a CAD system".ljust(72) + "S      1\n"
+IGES_GLOBAL = "1H,,1H;,4HPART,8Hpart.igs;".ljust(72) + "G      1\n"
+
+
+class TestSniffing:
+    def test_step_is_detected_without_extension(self, tmp_path):
+        path = tmp_path / "upload-7f3a"
+        path.write_text("ISO-10303-21;\nHEADER;\nENDSEC;\n")
+        assert sniff_cad_format(str(path)) == "step"
+        assert is_brep_file(str(path))
+
+    def test_iges_is_detected_behind_wrong_extension(self, tmp_path):
+        path = tmp_path / "part.step"
+        path.write_text(IGES_START + IGES_GLOBAL)
+        assert sniff_cad_format(str(path)) == "iges"
+
+    def test_brep_header(self, tmp_path):
+        path = tmp_path / "part.dat"
+        path.write_text("DBRep_DrawableShape\n\nCASCADE Topology V1, (c) Matra-Datavision\nLocations 0\n")
+        assert sniff_cad_format(str(path)) == "brep"
+
+    def test_binary_stl_with_solid_header_is_stl(self, tmp_path):
+        path = tmp_path / "part.bin"
+        path.write_bytes(b"solid exported".ljust(80, b" ") + struct.pack("<I", 2) + b"\0" * 100)
+        assert sniff_cad_format(str(path)) == "stl"
+        assert not is_brep_file(str(path))
+
+    def test_ascii_stl(self, tmp_path):
+        path = tmp_path / "part"
+        path.write_text("solid part\n  facet normal 0 0 1\n")
+        assert sniff_cad_format(str(path)) == "stl"
+
+    def test_extension_is_the_fallback(self, tmp_path):
+        unknown = tmp_path / "notes.txt"
+        unknown.write_text("hello")
+        assert sniff_cad_format(str(unknown)) is None
+        labelled = tmp_path / "part.igs"
+        labelled.write_text("hello")
+        assert sniff_cad_format(str(labelled)) == "iges"
+
+    def test_loader_rejects_non_brep_content(self, tmp_path):
+        path = tmp_path / "part.step"
+        path.write_text("solid part\n  facet normal 0 0 1\n")
+        with pytest.raises(RuntimeError, match="detected format: stl"):
+            load_cad_shape(str(path))
+
+    def test_cost_profile_uses_content_format(self, tmp_path):
+        path = tmp_path / "upload"
+        path.write_text("ISO-10303-21;\nDATA;\n#1=ADVANCED_FACE('',(#2),#3,.T.);\nENDSEC;\n")
+        profile = profile_file(str(path))
+        assert profile.fmt == "step"
+        assert profile.entity_counts.get("ADVANCED_FACE") == 1
@@ -0,0 +1,127 @@
+"""
+Tests for the offline feature-extraction CLI: corpus walking, shard schema and resume.
+"""
+import json
+import os
+
+import numpy as np
+import pytest
+
+from app import cli
+
+STEP = b"ISO-10303-21;\nHEADER;\nENDSEC;\n"
+
+
+def make_corpus(root, names):
+    for name in names:
+        path = root / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(STEP)
+
+
+def read_npz_shards(out):
+    return [dict(np.load(path)) for path in sorted(out.glob("features-*.npz"))]
+
+
+def test_manifest_paths_are_relative_to_manifest(tmp_path):
+    (tmp_path / "list.txt").write_text("# corpus\na.step\n\nsub/b.igs  # second\n")
+    assert list(cli.iter_corpus(str(tmp_path / "list.txt"))) == [
+        str(tmp_path / "a.step"),
+        str(tmp_path / "sub" / "b.igs"),
+    ]
+
+
+@pytest.fixture
+def extractor(monkeypatch):
+    """Let runs proceed without OCP; the rows then fail in the workers instead."""
+    monkeypatch.setattr(cli, "HAS_OCP", True)
+
+
+def crash_on_marker(file_path, file_name):
+    """Stands in for a kernel segfault on one file; runs in the spawned workers."""
+    if file_name == "crash.step":
+        os._exit(1)
+    return {"features": {"format": "step"}, "seconds": 0.0}
+
+
+def test_extraction_writes_fixed_schema_and_resumes(tmp_path, extractor):
+    corpus = tmp_path / "corpus"
+    out = tmp_path / "dataset"
+    make_corpus(corpus, ["a.step", "b/c.stp", "b/d.iges", "notes.txt"])
+
+    totals = cli.run_extraction(str(corpus), str(out), workers=2, shard_size=2, fmt="npz")
+
+    assert totals["files"] == 3 and totals["shards"] == 2
+    shards = read_npz_shards(out)
+    assert [len(shard["path"]) for shard in shards] == [2, 1]
+    assert all(list(shard) == [column for column, _ in cli.SCHEMA] for shard in shards)
+    assert all(shard["seconds"].dtype == np.float64 for shard in shards)
+    paths = sorted(p for shard in shards for p in shard["path"])
+    assert paths == sorted(str(p) for p in corpus.rglob("*") if p.suffix in (".step", ".stp", ".iges"))
+    # Every row is accounted for, features or not (OCP may be missing here)
+    assert all(((shard["status"] == "failed") == (shard["error"] != "")).all() for shard in shards)
+
+    make_corpus(corpus, ["e.brep"])
+    again = cli.run_extraction(str(corpus), str(out), workers=2, shard_size=2, fmt="npz")
+
+    assert again["files"] == 1 and again["skipped"] == 3
+    assert (out / "features-00002.npz").exists()
+    with open(out / cli.CHECKPOINT_NAME) as fh:
+        assert [json.loads(line)["rows"] for line in fh] == [2, 1, 1]
+
+
+def test_failed_paths_are_retried_on_request(tmp_path, extractor):
+    corpus = tmp_path / "corpus"
+    out = tmp_path / "dataset"
+    make_corpus(corpus, ["a.step", "b.step"])
+    (corpus / "b.step").write_bytes(b"not a model")
+
+    first = cli.run_extraction(str(corpus), str(out), workers=1, fmt="npz")
+    assert first["failed"] >= 1
+
+    assert cli.run_extraction(str(corpus), str(out), workers=1, fmt="npz")["files"] == 0
+    retried = cli.run_extraction(str(corpus), str(out), workers=1, fmt="npz", retry_failed=True)
+    assert retried["files"] == first["failed"]
+
+
+def test_crash_fails_only_its_file(tmp_path, extractor, monkeypatch):
+    monkeypatch.setattr(cli, "timed_feature_extraction", crash_on_marker)
+    paths = [str(tmp_path / name) for name in ("a.step", "crash.step", "b.step", "c.step")]
+
+    results = dict(cli.extract_all(paths, workers=2, max_tasks_per_child=10))
+
+    assert results[str(tmp_path / "crash.step")]["error"] == "Feature extraction worker crashed"
+    assert all("features" in results[path] for path in paths if not path.endswith("crash.step"))
+
+
+def test_extraction_refuses_without_ocp(tmp_path, monkeypatch):
+    monkeypatch.setattr(cli, "HAS_OCP", False)
+    with pytest.raises(RuntimeError, match="OCP"):
+        cli.run_extraction(str(tmp_path), str(tmp_path / "dataset"), workers=1, fmt="npz")
+    assert not (tmp_path / "dataset").exists()
+
+
+def test_dataset_with_other_schema_is_not_resumed(tmp_path, extractor, monkeypatch):
+    corpus = tmp_path / "corpus"
+    out = tmp_path / "dataset"
+    make_corpus(corpus, ["a.step"])
+    cli.run_extraction(str(corpus), str(out), workers=1, fmt="npz")
+
+    monkeypatch.setattr(cli, "SCHEMA_ID", "0" * 16)
+    with pytest.raises(RuntimeError, match="different feature schema"):
+        cli.run_extraction(str(corpus), str(out), workers=1, fmt="npz")
+
+
+def test_torn_checkpoint_line_is_dropped_before_appending(tmp_path):
+    checkpoint = cli.Checkpoint(tmp_path)
+    checkpoint.record("features-00000.npz", ["/a"], [])
+    with open(tmp_path / cli.CHECKPOINT_NAME, "a") as fh:
+        fh.write('{"shard": "features-00001.npz", "sch')
+
+    resumed = cli.Checkpoint(tmp_path)
+    assert resumed.shards == 1
+    resumed.record("features-00001.npz", ["/b"], [])
+
+    reloaded = cli.Checkpoint(tmp_path)
+    assert reloaded.shards == 2
+    assert reloaded.done == {"/a", "/b"}
@@ -0,0 +1,99 @@
+"""
+Tests for /api/convert helpers: upload spooling, the conversion cache and batch zips.
+"""
+import asyncio
+import hashlib
+import io
+import json
+import zipfile
+
+import pytest
+
+trimesh = pytest.importorskip("trimesh")
+
+from starlette.datastructures import UploadFile
+
+from app.api import conversion
+from app.utils import download
+from app.utils.download import save_upload_to_temp
+
+
+class TestUploadSpooling:
+    def test_upload_is_hashed_while_written(self, monkeypatch):
+        monkeypatch.setattr(download, "UPLOAD_CHUNK_BYTES", 7)
+        data = bytes(range(256)) * 10
+        path, sha = asyncio.run(save_upload_to_temp(UploadFile(io.BytesIO(data)), suffix=".step"))
+        with open(path, "rb") as f:
+            assert f.read() == data
+        assert sha == hashlib.sha256(data).hexdigest()
+        assert path.endswith(".step")
+
+    def test_oversized_upload_leaves_no_file(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(download.tempfile, "tempdir", str(tmp_path))
+        with pytest.raises(ValueError):
+            asyncio.run(save_upload_to_temp(UploadFile(io.BytesIO(b"x" * 100)), max_bytes=10))
+        assert not list(tmp_path.iterdir())
+
+    def test_archive_members_that_are_not_brep_are_reported(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(download.tempfile, "tempdir", str(tmp_path))
+        step = b"ISO-10303-21;\nHEADER;\nENDSEC;\n"
+        bundle = io.BytesIO()
+        with zipfile.ZipFile(bundle, "w") as zf:
+            zf.writestr("bracket.step", step)
+            zf.writestr("bracket.stl", trimesh.creation.box().export(file_type="stl"))
+        rejected = []
+
+        models = asyncio.run(conversion.spool_models(UploadFile(io.BytesIO(bundle.getvalue()), filename="parts.zip"), rejected))
+
+        assert [(name, sha) for name, _, sha in models] == [("bracket.step", hashlib.sha256(step).hexdigest())]
+        assert [entry["file"] for entry in rejected] == ["bracket.stl"]
+        assert "Unsupported file format" in rejected[0]["error"]
+        assert [p.name for p in tmp_path.iterdir()] == [models[0][1].rsplit("/", 1)[-1]]
+
+
+class TestConversionCache:
+    def test_cache_name_keys_on_content_format_and_parameters(self):
+        base = conversion.conversion_cache_name("abc", "stl", "medium")
+        assert base == conversion.conversion_cache_name("abc", "stl", "medium")
+        assert base != conversion.conversion_cache_name("abc", "obj", "medium")
+        assert base != conversion.conversion_cache_name("abc", "stl", "high")
+        assert base != conversion.conversion_cache_name("def", "stl", "medium")
+        # Explicit deflections override the preset
+        assert conversion.conversion_cache_name("abc", "stl", "low", 0.01) == conversion.conversion_cache_name(
+            "abc", "stl", "high", 0.01, conversion.DEFAULT_ANGULAR_DEFLECTION
+        )
+
+
+class TestBatchZip:
+    def test_parts_stream_into_zip_with_manifest(self, tmp_path, monkeypatch):
+        calls = []
+
+        def convert_cached(input_path, file_sha, output_format, *args):
+            calls.append(file_sha)
+            if file_sha == "bad":
+                raise conversion.CADReadError("Failed to read CAD file")
+            out = tmp_path / f"{file_sha}.{output_format}"
+            out.write_bytes(file_sha.encode() * 1000)
+            return out, False
+
+        monkeypatch.setattr(conversion, "convert_cached", convert_cached)
+        monkeypatch.setattr(conversion, "ZIP_CHUNK", 64)
+        inputs = []
+        for filename, file_sha in [("a.step", "aaa"), ("dir/a.stp", "aaa"), ("b.igs", "bbb"), ("c.step", "bad")]:
+            path = tmp_path / f"upload-{len(inputs)}"
+            path.write_bytes(b"ISO-10303-21;")
+            inputs.append((filename, str(path), file_sha))
+
+        rejected = [{"file": "notes.stl", "error": "Unsupported file format: notes.stl."}]
+        chunks = list(conversion.stream_batch_zip(inputs, "stl", "medium", rejected=rejected))
+
+        assert len(chunks) > 3
+        with zipfile.ZipFile(io.BytesIO(b"".join(chunks))) as archive:
+            assert sorted(archive.namelist()) == ["a-2.stl", "a.stl", "b.stl", "manifest.json"]
+            assert archive.read("b.stl") == b"bbb" * 1000
+            manifest = {entry["file"]: entry for entry in json.loads(archive.read("manifest.json"))}
+        assert sorted(calls) == ["aaa", "bad", "bbb"]
+        assert manifest["c.step"]["error"] == "Failed to read CAD file"
+        assert manifest["notes.stl"]["error"].startswith("Unsupported file format")
+        assert manifest["dir/a.stp"]["output"] in ("a.stl", "a-2.stl")
+        assert not any((tmp_path / f"upload-{i}").exists() for i in range(len(inputs)))
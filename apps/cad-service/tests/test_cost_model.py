@@ -0,0 +1,74 @@
+"""
+Unit tests for the CAD job cost model and fast/heavy queue routing.
+"""
+import struct
+
+import pytest
+
+from app.workers.cost_model import (
+    FAST_QUEUE,
+    HEAVY_QUEUE,
+    CostModel,
+    FileProfile,
+    choose_queue,
+    profile_file,
+    step_entity_census,
+    stl_triangle_count,
+)
+
+
+def write_step(path, faces: int, bsplines: int = 0):
+    lines = ["ISO-10303-21;", "HEADER;", "ENDSEC;", "DATA;"]
+    n = 1
+    for _ in range(faces):
+        lines.append(f"#{n}=ADVANCED_FACE('',(#{n + 1}),#{n + 2},.T.);")
+        n += 1
+    for _ in range(bsplines):
+        lines.append(f"#{n} = B_SPLINE_SURFACE_WITH_KNOTS('',3,3,(),.UNSPECIFIED.);")
+        n += 1
+    lines += ["ENDSEC;", "END-ISO-10303-21;"]
+    path.write_text("\n".join(lines))
+
+
+class TestFileProfiling:
+    def test_step_census_counts_entities(self, tmp_path):
+        step = tmp_path / "part.step"
+        write_step(step, faces=120, bsplines=7)
+        counts = step_entity_census(str(step))
+        assert counts["ADVANCED_FACE"] == 120
+        assert counts["B_SPLINE_SURFACE_WITH_KNOTS"] == 7
+
+    def test_step_census_handles_chunk_boundaries(self, tmp_path):
+        step = tmp_path / "big.stp"
+        write_step(step, faces=40_000)
+        assert step_entity_census(str(step))["ADVANCED_FACE"] == 40_000
+
+    def test_binary_stl_triangle_count(self, tmp_path):
+        stl = tmp_path / "mesh.stl"
+        stl.write_bytes(b"\0" * 80 + struct.pack("<I", 3) + b"\0" * 150)
+        assert stl_triangle_count(str(stl)) == 3
+        assert profile_file(str(stl)).triangle_count == 3
+
+
+class TestCostModel:
+    def test_bigger_files_cost_more(self):
+        model = CostModel()
+        small = FileProfile(size_bytes=20_000, fmt="step", entity_counts={"ADVANCED_FACE": 30})
+        big = FileProfile(size_bytes=150 * 1024 * 1024, fmt="step")
+        assert model.estimate_seconds(small) < model.estimate_seconds(big)
+        assert choose_queue(model.estimate_seconds(small)) == FAST_QUEUE
+        assert choose_queue(model.estimate_seconds(big)) == HEAVY_QUEUE
+
+    def test_fit_learns_from_recorded_timings(self):
+        samples = []
+        for faces in range(100, 5100, 100):
+            profile = FileProfile(size_bytes=faces * 4000, fmt="step", entity_counts={"ADVANCED_FACE": faces})
+            # Observed: 10 s per thousand faces
+            samples.append({"profile": profile.__dict__, "stage": "analyze", "seconds": faces / 100.0})
+        model = CostModel()
+        used = model.fit(samples)
+        assert used == {"step": len(samples)}
+        probe = FileProfile(size_bytes=3000 * 4000, fmt="step", entity_counts={"ADVANCED_FACE": 3000})
+        assert model.estimate_seconds(probe) == pytest.approx(30.0, rel=0.15)
+        restored = CostModel.from_json(model.to_json())
+        assert restored.estimate_seconds(probe) == pytest.approx(model.estimate_seconds(probe))
@@ -0,0 +1,80 @@
+"""
+Tests for deadline-aware analysis and its completeness reporting.
+"""
+import time
+
+import pytest
+
+from app.utils.deadline import Deadline, MIN_THICKNESS_SAMPLES
+
+trimesh = pytest.importorskip("trimesh")
+
+
+@pytest.fixture
+def plate_stl(tmp_path):
+    path = tmp_path / "plate.stl"
+    trimesh.creation.box((100.0, 50.0, 2.0)).export(str(path))
+    return str(path)
+
+
+class TestDeadline:
+    def test_no_deadline_never_expires(self):
+        deadline = Deadline(None)
+        assert not deadline.expired()
+        assert deadline.remaining_ms() is None
+        assert deadline.thickness_samples(8000) == 8000
+
+    def test_expired_deadline_skips_stages(self):
+        deadline = Deadline(0)
+        assert deadline.expired()
+        assert not deadline.allows("features")
+        assert deadline.completeness()["level"] == "partial"
+        assert deadline.completeness()["skipped_stages"] == ["features"]
+
+    def test_thickness_samples_shrink_with_budget(self):
+        assert Deadline(100).thickness_samples(8000) == MIN_THICKNESS_SAMPLES
+        assert Deadline(60_000).thickness_samples(8000) == 8000
+
+
+class TestDeadlineAwareAnalysis:
+    def test_full_analysis_reports_full(self, plate_stl):
+        from app.routers.analyze import analyze_file_path
+
+        metrics = analyze_file_path(plate_stl)
+        assert metrics["completeness"]["level"] == "full"
+        assert metrics["completeness"]["completed_stages"] == ["mass_props", "thickness"]
+
+    def test_expired_deadline_returns_mass_props_only(self, plate_stl):
+        from app.routers.analyze import analyze_file_path
+
+        metrics = analyze_file_path(plate_stl, deadline_ms=0)
+        assert metrics["completeness"]["level"] == "partial"
+        assert metrics["completeness"]["skipped_stages"] == ["thickness"]
+        assert metrics["volume"] == pytest.approx(10.0)  # 100 x 50 x 2 mm = 10 cm^3
+        assert metrics["thickness"] is None
+
+    def test_stage_is_stopped_at_the_deadline(self):
+        from app.routers.analyze import run_stage
+        from app.workers.kernel_pool import KernelPool
+
+        pool = KernelPool(size=1)
+        pool.warm()
+        deadline = Deadline(300)
+        started = time.monotonic()
+        try:
+            assert run_stage(deadline, "thickness", pool, time.sleep, 30) is None
+        finally:
+            pool.shutdown()
+        assert time.monotonic() - started < 5
+        assert deadline.completeness()["skipped_stages"] == ["thickness"]
+        assert pool.restarts == 1
+
+    def test_failed_stage_is_reported(self):
+        from app.routers.analyze import kernel_pool, run_stage
+
+        deadline = Deadline(None)
+        assert run_stage(deadline, "features", kernel_pool, int, "not a number") is None
+        completeness = deadline.completeness()
+        assert completeness["level"] == "partial"
+        assert completeness["failed_stages"] == ["features"]
+        assert completeness["skipped_stages"] == []
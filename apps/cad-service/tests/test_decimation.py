@@ -0,0 +1,79 @@
+"""
+Tests and benchmark for the in-tree quadric decimator used for GLB LODs.
+"""
+import time
+
+import numpy as np
+import pytest
+
+trimesh = pytest.importorskip("trimesh")
+
+from app.core.decimation import decimate, decimate_labeled
+from app.routers.gltf import LOD_TARGETS, lods_finest_first, simplify_mesh
+
+# Generous bound for CI machines; a 330k-triangle mesh takes a few seconds locally
+LOD_BENCHMARK_BUDGET_S = 60.0
+
+
+class TestDecimate:
+    def test_flat_faces_and_sharp_edges_survive(self):
+        box = trimesh.creation.box(extents=(10.0, 4.0, 2.0))
+        for _ in range(5):
+            box = box.subdivide()
+        vertices, faces = decimate(box.vertices, box.faces, 500)
+        result = trimesh.Trimesh(vertices, faces, process=False)
+
+        assert len(faces) <= 500
+        assert np.allclose(result.bounds, box.bounds, atol=1e-6)
+        assert result.volume == pytest.approx(80.0, rel=1e-6)
+        assert result.is_watertight
+
+    def test_open_boundary_stays_in_place(self):
+        tube = trimesh.creation.cylinder(radius=1.0, height=2.0, sections=128).subdivide().subdivide()
+        side = tube.faces[np.abs(tube.face_normals[:, 2]) < 0.5]
+        open_tube = trimesh.Trimesh(tube.vertices, side, process=True)
+
+        vertices, faces = decimate(open_tube.vertices, open_tube.faces, 1000)
+
+        assert len(faces) <= 1000
+        # Rim vertices stay on the rim planes and the surface stays on the cylinder
+        assert np.abs(vertices[:, 2]).max() == pytest.approx(1.0)
+        assert np.allclose(np.linalg.norm(vertices[:, :2], axis=1), 1.0, atol=1e-3)
+
+    def test_face_labels_follow_surviving_triangles(self):
+        box = trimesh.creation.box()
+        for _ in range(4):
+            box = box.subdivide()
+        axis = np.argmax(np.abs(box.face_normals), axis=1)
+        labels = axis * 2 + (box.face_normals.sum(axis=1) > 0) + 1
+
+        vertices, faces, kept = decimate_labeled(box.vertices, box.faces, labels, 200)
+        result = trimesh.Trimesh(vertices, faces, process=False)
+
+        assert len(kept) == len(faces) <= 200
+        assert set(kept.tolist()) == set(range(1, 7))
+        # Every triangle still lies on the box side it was labelled with
+        for label in range(1, 7):
+            normals = result.face_normals[kept == label]
+            assert np.allclose(normals, normals[0], atol=1e-6)
+
+    def test_input_arrays_are_not_modified(self):
+        sphere = trimesh.creation.icosphere(subdivisions=3)
+        faces = sphere.faces.copy()
+        decimate(sphere.vertices, sphere.faces, 200)
+        assert np.array_equal(sphere.faces, faces)
+
+
+class TestLodBenchmark:
+    def test_progressive_lods_hit_targets(self):
+        mesh = trimesh.creation.icosphere(subdivisions=7)  # 327,680 triangles
+        timings = {}
+        for lod in lods_finest_first():
+            started = time.perf_counter()
+            mesh = simplify_mesh(mesh, LOD_TARGETS[lod])
+            timings[lod] = time.perf_counter() - started
+            assert len(mesh.faces) <= LOD_TARGETS[lod]
+            assert len(mesh.faces) >= 0.95 * min(LOD_TARGETS[lod], 327_680)
+        assert sum(timings.values()) < LOD_BENCHMARK_BUDGET_S, timings
+        # Geometry stays on the sphere
+        assert np.allclose(np.linalg.norm(mesh.vertices, axis=1), 1.0, atol=1e-2)
@@ -0,0 +1,115 @@
+"""
+Tests for the quantized GLB encoder.
+"""
+import json
+import struct
+
+import numpy as np
+import pytest
+
+trimesh = pytest.importorskip("trimesh")
+
+from app.core.glb import FACE_RANGES_EXTENSION, QUANTIZATION_EXTENSION, add_face_ranges, cache_friendly_order, encode_mesh
+
+
+def parse_glb(data: bytes):
+    magic, version, total = struct.unpack_from("<III", data, 0)
+    assert (magic, version, total) == (0x46546C67, 2, len(data))
+    json_len, _ = struct.unpack_from("<II", data, 12)
+    gltf = json.loads(data[20:20 + json_len])
+    bin_len, _ = struct.unpack_from("<II", data, 20 + json_len)
+    blob = data[28 + json_len:28 + json_len + bin_len]
+    return gltf, blob
+
+
+def read_accessor(gltf, blob, index, dtype, width):
+    accessor = gltf["accessors"][index]
+    view = gltf["bufferViews"][accessor["bufferView"]]
+    raw = np.frombuffer(blob, dtype=dtype, count=view["byteLength"] // np.dtype(dtype).itemsize, offset=view["byteOffset"])
+    stride = view.get("byteStride", width * np.dtype(dtype).itemsize) // np.dtype(dtype).itemsize
+    return raw.reshape(-1, stride)[: accessor["count"], :width]
+
+
+class TestQuantizedGlb:
+    def test_round_trip_within_quantization_error(self):
+        mesh = trimesh.creation.icosphere(subdivisions=4, radius=50.0)
+        mesh.apply_translation([100.0, -20.0, 5.0])
+        gltf, blob = parse_glb(encode_mesh(mesh))
+
+        assert gltf["extensionsRequired"] == [QUANTIZATION_EXTENSION]
+        node = gltf["nodes"][0]
+        primitive = gltf["meshes"][0]["primitives"][0]
+        positions = read_accessor(gltf, blob, primitive["attributes"]["POSITION"], np.int16, 3)
+        decoded = positions / 32767.0 * np.array(node["scale"]) + np.array(node["translation"])
+        # Every decoded vertex lies on the original sphere, to within one quantization step
+        step = node["scale"][0] / 32767.0
+        radii = np.linalg.norm(decoded - [100.0, -20.0, 5.0], axis=1)
+        assert np.abs(radii - 50.0).max() < 2 * step
+
+        normals = read_accessor(gltf, blob, primitive["attributes"]["NORMAL"], np.int8, 3) / 127.0
+        assert np.allclose(np.linalg.norm(normals, axis=1), 1.0, atol=0.02)
+
+        indices = read_accessor(gltf, blob, primitive["indices"], np.uint16, 1).reshape(-1, 3)
+        assert gltf["accessors"][primitive["indices"]]["componentType"] == 5123
+        assert len(indices) == len(mesh.faces)
+        assert np.isclose(trimesh.Trimesh(decoded, indices, process=False).area, mesh.area, rtol=1e-3)
+
+    def test_large_mesh_is_split_into_uint16_primitives(self):
+        mesh = trimesh.creation.icosphere(subdivisions=7)  # 163,842 vertices
+        mesh.vertex_normals  # raw export includes normals when computed
+        encoded = encode_mesh(mesh)
+        gltf, _ = parse_glb(encoded)
+
+        primitives = gltf["meshes"][0]["primitives"]
+        assert len(primitives) > 1
+        assert {gltf["accessors"][p["indices"]]["componentType"] for p in primitives} == {5123}
+        assert sum(gltf["accessors"][p["indices"]]["count"] for p in primitives) == 3 * len(mesh.faces)
+        assert all(gltf["accessors"][p["attributes"]["POSITION"]]["count"] <= 0xFFFF for p in primitives)
+        assert len(encoded) < 0.55 * len(mesh.export(file_type="glb"))
+
+    def test_cache_order_keeps_every_triangle(self):
+        mesh = trimesh.creation.icosphere(subdivisions=3)
+        order, faces = cache_friendly_order(mesh.vertices, mesh.faces)
+        original = {tuple(sorted(face)) for face in mesh.faces.tolist()}
+        reordered = {tuple(sorted(face)) for face in order[faces].tolist()}
+        assert reordered == original
+        # Vertices are numbered in first-use order
+        _, first_use = np.unique(faces.reshape(-1), return_index=True)
+        assert np.all(np.diff(first_use) > 0)
+
+
+class TestFaceRanges:
+    def test_each_face_is_one_run_per_primitive(self):
+        mesh = trimesh.creation.icosphere(subdivisions=7)
+        # Octants stand in for B-rep faces
+        face_ids = (mesh.triangles_center > 0).astype(np.int32) @ [1, 2, 4] + 1
+        gltf, blob = parse_glb(encode_mesh(mesh, face_ids))
+
+        assert FACE_RANGES_EXTENSION in gltf["extensionsUsed"]
+        assert FACE_RANGES_EXTENSION not in gltf["extensionsRequired"]
+        totals = {}
+        for primitive in gltf["meshes"][0]["primitives"]:
+            ranges = primitive["extensions"][FACE_RANGES_EXTENSION]
+            assert len(set(ranges["faceIds"])) == len(ranges["faceIds"])
+            assert sum(ranges["triangleCounts"]) * 3 == gltf["accessors"][primitive["indices"]]["count"]
+            for face_id, count in zip(ranges["faceIds"], ranges["triangleCounts"]):
+                totals[face_id] = totals.get(face_id, 0) + count
+        assert totals == dict(zip(*np.unique(face_ids, return_counts=True)))
+
+        # The first run's triangles really are the first face's triangles
+        primitive = gltf["meshes"][0]["primitives"][0]
+        node = gltf["nodes"][0]
+        positions = read_accessor(gltf, blob, primitive["attributes"]["POSITION"], np.int16, 3)
+        decoded = positions / 32767.0 * np.array(node["scale"]) + np.array(node["translation"])
+        indices = read_accessor(gltf, blob, primitive["indices"], np.uint16, 1).reshape(-1, 3)
+        count = primitive["extensions"][FACE_RANGES_EXTENSION]["triangleCounts"][0]
+        assert np.all(decoded[indices[:count]].mean(axis=1) < 1e-3)
+
+    def test_ranges_can_be_added_to_a_raw_export(self):
+        mesh = trimesh.creation.box()
+        face_ids = np.sort(np.arange(len(mesh.faces)) // 2 + 1)
+        gltf, blob = parse_glb(add_face_ranges(mesh.export(file_type="glb"), face_ids))
+
+        ranges = gltf["meshes"][0]["primitives"][0]["extensions"][FACE_RANGES_EXTENSION]
+        assert ranges == {"faceIds": [1, 2, 3, 4, 5, 6], "triangleCounts": [2] * 6}
+        assert len(blob) == gltf["buffers"][0]["byteLength"]
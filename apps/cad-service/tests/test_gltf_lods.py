@@ -0,0 +1,93 @@
+"""
+Tests for one-pass LOD set generation: a single load, every GLB plus one sidecar.
+"""
+import json
+
+import pytest
+
+trimesh = pytest.importorskip("trimesh")
+
+from app.routers import gltf
+from app.routers.gltf import DEFAULT_LODS, ensure_glb_bytes, read_lod_metadata, stl_lod_keys
+from app.utils.artifact_cache import ArtifactCache
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(gltf, "artifact_cache", ArtifactCache(tmp_path))
+    return tmp_path
+
+
+class TestLodSet:
+    def test_first_request_builds_every_lod_from_one_load(self, cache_dir):
+        loads = []
+
+        def load_mesh():
+            loads.append(1)
+            return trimesh.creation.icosphere(subdivisions=3)
+
+        set_key, cache_keys = stl_lod_keys("abc123")
+        metadata, glb_bytes = ensure_glb_bytes(
+            load_mesh,
+            prefix="stl",
+            file_sha="abc123",
+            lod="low",
+            set_key=set_key,
+            cache_keys=cache_keys,
+            shared=False,
+        )
+
+        assert len(loads) == 1
+        assert glb_bytes[:4] == b"glTF"
+        assert metadata["lod"] == "low"
+        for lod in DEFAULT_LODS:
+            assert (cache_dir / f"{cache_keys[lod]}.glb").exists()
+            assert (cache_dir / f"{cache_keys[lod]}.quantized.glb").exists()
+        assert metadata["encodings"]["quantized"]["compression_ratio"] > 1
+        sidecar = json.loads((cache_dir / f"{set_key}.json").read_text())
+        assert set(sidecar["lods"]) == set(DEFAULT_LODS)
+        assert read_lod_metadata(set_key, "med")["mesh_version"] == cache_keys["med"]
+        # No temp files are left behind by the atomic writes
+        assert not list(cache_dir.glob(".*"))
+
+    def test_lods_decimate_progressively(self, cache_dir, monkeypatch):
+        targets = []
+
+        def simplify(mesh, target):
+            targets.append((len(mesh.faces), target))
+            return mesh
+
+        monkeypatch.setattr(gltf, "simplify_mesh", simplify)
+        set_key, cache_keys = stl_lod_keys("def456")
+        gltf.ensure_mesh_artifacts(
+            lambda: trimesh.creation.box(),
+            prefix="stl",
+            file_sha="def456",
+            lod="high",
+            set_key=set_key,
+            cache_keys=cache_keys,
+            shared=False,
+        )
+
+        assert [target for _, target in targets] == sorted(gltf.LOD_TARGETS.values(), reverse=True)
+
+
+class TestConvertToGltf:
+    def test_task_pregenerates_every_lod_once(self, cache_dir, tmp_path_factory, monkeypatch):
+        fakeredis = pytest.importorskip("fakeredis")
+        from app.utils.singleflight import SingleFlight
+
+        monkeypatch.setattr(gltf, "single_flight", SingleFlight(fakeredis.FakeRedis()))
+        stl_path = tmp_path_factory.mktemp("src") / "part.stl"
+        trimesh.creation.icosphere(subdivisions=2).export(str(stl_path))
+
+        first = gltf.convert_to_gltf("part-1", str(stl_path))
+        again = gltf.convert_to_gltf("part-1", str(stl_path))
+
+        assert first["cached"] is False and again["cached"] is True
+        assert first["mesh_versions"] == stl_lod_keys(first["file_sha"])[1]
+        for mesh_version in first["mesh_versions"].values():
+            assert (cache_dir / f"{mesh_version}.quantized.glb").exists()
+
+    def test_task_reports_missing_source(self, cache_dir):
+        assert gltf.convert_to_gltf("part-2", "") == {"error": "file_path or file_url is required"}
@@ -0,0 +1,97 @@
+"""
+Tests for cached GLB serving: file-backed responses, Range requests and ETag/304.
+"""
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+trimesh = pytest.importorskip("trimesh")
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.routers import gltf
+from app.utils.artifact_cache import ArtifactCache
+from app.utils.singleflight import SingleFlight
+
+FILE_URL = "https://files.example/part.stl"
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    redis = fakeredis.FakeRedis()
+    stl_path = tmp_path / "part.stl"
+    trimesh.creation.icosphere(subdivisions=2).export(str(stl_path))
+    downloads = []
+    origin = {"validator": '"v1"||'}
+
+    def download(url):
+        downloads.append(url)
+        return str(stl_path)
+
+    monkeypatch.setattr(gltf, "artifact_cache", ArtifactCache(tmp_path / "cache"))
+    monkeypatch.setattr(gltf, "download_to_temp", download)
+    monkeypatch.setattr(gltf, "get_redis", lambda: redis)
+    monkeypatch.setattr(gltf, "origin_validator", lambda url: origin["validator"])
+    monkeypatch.setattr(gltf, "single_flight", SingleFlight(redis))
+    app = FastAPI()
+    app.include_router(gltf.router, prefix="/gltf")
+    test_client = TestClient(app)
+    test_client.downloads = downloads
+    test_client.origin = origin
+    return test_client
+
+
+class TestGlbServing:
+    def test_repeat_load_is_answered_with_304_without_download(self, client):
+        first = client.get("/gltf/stream", params={"file_url": FILE_URL})
+        assert first.status_code == 200
+        assert first.content[:4] == b"glTF"
+        etag = first.headers["etag"]
+        assert etag == f'"{first.headers["x-mesh-version"]}.raw"'
+
+        again = client.get("/gltf/stream", params={"file_url": FILE_URL}, headers={"If-None-Match": etag})
+        assert again.status_code == 304
+        assert again.content == b""
+        assert len(client.downloads) == 1
+
+    def test_cache_hits_support_range_requests(self, client):
+        full = client.get("/gltf/stream", params={"file_url": FILE_URL, "encoding": "quantized"})
+        partial = client.get(
+            "/gltf/stream",
+            params={"file_url": FILE_URL, "encoding": "quantized"},
+            headers={"Range": "bytes=0-3"},
+        )
+        assert partial.status_code == 206
+        assert partial.content == b"glTF"
+        assert partial.headers["content-range"] == f"bytes 0-3/{len(full.content)}"
+        assert partial.headers["etag"] == full.headers["etag"]
+
+    def test_gzip_variant_has_its_own_etag(self, client):
+        plain = client.get("/gltf/stream", params={"file_url": FILE_URL})
+        compressed = client.get("/gltf/stream", params={"file_url": FILE_URL, "compression": "gzip"})
+        assert compressed.headers["content-encoding"] == "gzip"
+        assert compressed.content == plain.content
+        assert compressed.headers["etag"] != plain.headers["etag"]
+
+    def test_changed_origin_is_downloaded_again(self, client):
+        first = client.get("/gltf/stream", params={"file_url": FILE_URL})
+        client.origin["validator"] = '"v2"||'
+        again = client.get("/gltf/stream", params={"file_url": FILE_URL}, headers={"If-None-Match": first.headers["etag"]})
+        # Same bytes behind the new validator, so still a 304, but only after re-hashing
+        assert again.status_code == 304
+        assert len(client.downloads) == 2
+
+    def test_origin_without_validators_is_never_trusted(self, client):
+        client.origin["validator"] = None
+        first = client.get("/gltf/stream", params={"file_url": FILE_URL})
+        client.get("/gltf/stream", params={"file_url": FILE_URL}, headers={"If-None-Match": first.headers["etag"]})
+        assert len(client.downloads) == 2
+
+    def test_cached_file_survives_eviction_while_being_served(self, client, tmp_path):
+        first = client.get("/gltf/stream", params={"file_url": FILE_URL})
+        cache_path = gltf.artifact_cache.peek(gltf.mesh_cache_name(first.headers["x-mesh-version"]))
+        response = gltf.glb_response(first.headers["x-mesh-version"], "raw", "none", cache_path=cache_path)
+        cache_path.unlink()
+        with open(response.path, "rb") as handle:
+            assert handle.read() == first.content
+        gltf.unlink_quietly(response.path)
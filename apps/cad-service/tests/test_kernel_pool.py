@@ -0,0 +1,46 @@
+"""
+Tests for the supervised kernel subprocess pool: results, deadlines and crash recovery.
+"""
+import math
+import os
+import time
+
+import pytest
+
+from app.workers.kernel_pool import KernelCrashed, KernelPool, KernelTimeout
+
+
+@pytest.fixture
+def pool():
+    pool = KernelPool(size=1, timeout=30)
+    yield pool
+    pool.shutdown()
+
+
+class TestKernelPool:
+    def test_returns_results_from_helper(self, pool):
+        assert pool.run(math.sqrt, 16.0) == 4.0
+        helper_pid = pool.run(os.getpid)
+        assert helper_pid != os.getpid()
+        # Helpers are reused between calls
+        assert pool.run(os.getpid) == helper_pid
+
+    def test_exceptions_propagate_without_restart(self, pool):
+        with pytest.raises(ValueError):
+            pool.run(math.sqrt, -1.0)
+        assert pool.restarts == 0
+
+    def test_hung_operation_is_killed_at_deadline(self, pool):
+        started = time.monotonic()
+        with pytest.raises(KernelTimeout):
+            pool.run(time.sleep, 30, timeout=0.5)
+        assert time.monotonic() - started < 5
+        assert pool.restarts == 1
+        # A fresh helper takes over
+        assert pool.run(math.sqrt, 9.0) == 3.0
+
+    def test_crashed_helper_is_replaced(self, pool):
+        with pytest.raises(KernelCrashed):
+            pool.run(os.abort)
+        assert pool.restarts == 1
+        assert pool.run(math.sqrt, 4.0) == 2.0
@@ -0,0 +1,82 @@
+"""
+Tests for per-task RSS monitoring and the hard memory limit.
+"""
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+psutil = pytest.importorskip("psutil")
+
+from app.workers.kernel_pool import KernelPool
+from app.workers.memory import MB, MemoryLimitExceeded, RssGuard, check_memory_limit
+
+
+class TestRssGuard:
+    def test_records_peak_memory(self):
+        with RssGuard(interval=0.01) as guard:
+            blob = bytearray(64 * MB)
+            time.sleep(0.05)
+            del blob
+        usage = guard.as_dict()
+        assert usage["peak_rss_mb"] >= usage["start_rss_mb"] + 32
+        assert usage["hard_limit_tripped"] is False
+
+    def test_hard_limit_aborts_running_task_at_stage_boundary(self):
+        with pytest.raises(MemoryLimitExceeded):
+            with RssGuard(hard_limit_mb=1, interval=0.01) as guard:
+                deadline = time.monotonic() + 5
+                while time.monotonic() < deadline:
+                    time.sleep(0.001)
+                    check_memory_limit()
+        assert guard.tripped
+
+    def test_hard_limit_kills_kernel_subprocess(self):
+        helper = None
+        try:
+            with pytest.raises(MemoryLimitExceeded):
+                with RssGuard(interval=0.01) as guard:
+                    guard.hard_limit = guard.start_rss + 128 * MB
+                    helper = subprocess.Popen(
+                        [sys.executable, "-c", "import time; blob = bytearray(256 * 1024 * 1024); time.sleep(30)"]
+                    )
+                    helper.wait(timeout=10)
+            assert helper.returncode is not None and guard.killed >= 1
+        finally:
+            if helper is not None:
+                helper.kill()
+
+    def test_check_is_a_no_op_outside_a_tripped_guard(self):
+        check_memory_limit()
+        with RssGuard(interval=0.01):
+            check_memory_limit()
+
+    def test_limit_error_is_not_swallowed_by_broad_handlers(self):
+        with pytest.raises(MemoryLimitExceeded):
+            with RssGuard(hard_limit_mb=1, interval=0.01):
+                try:
+                    time.sleep(0.2)
+                    for _ in range(1000):
+                        time.sleep(0.001)
+                        check_memory_limit()
+                except Exception:
+                    pytest.fail("MemoryLimitExceeded must bypass `except Exception`")
+
+    def test_helper_above_soft_limit_is_replaced(self):
+        pool = KernelPool(size=1, timeout=30)
+        try:
+            bloated_pid = pool.run(os.getpid)
+            baseline = psutil.Process(bloated_pid).memory_info().rss
+            soft_limit_mb = baseline // MB + 128
+            with RssGuard(soft_limit_mb=soft_limit_mb, interval=0.01):
+                pool.run(exec, "import builtins; builtins.blob = b'x' * (256 * 1024 * 1024)")
+            assert pool.restarts == 1
+            assert pool.run(os.getpid) != bloated_pid
+            # A helper under the limit is kept
+            with RssGuard(soft_limit_mb=soft_limit_mb, interval=0.01):
+                pass
+            assert pool.restarts == 1
+        finally:
+            pool.shutdown()
@@ -0,0 +1,75 @@
+"""
+Tests for the array-based STL/OBJ/PLY/3MF writers.
+"""
+import io
+import zipfile
+import xml.etree.ElementTree as ET
+
+import numpy as np
+import pytest
+
+trimesh = pytest.importorskip("trimesh")
+
+from app.core import mesh_writers
+from app.core.mesh_writers import THREEMF_MODEL, write_mesh
+
+CORE_NS = "{http://schemas.microsoft.com/3dmanufacturing/core/2015/02}"
+
+
+@pytest.fixture
+def box(monkeypatch):
+    # Small chunks so every writer crosses chunk boundaries
+    monkeypatch.setattr(mesh_writers, "WRITE_CHUNK", 5)
+    return trimesh.creation.box(extents=(2, 3, 4))
+
+
+class TestMeshWriters:
+    @pytest.mark.parametrize("output_format", ["stl", "obj", "ply"])
+    def test_written_mesh_round_trips(self, box, output_format):
+        buffer = io.BytesIO()
+        write_mesh(box.vertices, box.faces, output_format, buffer)
+        buffer.seek(0)
+
+        mesh = trimesh.load(buffer, file_type=output_format, process=True)
+        assert len(mesh.faces) == len(box.faces)
+        assert mesh.is_watertight
+        assert mesh.volume == pytest.approx(24, rel=1e-5)
+
+    def test_3mf_package_holds_the_mesh(self, box):
+        buffer = io.BytesIO()
+        write_mesh(box.vertices, box.faces, "3mf", buffer)
+
+        with zipfile.ZipFile(buffer) as package:
+            assert {"[Content_Types].xml", "_rels/.rels", THREEMF_MODEL} <= set(package.namelist())
+            model = ET.fromstring(package.read(THREEMF_MODEL))
+        vertices = np.array(
+            [[float(v.get(axis)) for axis in "xyz"] for v in model.iter(f"{CORE_NS}vertex")]
+        )
+        faces = np.array(
+            [[int(t.get(k)) for k in ("v1", "v2", "v3")] for t in model.iter(f"{CORE_NS}triangle")]
+        )
+        mesh = trimesh.Trimesh(vertices, faces)
+        assert mesh.is_watertight
+        assert mesh.volume == pytest.approx(24, rel=1e-5)
+
+    def test_text_formats_keep_large_coordinates(self):
+        vertices = np.array([[12345.678, -98765.4321, 0.001], [12345.679, 0.0, 0.0], [0.0, 1.0, 0.0]])
+        faces = np.array([[0, 1, 2]])
+        obj, threemf = io.BytesIO(), io.BytesIO()
+        write_mesh(vertices, faces, "obj", obj)
+        write_mesh(vertices, faces, "3mf", threemf)
+
+        obj_vertices = [
+            [float(value) for value in line.split()[1:]]
+            for line in obj.getvalue().decode().splitlines()
+            if line.startswith("v ")
+        ]
+        with zipfile.ZipFile(threemf) as package:
+            model = ET.fromstring(package.read(THREEMF_MODEL))
+        threemf_vertices = [[float(v.get(axis)) for axis in "xyz"] for v in model.iter(f"{CORE_NS}vertex")]
+        np.testing.assert_allclose(obj_vertices, vertices, rtol=0, atol=1e-6)
+        np.testing.assert_allclose(threemf_vertices, vertices, rtol=0, atol=1e-6)
+
+    def test_unknown_format_is_rejected(self, box):
+        with pytest.raises(ValueError):
+            write_mesh(box.vertices, box.faces, "step", io.BytesIO())
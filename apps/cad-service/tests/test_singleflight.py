@@ -0,0 +1,98 @@
+"""
+Unit tests for Redis single-flight deduplication of CAD operations.
+"""
+import threading
+import time
+
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+
+from app.utils.singleflight import SingleFlight, single_flight_key
+
+
+@pytest.fixture
+def client():
+    return fakeredis.FakeRedis()
+
+
+class TestSingleFlight:
+    """Concurrent identical requests should compute once."""
+
+    def test_key_is_stable_and_param_sensitive(self):
+        a = single_flight_key("abc", "analyze", {"units_hint": "mm", "ext": ".step"})
+        b = single_flight_key("abc", "analyze", {"ext": ".step", "units_hint": "mm"})
+        c = single_flight_key("abc", "analyze", {"units_hint": "inch", "ext": ".step"})
+        assert a == b
+        assert a != c
+
+    def test_leader_publishes_result_for_late_callers(self, client):
+        flight = SingleFlight(client)
+        calls = []
+
+        def compute():
+            calls.append(1)
+            return {"volume": 12.5}
+
+        assert flight.run("sha", "analyze", {}, compute) == {"volume": 12.5}
+        assert flight.run("sha", "analyze", {}, compute) == {"volume": 12.5}
+        assert flight.peek("sha", "analyze", {}) == {"volume": 12.5}
+        assert len(calls) == 1
+
+    def test_concurrent_callers_share_one_computation(self, client):
+        flight = SingleFlight(client, poll_interval=0.01)
+        calls = []
+        results = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.2)
+            return {"triangles": 42}
+
+        def worker():
+            results.append(flight.run("sha", "gltf-step", {"lod": "low"}, compute))
+
+        threads = [threading.Thread(target=worker) for _ in range(5)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        assert len(calls) == 1
+        assert results == [{"triangles": 42}] * 5
+
+    def test_follower_takes_over_when_leader_fails(self, client):
+        flight = SingleFlight(client, poll_interval=0.01)
+
+        def failing():
+            raise RuntimeError("STEP read failed")
+
+        with pytest.raises(RuntimeError):
+            flight.run("sha", "analyze", {}, failing)
+        # Lock was released, so the next caller computes instead of waiting it out
+        assert flight.run("sha", "analyze", {}, lambda: {"ok": True}) == {"ok": True}
+
+    def test_redis_outage_computes_locally(self):
+        class DownRedis:
+            def get(self, *args, **kwargs):
+                raise ConnectionError("redis down")
+
+        flight = SingleFlight(DownRedis())
+        assert flight.run("sha", "analyze", {}, lambda: 7) == 7
+
+    def test_follower_computes_locally_when_redis_fails_mid_wait(self, client, monkeypatch):
+        flight = SingleFlight(client, poll_interval=0.01)
+        key = single_flight_key("sha", "analyze", {})
+        client.set(f"{key}:lock", "other-leader")
+        real_get = client.get
+        calls = []
+
+        def flaky_get(name):
+            calls.append(name)
+            if len(calls) > 2:
+                raise ConnectionError("redis went away")
+            return real_get(name)
+
+        monkeypatch.setattr(client, "get", flaky_get)
+        assert flight.run("sha", "analyze", {}, lambda: {"volume": 1.0}) == {"volume": 1.0}
+        assert len(calls) == 3
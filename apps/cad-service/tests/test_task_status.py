@@ -0,0 +1,65 @@
+"""
+Tests for bulk and long-poll task status lookups against the result backend.
+"""
+import asyncio
+import time
+
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+
+from celery import states
+
+from app.workers.celery import celery_app
+from app.workers.task_status import (
+    fetch_task_metas,
+    summarize_task_meta,
+    task_meta_key,
+    wait_for_task_meta,
+)
+
+
+def encoded(result, state=states.SUCCESS):
+    backend = celery_app.backend
+    return backend.encode(backend._get_result_meta(result, state, None, None))
+
+
+async def store(client, task_id, result, state=states.SUCCESS):
+    # Mirrors RedisBackend._set: store the meta, then publish it on the same key
+    value = encoded(result, state)
+    await client.set(task_meta_key(task_id), value)
+    await client.publish(task_meta_key(task_id), value)
+
+
+class TestTaskStatus:
+    def test_bulk_lookup_resolves_all_ids(self):
+        async def scenario():
+            client = fakeredis.aioredis.FakeRedis()
+            await store(client, "done", {"file_id": "a", "metrics": {}})
+            await store(client, "bad", {"error": "unsupported format"})
+            return await fetch_task_metas(["done", "bad", "pending", "done"], client=client)
+
+        metas = asyncio.run(scenario())
+        assert list(metas) == ["done", "bad", "pending"]
+        summary = {task_id: summarize_task_meta(meta) for task_id, meta in metas.items()}
+        assert summary["done"] == {"status": "SUCCESS", "result": {"file_id": "a", "metrics": {}}}
+        assert summary["bad"] == {"status": "SUCCESS", "error": "unsupported format"}
+        assert summary["pending"] == {"status": "PENDING"}
+
+    def test_long_poll_returns_when_result_is_published(self):
+        async def scenario():
+            client = fakeredis.aioredis.FakeRedis()
+            waiter = asyncio.create_task(wait_for_task_meta("t1", 10, client=client))
+            await asyncio.sleep(0.2)
+            await store(client, "t1", {"file_id": "a", "metrics": {}})
+            started = time.monotonic()
+            meta = await waiter
+            return meta, time.monotonic() - started
+
+        meta, waited = asyncio.run(scenario())
+        assert meta["status"] == states.SUCCESS
+        assert waited < 5
+
+    def test_long_poll_times_out_while_pending(self):
+        client = fakeredis.aioredis.FakeRedis()
+        assert asyncio.run(wait_for_task_meta("never", 0.3, client=client)) is None
@@ -0,0 +1,64 @@
+"""
+Tests for the triangle-budget tessellation planner.
+"""
+import numpy as np
+import pytest
+
+from app.core.tessellation import (
+    COARSE_ANGULAR_DEFLECTION,
+    COARSE_DEFLECTION_RATIO,
+    MIN_DEFLECTION_RATIO,
+    plan_tessellation,
+    triangulation_arrays,
+)
+
+
+class TestPlanTessellation:
+    def test_refines_curved_faces_to_the_budget(self):
+        plan = plan_tessellation(100.0, curved_triangles=2_000, flat_triangles=1_000, budget=11_000)
+
+        coarse = 100.0 * COARSE_DEFLECTION_RATIO
+        assert plan.linear_deflection == pytest.approx(coarse / 5)
+        assert plan.estimated_triangles == 11_000
+        assert plan.angular_deflection < COARSE_ANGULAR_DEFLECTION
+
+    def test_deflection_scales_with_part_size(self):
+        pin = plan_tessellation(7.0, curved_triangles=2_000, flat_triangles=100, budget=50_000)
+        weldment = plan_tessellation(2_800.0, curved_triangles=2_000, flat_triangles=100, budget=50_000)
+
+        assert weldment.linear_deflection / pin.linear_deflection == pytest.approx(400.0)
+        assert weldment.estimated_triangles == pin.estimated_triangles
+
+    def test_over_budget_coarse_pass_is_kept(self):
+        plan = plan_tessellation(100.0, curved_triangles=80_000, flat_triangles=30_000, budget=100_000)
+        assert plan.linear_deflection == pytest.approx(100.0 * COARSE_DEFLECTION_RATIO)
+        assert plan.angular_deflection == COARSE_ANGULAR_DEFLECTION
+        assert plan.estimated_triangles == 110_000
+
+    def test_refinement_stops_at_the_finest_deflection(self):
+        plan = plan_tessellation(100.0, curved_triangles=10, flat_triangles=0, budget=10_000_000)
+        assert plan.linear_deflection == pytest.approx(100.0 * MIN_DEFLECTION_RATIO)
+        assert plan.estimated_triangles < 10_000_000
+
+        capped = plan_tessellation(100.0, curved_triangles=10, flat_triangles=0, budget=10_000_000, finest=0.05)
+        assert capped.linear_deflection == pytest.approx(0.05)
+
+
+class TestTriangulationArrays:
+    def test_box_face_ids_cover_each_face(self):
+        pytest.importorskip("OCC.Core.BRepPrimAPI")
+        from OCC.Core.BRepMesh import BRepMesh_IncrementalMesh
+        from OCC.Core.BRepPrimAPI import BRepPrimAPI_MakeBox
+
+        shape = BRepPrimAPI_MakeBox(10.0, 20.0, 30.0).Shape()
+        BRepMesh_IncrementalMesh(shape, 0.5, False, 0.5, True).Perform()
+
+        vertices, faces, face_ids = triangulation_arrays(shape)
+
+        assert len(vertices) == 8
+        assert len(faces) == len(face_ids) == 12
+        assert sorted(set(face_ids.tolist())) == [1, 2, 3, 4, 5, 6]
+        for face_id in range(1, 7):
+            corners = vertices[faces[face_ids == face_id]].reshape(-1, 3)
+            # Every box face is flat: one coordinate is constant across its triangles
+            assert (np.ptp(corners, axis=0) == 0).sum() == 1
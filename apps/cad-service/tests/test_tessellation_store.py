@@ -0,0 +1,96 @@
+"""
+Tests for the shared tessellation store: reuse, decimation and planning from stored stats.
+"""
+import numpy as np
+import pytest
+
+trimesh = pytest.importorskip("trimesh")
+
+from app.core.tessellation import plan_tessellation
+from app.utils.artifact_cache import ArtifactCache, FilesystemBackend
+from app.utils.tessellation_store import Tessellation, TessellationStore
+
+
+def box_tessellation(linear, angular=0.1):
+    mesh = trimesh.creation.box()
+    for _ in range(4):
+        mesh = mesh.subdivide()  # 3,072 triangles
+    # One B-rep face per side of the box
+    axis = np.argmax(np.abs(mesh.face_normals), axis=1)
+    face_ids = (axis * 2 + (mesh.face_normals.sum(axis=1) > 0) + 1).astype(np.int32)
+    return Tessellation(np.asarray(mesh.vertices), np.asarray(mesh.faces), face_ids, linear, angular)
+
+
+@pytest.fixture
+def store(tmp_path):
+    return TessellationStore(ArtifactCache(tmp_path))
+
+
+class TestTessellationStore:
+    def test_round_trip_is_compact(self, store):
+        stored = box_tessellation(0.01)
+        store.put("sha", stored)
+        hit = store.lookup("sha", 0.01, 0.1)
+
+        assert np.array_equal(hit.faces, stored.faces)
+        assert np.array_equal(hit.face_ids, stored.face_ids)
+        assert np.allclose(hit.vertices, stored.vertices, atol=1e-5)
+        npz_bytes = sum(p.stat().st_size for p in store.cache.root.glob("*.npz"))
+        assert npz_bytes < stored.vertices.nbytes + stored.faces.nbytes
+
+    def test_finer_requests_miss(self, store):
+        store.put("sha", box_tessellation(0.01))
+        assert store.lookup("sha", 0.005, 0.1) is None
+        assert store.lookup("sha", 0.01, 0.05) is None
+        assert store.lookup("other", 0.01, 0.1) is None
+
+    def test_much_coarser_requests_are_decimated_and_stored(self, store):
+        stored = box_tessellation(0.01)
+        store.put("sha", stored)
+
+        coarse = store.lookup("sha", 0.1, 0.2)
+
+        assert coarse.linear_deflection == 0.1
+        assert len(coarse.faces) <= len(stored.faces) // 10
+        assert set(coarse.face_ids.tolist()) == set(range(1, 7))
+        # Every vertex stays on the box surface
+        assert np.allclose(np.abs(coarse.vertices).max(axis=1), 0.5)
+        assert [(e["linear_deflection"], e["derived"]) for e in store.read_index("sha")["entries"]] == [(0.01, False), (0.1, True)]
+
+    def test_decimated_entries_are_not_served_when_disallowed(self, store):
+        store.put("sha", box_tessellation(0.01))
+        store.lookup("sha", 0.1, 0.2)
+
+        exact = store.lookup("sha", 0.1, 0.2, allow_decimated=False)
+
+        assert not exact.derived
+        assert exact.linear_deflection == 0.01 and len(exact.faces) == 3_072
+
+    def test_concurrent_writers_keep_each_others_entries(self, tmp_path):
+        shared = FilesystemBackend(tmp_path / "shared")
+        replica_a = TessellationStore(ArtifactCache(tmp_path / "a", shared=shared))
+        replica_b = TessellationStore(ArtifactCache(tmp_path / "b", shared=shared))
+        # Both read the file's index before either writes
+        replica_a.read_index("sha"), replica_b.read_index("sha")
+
+        replica_a.put("sha", box_tessellation(0.01))
+        replica_b.put("sha", box_tessellation(0.02))
+
+        for store in (replica_a, replica_b):
+            assert [e["linear_deflection"] for e in store.read_index("sha")["entries"]] == [0.01, 0.02]
+
+    def test_budget_requests_are_planned_from_stored_stats(self, store):
+        diagonal, curved, flat = 1.73, 300, 0
+        plan = plan_tessellation(diagonal, curved, flat, budget=3_000)
+        plan.triangles = 3_072
+        store.put("sha", box_tessellation(plan.linear_deflection, plan.angular_deflection), plan)
+
+        def load_shape():
+            raise AssertionError("the shape should not be loaded")
+
+        tessellation, info = store.tessellate("sha", load_shape, 3_000)
+        assert info["source"] == "store"
+        assert len(tessellation.faces) == 3_072
+
+        smaller, info = store.tessellate("sha", load_shape, 1_000)
+        assert len(smaller.faces) <= 1_000
@@ -0,0 +1,126 @@
+"""
+Tests for the webhook outbox: signing, batching, retries and dead-lettering.
+"""
+import asyncio
+import hashlib
+import hmac
+import json
+
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+httpx = pytest.importorskip("httpx")
+
+from app.workers.webhooks import (
+    DEAD_KEY,
+    INFLIGHT_KEY,
+    LEASE_KEY,
+    OUTBOX_KEY,
+    RETRY_KEY,
+    WebhookDispatcher,
+    enqueue_webhook,
+)
+
+
+class Receiver:
+    def __init__(self, status=200):
+        self.status = status
+        self.requests = []
+
+    def __call__(self, request):
+        self.requests.append(request)
+        return httpx.Response(self.status)
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def dispatch(receiver, raws, **kwargs):
+    redis = fakeredis.aioredis.FakeRedis()
+    for raw in raws:
+        await redis.lpush(OUTBOX_KEY, raw)
+    dispatcher = WebhookDispatcher(
+        redis, httpx.AsyncClient(transport=httpx.MockTransport(receiver)), **kwargs
+    )
+    try:
+        await dispatcher.drain_once()
+    finally:
+        await dispatcher.aclose()
+    return redis, dispatcher
+
+
+def queued(*payloads, url="https://hooks.example/cad"):
+    sync = fakeredis.FakeRedis()
+    for payload in payloads:
+        assert enqueue_webhook(url, payload, client=sync)
+    return list(reversed(sync.lrange(OUTBOX_KEY, 0, -1)))
+
+
+class TestWebhookDispatcher:
+    def test_signature_covers_exact_body(self, monkeypatch):
+        monkeypatch.setenv("GEOMETRY_WEBHOOK_SECRET", "s3cret")
+        receiver = Receiver()
+        redis, dispatcher = run(dispatch(receiver, queued({"part_id": "p1", "metrics": {"volume": 1.5}})))
+
+        (request,) = receiver.requests
+        expected = hmac.new(b"s3cret", request.content, hashlib.sha256).hexdigest()
+        assert request.headers["X-CAD-Webhook-Signature"] == f"sha256={expected}"
+        assert json.loads(request.content)["part_id"] == "p1"
+        assert dispatcher.delivered == 1
+        assert run(redis.llen(INFLIGHT_KEY)) == 0
+
+    def test_batches_entries_for_same_receiver(self):
+        receiver = Receiver()
+        raws = queued(*({"part_id": f"p{i}"} for i in range(5)))
+        run(dispatch(receiver, raws, batch_max=3))
+
+        assert [r.headers.get("X-CAD-Webhook-Batch") for r in receiver.requests] == ["3", "2"]
+        parts = [p["part_id"] for r in receiver.requests for p in json.loads(r.content)["batch"]]
+        assert sorted(parts) == [f"p{i}" for i in range(5)]
+
+    def test_failed_delivery_is_scheduled_for_retry(self):
+        redis, dispatcher = run(dispatch(Receiver(status=503), queued({"part_id": "p1"})))
+
+        retries = run(redis.zrange(RETRY_KEY, 0, -1))
+        assert len(retries) == 1
+        assert json.loads(retries[0])["attempts"] == 1
+        assert dispatcher.failed == 1
+        assert run(redis.llen(INFLIGHT_KEY)) == 0
+
+    def test_exhausted_entries_are_dead_lettered(self):
+        redis, _ = run(dispatch(Receiver(status=500), queued({"part_id": "p1"}), max_attempts=1))
+
+        assert run(redis.zcard(RETRY_KEY)) == 0
+        assert json.loads(run(redis.lindex(DEAD_KEY, 0)))["payload"] == {"part_id": "p1"}
+
+
+class TestDispatcherLease:
+    def test_only_lease_holder_recovers_and_delivers(self):
+        receiver = Receiver()
+
+        async def scenario():
+            redis = fakeredis.aioredis.FakeRedis()
+            await redis.lpush(INFLIGHT_KEY, *queued({"part_id": "left-in-flight"}))
+            http = httpx.AsyncClient(transport=httpx.MockTransport(receiver))
+            active = WebhookDispatcher(redis, http, lease_ttl=30)
+            standby = WebhookDispatcher(redis, http, lease_ttl=30)
+            assert await active.acquire_lease()
+            assert not await standby.acquire_lease()
+
+            task = asyncio.ensure_future(active.run_forever())
+            for _ in range(100):
+                if receiver.requests:
+                    break
+                await asyncio.sleep(0.01)
+            assert await redis.get(LEASE_KEY) == active.token.encode()
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+            assert await redis.get(LEASE_KEY) is None
+            # The lease is free again for a standby to take over
+            assert await standby.acquire_lease()
+            await http.aclose()
+
+        run(scenario())
+        assert [json.loads(r.content)["part_id"] for r in receiver.requests] == ["left-in-flight"]